@@ -0,0 +1,640 @@
+'''
+Asyncio fetching for the crawl of the college catalog.
+
+crawler.go overlaps page fetches with a thread per in-flight request;
+async_crawler.go keeps the requests in flight on one event loop instead,
+running in a thread of its own (EventLoopThread), and hands everything
+else to crawler.go through its fetch option: the crawl and its frontier,
+the parsing, checkpoints, incremental and duplicate-skipping modes, the
+index writers and the command line are crawler.py's, and pages are
+indexed in crawl order, so the index is byte for byte the one crawler.py
+writes with the same options.
+
+Pages are fetched through a transport: an object with
+
+    async get(url)  -> Response after redirects and retries (raises on
+                       connection errors)
+    async close()
+
+StreamTransport, the default, is a small HTTP/1.1 client over asyncio
+streams with keep-alive connections, requests' retry policy and HTTP_PROXY
+support (so it can crawl a mirror.py server); AiohttpTransport uses aiohttp
+when it is installed; SourceTransport answers from an in-process page
+source such as mirror.SyntheticCatalog, for tests. PoliteTransport wraps
+any of them in a scheduler.PoliteScheduler, which paces the requests to
+every host and follows its robots.txt; go does that by default.
+
+    python3 async_crawler.py [num_pages] [--concurrency 16] [--max-rate 10]
+'''
+# pylint: disable-msg=invalid-name
+
+import argparse
+import asyncio
+import collections
+import functools
+import itertools
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+import requests.structures
+import requests.utils
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import crawler
+import scheduler
+import util
+
+# requests in flight at once; like the per-host limit of the scheduler, so
+# the default crawl stays polite
+CONCURRENCY = scheduler.MAX_CONCURRENCY
+# as in requests
+MAX_REDIRECTS = 30
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+Response = collections.namedtuple("Response", ["url", "status", "headers", "body"])
+
+
+def as_request(response):
+    '''
+    Wrap a transport Response in a requests.Response, decoded the way
+    requests decodes it, so util.read_request reads it.
+    '''
+    request = requests.Response()
+    request.url = response.url
+    request.status_code = response.status
+    request.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    request.encoding = requests.utils.get_encoding_from_headers(request.headers)
+    # pylint: disable=protected-access
+    request._content = response.body
+    return request
+
+
+async def retrying(send, url, retries=util.MAX_RETRIES,
+                   backoff_factor=util.BACKOFF_FACTOR):
+    '''
+    Call send(url) until it neither fails to connect nor answers with one
+    of util.RETRY_STATUSES, at most retries more times, sleeping
+    backoff_factor * 2 ** (retry - 1) seconds between attempts (the retry
+    policy of util.make_session).
+    '''
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_factor * 2 ** (attempt - 1))
+        try:
+            response = await send(url)
+        except (OSError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+            continue
+        if response.status not in util.RETRY_STATUSES or attempt == retries:
+            return response
+    return response
+
+
+class StreamTransport:
+    '''
+    HTTP/1.1 client over asyncio streams. Keeps up to pool_size idle
+    connections per host alive for reuse, follows redirects, retries like
+    util.make_session and sends http:// requests through the HTTP_PROXY of
+    the environment (https:// is always fetched directly).
+
+    Inputs:
+        pool_size: idle connections kept open per host
+        timeout: seconds to wait for each attempt at a request
+        retries, backoff_factor: see retrying
+        ssl_context: the ssl.SSLContext of https connections
+    '''
+
+    def __init__(self, pool_size=CONCURRENCY, timeout=util.REQUEST_TIMEOUT,
+                 retries=util.MAX_RETRIES, backoff_factor=util.BACKOFF_FACTOR,
+                 ssl_context=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.user_agent = requests.utils.default_user_agent()
+        self._idle = collections.defaultdict(list)
+        self._proxies = {}
+
+    async def get(self, url):
+        '''
+        GET url, following redirects.
+
+        Outputs:
+            the final Response
+        '''
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await retrying(self._send, url, self.retries,
+                                      self.backoff_factor)
+            location = response.headers.get("Location")
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urllib.parse.urljoin(url, location)
+        raise ValueError("too many redirects: " + url)
+
+    async def close(self):
+        '''
+        Close the idle connections (the transport can still be used).
+        '''
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    def _proxy(self, url, scheme, host):
+        # the environment's proxy settings only change between crawls
+        if (scheme, host) not in self._proxies:
+            proxy = None
+            if scheme == "http":
+                proxy = requests.utils.get_environ_proxies(url).get("http")
+            self._proxies[scheme, host] = proxy
+        return self._proxies[scheme, host]
+
+    async def _send(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+            raise ValueError("cannot fetch " + url)
+        proxy = self._proxy(url, parts.scheme, parts.netloc)
+        if proxy is None:
+            address = (parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme],
+                       parts.scheme == "https")
+            target = urllib.parse.urlunsplit(("", "", parts.path or "/",
+                                              parts.query, ""))
+        else:
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            address = (proxy_parts.hostname, proxy_parts.port or 80, False)
+            target = urllib.parse.urlunsplit(parts._replace(fragment=""))
+        request = ("GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\n"
+                   "Accept: */*\r\nAccept-Encoding: identity\r\n\r\n").format(
+                       target, parts.netloc, self.user_agent).encode("latin-1")
+        while self._idle[address]:
+            # an idle connection the server has closed since fails here
+            # without an answer; try the next one
+            connection = self._idle[address].pop()
+            try:
+                return await self._exchange(url, address, connection, request)
+            except (OSError, asyncio.IncompleteReadError):
+                connection[1].close()
+            except BaseException:
+                connection[1].close()
+                raise
+        connection = await asyncio.wait_for(self._connect(address), self.timeout)
+        try:
+            return await self._exchange(url, address, connection, request)
+        except asyncio.IncompleteReadError as e:
+            connection[1].close()
+            raise ConnectionError("connection closed: " + url) from e
+        except BaseException:
+            connection[1].close()
+            raise
+
+    async def _connect(self, address):
+        host, port, secure = address
+        return await asyncio.open_connection(
+            host, port, ssl=self.ssl_context if secure else None)
+
+    async def _exchange(self, url, address, connection, request):
+        # like requests' timeout, self.timeout bounds each wait for the
+        # server rather than the whole exchange: pages parsed on the event
+        # loop meanwhile do not count against it
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                      self.timeout)
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        version, status = status_line.split(None, 2)[:2]
+        status = int(status)
+        headers = requests.structures.CaseInsensitiveDict()
+        for line in header_lines:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            name, value = name.strip(), value.strip()
+            headers[name] = (headers[name] + ", " + value if name in headers
+                             else value)
+        keep_alive = (version == "HTTP/1.1" and
+                      headers.get("Connection", "").lower() != "close")
+        if status in (204, 304) or 100 <= status < 200:
+            read_body = None
+        elif headers.get("Transfer-Encoding", "").lower() == "chunked":
+            read_body = read_chunked(reader)
+        elif "Content-Length" in headers:
+            read_body = reader.readexactly(int(headers["Content-Length"]))
+        else:
+            read_body = reader.read()
+            keep_alive = False
+        body = b""
+        if read_body is not None:
+            body = await asyncio.wait_for(read_body, self.timeout)
+        encoding = headers.get("Content-Encoding", "").lower()
+        if encoding in ("gzip", "deflate"):
+            # 47: a gzip or zlib header, detected automatically
+            body = zlib.decompress(body, 47)
+        if keep_alive and len(self._idle[address]) < self.pool_size:
+            self._idle[address].append(connection)
+        else:
+            writer.close()
+        return Response(url, status, headers, body)
+
+
+async def read_chunked(reader):
+    '''
+    Read a body sent with chunked transfer encoding.
+    '''
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if size == 0:
+            # trailers, up to the empty line
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return b"".join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+class AiohttpTransport:
+    '''
+    Transport sending requests with aiohttp (which must be installed),
+    with the retry policy of util.make_session.
+
+    Inputs:
+        pool_size: the most connections open at once
+        timeout: seconds to wait for each attempt at a request
+        retries, backoff_factor: see retrying
+    '''
+
+    def __init__(self, pool_size=CONCURRENCY, timeout=util.REQUEST_TIMEOUT,
+                 retries=util.MAX_RETRIES, backoff_factor=util.BACKOFF_FACTOR):
+        if aiohttp is None:
+            raise ImportError("AiohttpTransport needs aiohttp installed")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._session = None
+
+    async def get(self, url):
+        '''
+        GET url, following redirects.
+
+        Outputs:
+            the final Response
+        '''
+        if self._session is None:
+            # the session belongs to the running event loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trust_env=True)
+        return await retrying(self._send, url, self.retries,
+                              self.backoff_factor)
+
+    async def close(self):
+        '''
+        Close the session (the next request opens a new one).
+        '''
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _send(self, url):
+        try:
+            async with self._session.get(url, auto_decompress=True) as r:
+                return Response(str(r.url), r.status,
+                                requests.structures.CaseInsensitiveDict(r.headers),
+                                await r.read())
+        except aiohttp.ClientError as e:
+            raise ConnectionError(str(e)) from e
+
+
+class SourceTransport:
+    '''
+    Transport answering from a page source, such as the ones mirror.py
+    serves, without any network: 200 with the page, or 404.
+
+    Inputs:
+        source: an object whose get(url) returns a page body or None
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.requests = 0
+
+    async def get(self, url):
+        '''
+        The Response of the source for url.
+        '''
+        self.requests += 1
+        body = self.source.get(url)
+        if body is None:
+            return Response(url, 404, {}, b"")
+        return Response(url, 200, {"Content-Type": "text/html; charset=utf-8"},
+                        body)
+
+    async def close(self):
+        '''
+        Nothing to close.
+        '''
+
+
+class PoliteTransport:
+    '''
+    Transport sending the requests of another through a
+    scheduler.PoliteScheduler, as scheduler.SchedulingAdapter does for a
+    requests.Session: every host's robots.txt is read once (disallowed
+    pages are answered with an empty 403), every request waits for its
+    host's rate and concurrency limits, and requests that fail to connect
+    or are answered with one of scheduler.BACKOFF_STATUSES are retried,
+    each attempt paced like any other request.
+
+    Inputs:
+        transport: the transport that sends the requests (which should not
+          retry them itself)
+        polite: the PoliteScheduler
+        retries, backoff_factor: see retrying
+    '''
+
+    def __init__(self, transport, polite, retries=util.MAX_RETRIES,
+                 backoff_factor=util.BACKOFF_FACTOR):
+        self.transport = transport
+        self.scheduler = polite
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        # notified whenever a request to the host finishes
+        self._conditions = collections.defaultdict(asyncio.Condition)
+        self._robots_lock = asyncio.Lock()
+
+    async def get(self, url):
+        '''
+        GET url once the scheduler lets it go out, following redirects.
+
+        Outputs:
+            the final Response
+        '''
+        state = await self._host(url)
+        if not self.scheduler.can_fetch(state, url):
+            self.scheduler.record_disallowed()
+            return Response(url, 403, {}, b"")
+        condition = self._conditions[scheduler.host_key(url)]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            await self._acquire(state, condition)
+            start = time.monotonic()
+            status = None
+            retry_after = None
+            try:
+                response = await self.transport.get(url)
+                status = response.status
+                retry_after = scheduler.parse_retry_after(
+                    response.headers.get("Retry-After"))
+            except (OSError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                continue
+            finally:
+                state.release(status, time.monotonic() - start, retry_after)
+                self.scheduler.record(status, start)
+                async with condition:
+                    condition.notify_all()
+            if status not in scheduler.BACKOFF_STATUSES or attempt == self.retries:
+                return response
+        return response
+
+    async def close(self):
+        '''
+        Close the transport the requests are sent with.
+        '''
+        await self.transport.close()
+
+    async def _host(self, url):
+        state = self.scheduler.known_host(url)
+        if state is None:
+            # the other requests wait for the rules of the new host
+            async with self._robots_lock:
+                state = self.scheduler.known_host(url)
+                if state is None:
+                    state = self.scheduler.add_host(
+                        url, await self._read_robots(url))
+        return state
+
+    async def _read_robots(self, url):
+        try:
+            response = await asyncio.wait_for(
+                self.transport.get(scheduler.robots_url(url)),
+                scheduler.ROBOTS_TIMEOUT)
+        except Exception:  # pylint: disable=broad-except
+            # no readable robots.txt means no restrictions
+            return ""
+        if response.status != 200:
+            return ""
+        return as_request(response).text
+
+    @staticmethod
+    async def _acquire(state, condition):
+        async with condition:
+            while True:
+                wait = state.try_acquire()
+                if wait == 0:
+                    return
+                try:
+                    await asyncio.wait_for(condition.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+
+TRANSPORTS = {"streams": StreamTransport, "aiohttp": AiohttpTransport}
+
+
+class EventLoopThread:
+    '''
+    An event loop running in a thread of its own, which the crawler's
+    threads hand coroutines to. Its submit makes it an executor for
+    crawler.bounded_map; use it as a context manager, or close it.
+    '''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run the coroutine func(*args, **kwargs) on the loop.
+
+        Outputs:
+            a concurrent.futures.Future of its result
+        '''
+        return asyncio.run_coroutine_threadsafe(func(*args, **kwargs),
+                                                self.loop)
+
+    def run(self, coroutine):
+        '''
+        Run coroutine on the loop and wait for its result.
+        '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        '''
+        Cancel the coroutines still running, then stop and close the loop.
+        '''
+        self.run(cancel_tasks())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def cancel_tasks():
+    '''
+    Cancel every other task of the running loop and wait for them to end.
+    '''
+    tasks = [task for task in asyncio.all_tasks()
+             if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def fetch_page(url, transport, crawl_metrics=None):
+    '''
+    Fetches the raw HTML of a webpage, like crawler.fetch_page.
+
+    Args:
+        url (str): The URL of the webpage to fetch.
+        transport: The transport to fetch with.
+        crawl_metrics (CrawlMetrics): Optional metrics to time the fetch with.
+
+    Returns:
+        bytes: The HTML of the page, or "" if the request fails.
+    '''
+    if not util.is_absolute_url(url):
+        return ""
+    start = time.perf_counter()
+    size = 0
+    try:
+        response = await transport.get(url)
+        size = len(response.body)
+    except Exception:  # pylint: disable=broad-except
+        # fail on any kind of error
+        return ""
+    finally:
+        if crawl_metrics is not None:
+            crawl_metrics.record("fetch", time.perf_counter() - start, url,
+                                 bytes=size)
+    if response.status in (403, 404):
+        return ""
+    return util.read_request(as_request(response))
+
+
+def fetch_pages(urls, loop, transport, concurrency=CONCURRENCY,
+                crawl_metrics=None):
+    '''
+    Fetches the given pages on an event loop, concurrency at a time: the
+    fetch of crawler.go (see crawler.fetch_pages) that async_crawler.go
+    crawls with.
+
+    Inputs:
+        urls: iterable of urls
+        loop: the EventLoopThread to fetch on
+        transport: the transport to fetch with
+        concurrency: the most requests in flight at once
+        crawl_metrics: optional metrics.CrawlMetrics to time the fetches with
+
+    Output:
+        iterator of (url, html) pairs in the order of urls, where html is ""
+          for pages that could not be fetched
+    '''
+    urls, fetched_urls = itertools.tee(urls)
+    fetch = functools.partial(fetch_page, transport=transport,
+                              crawl_metrics=crawl_metrics)
+    return zip(fetched_urls, crawler.bounded_map(loop, fetch, urls, concurrency,
+                                                 crawl_metrics, "fetch"))
+
+
+def go(num_pages_to_crawl, course_map_filename, index_filename, *,
+       concurrency=CONCURRENCY, transport=None, max_rate=scheduler.MAX_RATE,
+       **crawl_options):
+    '''
+    Crawl the college catalog, fetching on one event loop, and write the
+    index that crawler.go writes with the same options.
+
+    Inputs:
+        num_pages_to_crawl: the number of pages to process during the crawl
+        course_map_filename: the name of a JSON file that contains the mapping
+          course codes to course identifiers
+        index_filename: the name for the file of the index
+        concurrency: the most requests in flight at once
+        transport: the transport to fetch pages with (a StreamTransport
+          by default); it is closed at the end of the crawl, and should not
+          retry requests itself when max_rate is set
+        max_rate: if set, pace requests with a scheduler.PoliteScheduler
+          that sends at most max_rate requests per second to a host (see
+          PoliteTransport); None sends them as fast as concurrency allows
+        crawl_options: the other keyword options of crawler.go, but for
+          the ones of its sessions and processes (num_workers, which only
+          parses pages on threads here, may be set)
+
+    Outputs:
+        as crawler.go
+    '''
+    for option in ("cache_dir", "offline", "num_shards", "fetch"):
+        if option in crawl_options:
+            raise TypeError("async_crawler.go() does not take " + option)
+    polite = None
+    if transport is None:
+        transport = StreamTransport(
+            pool_size=concurrency,
+            retries=0 if max_rate is not None else util.MAX_RETRIES)
+    if max_rate is not None:
+        polite = scheduler.PoliteScheduler(max_rate=max_rate,
+                                           max_concurrency=concurrency)
+        transport = PoliteTransport(transport, polite)
+    with EventLoopThread() as loop:
+        try:
+            counts = crawler.go(num_pages_to_crawl, course_map_filename,
+                                index_filename, fetch=functools.partial(
+                                    fetch_pages, loop=loop, transport=transport,
+                                    concurrency=concurrency),
+                                **crawl_options)
+        finally:
+            loop.run(transport.close())
+    if polite is not None:
+        polite.report()
+    return counts
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python3 async_crawler.py")
+    crawler.add_crawl_arguments(arg_parser, max_rate=scheduler.MAX_RATE)
+    arg_parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                            help="most requests in flight at once")
+    arg_parser.add_argument("--transport", choices=sorted(TRANSPORTS),
+                            default="streams", help="HTTP client to fetch with")
+    args = arg_parser.parse_args()
+    index_filename, options = crawler.crawl_options(args, arg_parser)
+    # the scheduler retries paced requests itself
+    transport = TRANSPORTS[args.transport](
+        pool_size=args.concurrency,
+        retries=0 if options["max_rate"] is not None else util.MAX_RETRIES)
+
+    go(args.num_pages_to_crawl, "course_map.json", index_filename,
+       concurrency=args.concurrency, transport=transport, **options)
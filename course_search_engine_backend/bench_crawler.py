@@ -0,0 +1,428 @@
+'''
+Benchmarks for the crawler.
+
+Runs against pages stored on disk, either a page cache directory written
+by a crawl with CRAWLER_CACHE_DIR set or a directory of .html files, so
+no network is needed:
+
+    python3 bench_crawler.py parsers <page directory>
+    python3 bench_crawler.py tokenizer <page directory>
+    python3 bench_crawler.py links <page directory>
+    python3 bench_crawler.py blocks <page directory>
+
+The crawl benchmark runs whole crawls against a local mirror.py server,
+serving either a page cache directory or a synthetic catalog of the given
+number of pages:
+
+    python3 bench_crawler.py crawl <page cache directory | number of pages>
+'''
+# pylint: disable-msg=invalid-name
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import urllib.parse
+
+import async_crawler
+import crawler
+import mirror
+import util
+
+
+def load_pages(directory):
+    '''
+    Load the HTML of every stored page under directory.
+
+    Inputs:
+        directory: a page cache directory or a directory of .html files
+
+    Outputs:
+        list of page bodies (bytes)
+    '''
+    objects = os.path.join(directory, "objects")
+    cached = os.path.isdir(objects)
+    if cached:
+        directory = objects
+    pages = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            if cached and filename.endswith(".tmp"):
+                continue
+            if not cached and not filename.endswith(".html"):
+                continue
+            with open(os.path.join(root, filename), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def time_pages(func, pages, repeat=3):
+    '''
+    Apply func to every page, repeat times, and return the best rate in
+    pages per second together with the results of the last run.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(page) for page in pages]
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(pages) / best, results
+
+
+def report(title, rows):
+    '''
+    Print one line per (name, pages per second, matches baseline) row,
+    with the speedup relative to the first row.
+    '''
+    print(title)
+    base = rows[0][1]
+    for name, rate, same in rows:
+        print("  {:<16} {:>10.1f} pages/sec  {:>5.2f}x  {}".format(
+            name, rate, rate / base, "same output" if same else "DIFFERENT"))
+
+
+def bench_parsers(pages, course_map):
+    '''
+    Compare the PARSERS backends on parsing pages and extracting their
+    course blocks and links.
+    '''
+    limiting_domain = "classes.cs.uchicago.edu"
+    url = ("http://www.classes.cs.uchicago.edu/archive/2015/winter"
+           "/12200-1/new.collegecatalog.uchicago.edu/index.html")
+    rows = []
+    baseline = None
+    for name in crawler.PARSERS:
+        def index_page(html, name=name):
+            courses = crawler.course_info_from_soup(
+                crawler.parse_html(html, name, crawler.COURSE_STRAINER),
+                course_map)
+            links = crawler.extract_links(
+                crawler.parse_html(html, name, crawler.LINK_STRAINER),
+                url, limiting_domain)
+            return courses, links
+        try:
+            rate, results = time_pages(index_page, pages)
+        except Exception as e:  # pylint: disable=broad-except
+            print("  {:<16} unavailable ({})".format(name, e))
+            continue
+        if baseline is None:
+            baseline = results
+        rows.append((name, rate, results == baseline))
+    report("parse + extract, {} pages".format(len(pages)), rows)
+
+
+def legacy_extract_course_codes(title_text):
+    '''
+    extract_course_codes as it was before the tokenizer module.
+    '''
+    pattern = r'([A-Z]+)\s+((?:\d{5}(?:-\d{5})*))'
+    matches = re.finditer(pattern, title_text)
+    course_codes = []
+
+    for match in matches:
+        dept = match.group(1)
+        all_num = match.group(2)
+        num_list = all_num.split('-')
+        for num in num_list:
+            course_codes.append(f"{dept} {num}")
+    return course_codes
+
+
+def legacy_get_valid_words(text):
+    '''
+    get_valid_words as it was before the tokenizer module.
+    '''
+    text = text.lower()
+    words = set(re.findall(r'[a-z][a-z0-9_]*', text))
+    return words - crawler.INDEX_IGNORE
+
+
+def bench_tokenizer(pages, course_map):
+    '''
+    Compare tokenizing the course blocks of each page block by block with
+    the original functions, block by block with the tokenizer, and with
+    the tokenizer's batch API.
+    '''
+    page_blocks = [crawler.parse_course_blocks(html) for html in pages]
+
+    def legacy(blocks):
+        return [(legacy_extract_course_codes(title),
+                 legacy_get_valid_words(title + " " + descrip))
+                for title, descrip in blocks]
+
+    def per_block(blocks):
+        return [(crawler.extract_course_codes(title),
+                 crawler.get_valid_words(title + " " + descrip))
+                for title, descrip in blocks]
+
+    rows = []
+    baseline = None
+    for name, func in [("legacy", legacy), ("per block", per_block),
+                       ("batch", crawler.TOKENIZER.tokenize_blocks)]:
+        rate, results = time_pages(func, page_blocks, repeat=5)
+        if baseline is None:
+            baseline = results
+        rows.append((name, rate, results == baseline))
+    report("tokenize, {} blocks on {} pages".format(
+        sum(map(len, page_blocks)), len(pages)), rows)
+
+
+def legacy_convert_if_relative_url(current_url, new_url):
+    '''
+    util.convert_if_relative_url as it was before resolve_link.
+    '''
+    if new_url == "" or not util.is_absolute_url(current_url):
+        return None
+    if util.is_absolute_url(new_url):
+        return new_url
+    parsed_url = urllib.parse.urlparse(new_url)
+    path_parts = parsed_url.path.split("/")
+    if len(path_parts) == 0:
+        return None
+    ext = path_parts[0][-4:]
+    if ext in [".edu", ".org", ".com", ".net"]:
+        return "http://" + new_url
+    if new_url[:3] == "www":
+        return "http://" + new_url
+    return urllib.parse.urljoin(current_url, new_url)
+
+
+def legacy_is_url_ok_to_follow(url, limiting_domain):
+    '''
+    util.is_url_ok_to_follow as it was before the compiled rules.
+    '''
+    if "mailto:" in url or "@" in url:
+        return False
+    if url[:util.LEN_ARCHIVES] == util.ARCHIVES or \
+            url[:util.LEN_ARCHIVES_HTTP] == util.ARCHIVES_HTTP:
+        return False
+    parsed_url = urllib.parse.urlparse(url)
+    if parsed_url.scheme != "http" and parsed_url.scheme != "https":
+        return False
+    if parsed_url.netloc == "" or parsed_url.fragment != "" or \
+            parsed_url.query != "":
+        return False
+    loc = parsed_url.netloc
+    ld = len(limiting_domain)
+    trunc_loc = loc[-(ld+1):]
+    if not (limiting_domain == loc or (trunc_loc == "." + limiting_domain)):
+        return False
+    ext = os.path.splitext(parsed_url.path)[1]
+    return ext == "" or ext == ".html"
+
+
+def load_page_urls(directory):
+    '''
+    The URLs of the pages load_pages(directory) returns, in the same
+    order: the URLs they were recorded for in a page cache (the first
+    one, for a body cached under several), and for .html files their path
+    under the catalog.
+    '''
+    objects = os.path.join(directory, "objects")
+    if os.path.isdir(objects):
+        conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"))
+        digest_urls = {}
+        for url, digest in conn.execute("SELECT url, digest FROM pages"
+                                        " ORDER BY url"):
+            digest_urls.setdefault(digest, url)
+        conn.close()
+        directory = objects
+    urls = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            if os.path.isdir(objects):
+                if not filename.endswith(".tmp"):
+                    urls.append(digest_urls.get(filename, mirror.CATALOG_URL +
+                                                filename))
+            elif filename.endswith(".html"):
+                urls.append(mirror.CATALOG_URL + os.path.relpath(
+                    os.path.join(root, filename), directory))
+    return urls
+
+
+def bench_links(pages, course_map, urls):
+    '''
+    Compare resolving and filtering the links of every page with the
+    original functions and with util.resolve_link, as a crawl does: each
+    page once, at its own URL, starting from an empty cache.
+    '''
+    del course_map
+    limiting_domain = "classes.cs.uchicago.edu"
+    page_hrefs = []
+    for url, html in zip(urls, pages):
+        soup = crawler.parse_html(html, parse_only=crawler.LINK_STRAINER)
+        page_hrefs.append((url, [link.get('href') for link in soup.find_all('a')
+                                 if link.get('href')]))
+
+    def legacy(page):
+        url, hrefs = page
+        links = set()
+        for href in hrefs:
+            absolute_url = legacy_convert_if_relative_url(url, href)
+            if absolute_url and legacy_is_url_ok_to_follow(absolute_url,
+                                                           limiting_domain):
+                links.add(absolute_url)
+        return links
+
+    def resolved(page):
+        url, hrefs = page
+        links = set()
+        for href in hrefs:
+            absolute_url = util.resolve_link(url, href, limiting_domain)
+            if absolute_url:
+                links.add(absolute_url)
+        return links
+
+    def crawl(func):
+        def run(_):
+            util.resolve_link_from.cache_clear()
+            util.page_directory.cache_clear()
+            return [func(page) for page in page_hrefs]
+        return run
+
+    rows = []
+    baseline = None
+    for name, func in [("legacy", legacy), ("resolve_link", resolved)]:
+        # one crawl of all the pages per run
+        rate, (results,) = time_pages(crawl(func), [None], repeat=5)
+        if baseline is None:
+            baseline = results
+        rows.append((name, rate * len(pages), results == baseline))
+    report("resolve + filter, {} links on {} pages".format(
+        sum(len(hrefs) for _, hrefs in page_hrefs), len(pages)), rows)
+    print("  resolve_link cache: {}".format(util.resolve_link_from.cache_info()))
+
+
+def legacy_course_blocks(soup):
+    '''
+    crawler.course_blocks as it was before the linear traversal.
+    '''
+    blocks = []
+    for block in soup.find_all('div', class_=crawler.COURSEBLOCK_CLASSES):
+        title_tag = block.find('p', class_='courseblocktitle')
+        descrip_tag = block.find('p', class_='courseblockdesc')
+        blocks.append((title_tag.get_text(strip=True),
+                       descrip_tag.get_text(strip=True)))
+    return blocks
+
+
+def bench_blocks(pages, course_map):
+    '''
+    Compare extracting the course blocks of parsed pages with find_all
+    and with crawler.course_blocks' single traversal, on full and on
+    strained parse trees.
+    '''
+    del course_map
+    for parser in ("html.parser", "strained"):
+        soups = [crawler.parse_html(html, parser, crawler.COURSE_STRAINER)
+                 for html in pages]
+        rows = []
+        baseline = None
+        for name, func in [("find_all", legacy_course_blocks),
+                           ("linear", crawler.course_blocks)]:
+            rate, results = time_pages(func, soups, repeat=5)
+            if baseline is None:
+                baseline = results
+            rows.append((name, rate, results == baseline))
+        report("course blocks, {} tree, {} pages".format(parser, len(pages)),
+               rows)
+
+
+# more pages than any catalog has, so crawls stop when the catalog does
+CRAWL_BUDGET = 10 ** 7
+
+CRAWL_CONFIGS = [
+    ("serial", crawler.go, {}),
+    ("8 workers", crawler.go, {"num_workers": 8}),
+    ("pipeline", crawler.go, {"num_workers": 8, "parse_processes": 2}),
+    ("4 shards", crawler.go, {"num_workers": 4, "num_shards": 4}),
+    ("asyncio", async_crawler.go, {"concurrency": 1000, "max_rate": None}),
+]
+
+
+def bench_crawl(location, course_map_filename):
+    '''
+    Compare crawler.go configurations and async_crawler.go on full crawls
+    of a local mirror of the catalog: a page cache directory, or a
+    synthetic catalog when location is a number of pages.
+    '''
+    if location.isdigit():
+        with open(course_map_filename) as f:
+            source = mirror.SyntheticCatalog(int(location), json.load(f))
+    else:
+        source = mirror.SnapshotSource(location)
+    server = mirror.MirrorServer(source, 0).start()
+    proxy = os.environ.get("HTTP_PROXY")
+    # crawler processes inherit the proxy too
+    os.environ["HTTP_PROXY"] = server.url
+    output_dir = tempfile.mkdtemp(prefix="bench")
+    rows = []
+    baseline = None
+    try:
+        for name, go, options in CRAWL_CONFIGS:
+            index_filename = os.path.join(output_dir, "index.csv")
+            served = server.requests
+            start = time.perf_counter()
+            go(CRAWL_BUDGET, course_map_filename, index_filename, **options)
+            elapsed = time.perf_counter() - start
+            with open(index_filename) as f:
+                index = sorted(f)
+            if baseline is None:
+                baseline = index
+                pages = server.requests - served
+            rows.append((name, (server.requests - served) / elapsed,
+                         index == baseline))
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+        if proxy is None:
+            del os.environ["HTTP_PROXY"]
+        else:
+            os.environ["HTTP_PROXY"] = proxy
+    report("crawl, {} pages from {} ({} rows)".format(
+        pages, server.url, len(baseline)), rows)
+
+
+# benchmarks that take the location of a catalog instead of its pages
+CRAWL_BENCHMARKS = {
+    "crawl": bench_crawl,
+}
+
+BENCHMARKS = {
+    "parsers": bench_parsers,
+    "tokenizer": bench_tokenizer,
+    "blocks": bench_blocks,
+}
+
+# benchmarks that also take the URLs of the pages (see load_page_urls)
+URL_BENCHMARKS = {
+    "links": bench_links,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python3 bench_crawler.py")
+    arg_parser.add_argument("benchmark",
+                            choices=sorted(BENCHMARKS) + sorted(URL_BENCHMARKS) +
+                            sorted(CRAWL_BENCHMARKS))
+    arg_parser.add_argument("pages", help="page cache or .html directory (or"
+                                          " number of synthetic pages to crawl)")
+    arg_parser.add_argument("--course-map", default="course_map.json")
+    args = arg_parser.parse_args()
+
+    if args.benchmark in CRAWL_BENCHMARKS:
+        CRAWL_BENCHMARKS[args.benchmark](args.pages, args.course_map)
+    else:
+        with open(args.course_map) as f:
+            course_map = json.load(f)
+        if args.benchmark in URL_BENCHMARKS:
+            URL_BENCHMARKS[args.benchmark](load_pages(args.pages), course_map,
+                                           load_page_urls(args.pages))
+        else:
+            BENCHMARKS[args.benchmark](load_pages(args.pages), course_map)
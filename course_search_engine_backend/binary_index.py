@@ -0,0 +1,199 @@
+'''
+Binary inverted index, a compact alternative to the pipe-delimited CSV.
+
+File layout (all integers little-endian):
+
+    header      MAGIC, version (uint32), number of terms (uint32),
+                offset of the term strings (uint64),
+                offset of the posting lists (uint64)
+    term table  one fixed-size TERM_ENTRY per term, sorted by term:
+                term offset (uint64), term length (uint32),
+                postings offset (uint64), number of postings (uint32)
+    terms       the UTF-8 bytes of every term, back to back
+    postings    for every term, its sorted course ids as varints, each
+                stored as the difference from the previous id
+
+Because the term table has fixed-size entries, BinaryIndex can binary
+search it straight out of a memory map, so opening the index reads
+nothing and a lookup only decodes the posting list it needs.
+'''
+# pylint: disable-msg=invalid-name
+
+import mmap
+import struct
+
+MAGIC = b"CIDX"
+VERSION = 1
+HEADER = struct.Struct("<4sIIQQ")
+TERM_ENTRY = struct.Struct("<QIQI")
+
+
+def encode_varint(n, out):
+    '''
+    Append the unsigned LEB128 encoding of n to the bytearray out.
+    '''
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_postings(buf, offset, count):
+    '''
+    Decode count delta/varint encoded course ids starting at offset.
+
+    Outputs:
+        list of course ids in increasing order
+    '''
+    ids = []
+    course_id = 0
+    for _ in range(count):
+        delta = 0
+        shift = 0
+        while True:
+            byte = buf[offset]
+            offset += 1
+            delta |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        course_id += delta
+        ids.append(course_id)
+    return ids
+
+
+class BinaryIndexWriter:
+    '''
+    Collects (course_id, word) pairs and writes them as a binary index
+    when closed.
+
+    Inputs:
+        filename: the name of the index file
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.postings = {}
+
+    def add(self, course_id, word):
+        '''
+        Add one (course_id, word) pair to the index.
+        '''
+        self.postings.setdefault(word, set()).add(course_id)
+
+    def close(self):
+        '''
+        Write the index file.
+        '''
+        write_binary_index(self.postings, self.filename)
+
+
+def write_binary_index(postings, filename):
+    '''
+    Write a binary index.
+
+    Inputs:
+        postings: dictionary {word: iterable of course ids}
+        filename: the name of the index file
+    '''
+    terms = sorted(postings)
+    term_table = bytearray()
+    term_blob = bytearray()
+    posting_blob = bytearray()
+    for term in terms:
+        encoded = term.encode("utf-8")
+        ids = sorted(postings[term])
+        term_table += TERM_ENTRY.pack(len(term_blob), len(encoded),
+                                      len(posting_blob), len(ids))
+        term_blob += encoded
+        previous = 0
+        for course_id in ids:
+            encode_varint(course_id - previous, posting_blob)
+            previous = course_id
+    terms_offset = HEADER.size + len(term_table)
+    postings_offset = terms_offset + len(term_blob)
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(terms), terms_offset,
+                            postings_offset))
+        f.write(term_table)
+        f.write(term_blob)
+        f.write(posting_blob)
+
+
+class BinaryIndex:
+    '''
+    Read-only, memory-mapped view of a binary index.
+
+    Inputs:
+        filename: the name of the index file
+    '''
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._num_terms, self._terms_offset, \
+            self._postings_offset = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self._buf.close()
+            raise ValueError("{} is not a binary index".format(filename))
+
+    def __len__(self):
+        return self._num_terms
+
+    def _entry(self, i):
+        term_offset, term_len, postings_offset, count = \
+            TERM_ENTRY.unpack_from(self._buf, HEADER.size + i * TERM_ENTRY.size)
+        start = self._terms_offset + term_offset
+        return (self._buf[start:start + term_len],
+                self._postings_offset + postings_offset, count)
+
+    def _find(self, word):
+        key = word.encode("utf-8")
+        lo, hi = 0, self._num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._num_terms and self._entry(lo)[0] == key:
+            return lo
+        return None
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+    def lookup(self, word):
+        '''
+        Returns the sorted list of course ids whose index contains word
+        (empty if the word is not in the index).
+        '''
+        i = self._find(word)
+        if i is None:
+            return []
+        _, offset, count = self._entry(i)
+        return decode_postings(self._buf, offset, count)
+
+    def terms(self):
+        '''
+        Generates every term of the index in sorted order.
+        '''
+        for i in range(self._num_terms):
+            yield self._entry(i)[0].decode("utf-8")
+
+    def pairs(self):
+        '''
+        Generates every (course_id, word) pair of the index, ordered by
+        word and then by course id.
+        '''
+        for i in range(self._num_terms):
+            term, offset, count = self._entry(i)
+            word = term.decode("utf-8")
+            for course_id in decode_postings(self._buf, offset, count):
+                yield course_id, word
+
+    def close(self):
+        '''
+        Unmap the index file.
+        '''
+        self._buf.close()
@@ -0,0 +1,127 @@
+'''
+Checkpoints for long crawls.
+
+A Checkpoint keeps, in a SQLite file in its own directory, everything a
+crawl needs to pick up where it stopped: the pages it is going to index,
+how many of them are already in the index, how long the index file was at
+that point, and the (course_id, word) pairs written so far (so resumed
+pages do not emit them again).
+'''
+# pylint: disable-msg=invalid-name
+
+import os
+import shutil
+import sqlite3
+
+# pages indexed between two checkpoints
+CHECKPOINT_EVERY = 50
+CHECKPOINT_FILENAME = "checkpoint.sqlite3"
+# saved pages read from the checkpoint at a time
+PAGES_CHUNK = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (position INTEGER PRIMARY KEY, url TEXT);
+CREATE TABLE IF NOT EXISTS pairs (course_id INTEGER, word TEXT);
+CREATE TABLE IF NOT EXISTS progress (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    pages_done INTEGER,
+    index_offset INTEGER
+);
+"""
+
+
+def exists(directory):
+    '''
+    Is there a checkpoint in directory to resume from?
+    '''
+    return os.path.isfile(os.path.join(directory, CHECKPOINT_FILENAME))
+
+
+class Checkpoint:
+    '''
+    Saved state of one crawl.
+
+    Inputs:
+        directory: where the checkpoint is kept (created if needed)
+        every: the number of pages between two saves
+    '''
+
+    def __init__(self, directory, every=CHECKPOINT_EVERY):
+        self.directory = directory
+        self.every = every
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, CHECKPOINT_FILENAME))
+        self.db.executescript(SCHEMA)
+
+    def has_pages(self):
+        '''
+        Were the pages to index saved (the crawl finished collecting them)?
+        '''
+        return self.db.execute("SELECT 1 FROM pages LIMIT 1").fetchone() \
+            is not None
+
+    def pages(self):
+        '''
+        Yields the saved pages to index in order, reading PAGES_CHUNK of
+        them at a time.
+        '''
+        position = 0
+        while True:
+            chunk = self.db.execute(
+                "SELECT position, url FROM pages WHERE position >= ?"
+                " ORDER BY position LIMIT ?", (position, PAGES_CHUNK)).fetchall()
+            if not chunk:
+                return
+            yield from (url for _, url in chunk)
+            position = chunk[-1][0] + 1
+
+    def save_pages(self, pages_to_crawl):
+        '''
+        Save the pages the crawl is going to index (any iterable, written
+        as it is consumed).
+        '''
+        self.db.execute("DELETE FROM pages")
+        self.db.executemany("INSERT INTO pages VALUES (?, ?)",
+                            enumerate(pages_to_crawl))
+        self.db.execute("DELETE FROM pairs")
+        self.db.execute("DELETE FROM progress")
+        self.db.commit()
+
+    def progress(self):
+        '''
+        Returns the pair (number of pages already indexed, length of the
+        index file when they were), or None if nothing was saved yet.
+        '''
+        return self.db.execute(
+            "SELECT pages_done, index_offset FROM progress").fetchone()
+
+    def pairs(self):
+        '''
+        Returns the set of (word, course_id) pairs already in the index.
+        '''
+        return {(word, course_id) for course_id, word in
+                self.db.execute("SELECT course_id, word FROM pairs")}
+
+    def save_progress(self, pages_done, index_offset, new_pairs):
+        '''
+        Record that pages_done pages are indexed, in an index file of
+        index_offset bytes, adding new_pairs ((course_id, word) pairs
+        written since the last save) to the saved pairs.
+        '''
+        self.db.executemany("INSERT INTO pairs VALUES (?, ?)", new_pairs)
+        self.db.execute("INSERT OR REPLACE INTO progress VALUES (0, ?, ?)",
+                        (pages_done, index_offset))
+        self.db.commit()
+
+    def remove(self):
+        '''
+        Delete the checkpoint once the crawl has finished.
+        '''
+        self.db.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def close(self):
+        '''
+        Close the checkpoint, keeping it on disk.
+        '''
+        self.db.close()
@@ -0,0 +1,61 @@
+'''
+Fixtures for the crawler tests that run without the network: a mirror.py
+server for a small synthetic catalog, set as the HTTP proxy, so crawler.go
+crawls it at the catalog's URLs.
+'''
+# pylint: skip-file
+
+import json
+import os
+
+import pytest
+
+import mirror
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+COURSE_MAP_FILENAME = os.path.join(TEST_DIR, "course_map.json")
+# start page, 1 area page and 38 program pages
+SYNTHETIC_PAGES = 40
+
+
+class EditableSource:
+    '''
+    A page source that answers like another one, except for the pages
+    given a body of their own (None for a 404).
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.pages = {}
+
+    def get(self, url):
+        if url in self.pages:
+            return self.pages[url]
+        return self.source.get(url)
+
+
+@pytest.fixture
+def course_map():
+    with open(COURSE_MAP_FILENAME) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def catalog(course_map):
+    return mirror.SyntheticCatalog(SYNTHETIC_PAGES, course_map)
+
+
+@pytest.fixture
+def catalog_server(catalog, monkeypatch):
+    '''
+    A MirrorServer for the synthetic catalog, answering every http://
+    request of the test; its source is an EditableSource.
+    '''
+    server = mirror.MirrorServer(EditableSource(catalog), port=0).start()
+    for name in ("http_proxy", "HTTP_PROXY"):
+        monkeypatch.setenv(name, server.url)
+    for name in ("no_proxy", "NO_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -5,13 +5,30 @@ Yolanda Pan
 # DO NOT REMOVE THESE LINES OF CODE
 # pylint: disable-msg=invalid-name, redefined-outer-name, unused-argument, unused-variable
 
-import queue
+import contextlib
 import json
-import sys
-import csv
-import re
+import argparse
+import functools
+import itertools
+import concurrent.futures
+import collections
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
 import bs4
 import util
+import page_cache
+import incremental
+import tokenizer
+import index_writers
+import scheduler
+import frontier
+import checkpoint
+import metrics
+import shards
+import fingerprint
 
 INDEX_IGNORE = set(['a', 'also', 'an', 'and', 'are', 'as', 'at', 'be',
                     'but', 'by', 'course', 'for', 'from', 'how', 'i',
@@ -21,25 +38,103 @@ INDEX_IGNORE = set(['a', 'also', 'an', 'and', 'are', 'as', 'at', 'be',
                     'topics', 'units', 'we', 'were', 'which', 'will', 'with',
                     'yet'])
 
+TOKENIZER = tokenizer.Tokenizer(INDEX_IGNORE)
+
+# Set CRAWLER_CACHE_DIR to keep fetched pages on disk between crawls, and
+# CRAWLER_OFFLINE=1 to replay them without touching the network.
+CACHE_DIR = os.environ.get("CRAWLER_CACHE_DIR")
+OFFLINE = os.environ.get("CRAWLER_OFFLINE") == "1"
+
+COURSEBLOCK_CLASSES = ['courseblock main', 'courseblock subsequence']
+
+# parser backend name -> (BeautifulSoup tree builder, only build the tags
+# the crawler reads)
+PARSERS = {
+    'html.parser': ('html.parser', False),
+    'lxml': ('lxml', False),
+    'strained': ('html.parser', True),
+    'lxml-strained': ('lxml', True),
+}
+DEFAULT_PARSER = 'html.parser'
+# with a strained parser, link pages only materialize <a> tags and course
+# pages only materialize the course blocks
+LINK_STRAINER = bs4.SoupStrainer('a')
+COURSE_STRAINER = bs4.SoupStrainer('div', class_=COURSEBLOCK_CLASSES)
+
+# the most pages held between two stages of the streaming pipeline
+PIPELINE_DEPTH = 32
+# added to a course's word positions between two fields, so that phrases
+# never match across a title and a description
+POSITION_GAP = 100
+
 
 ### YOUR FUNCTIONS HERE
-def process_page(url):
+def timing(crawl_metrics, stage, url=None):
+    '''
+    Context manager timing its body as stage of the page url when
+    crawl_metrics (a metrics.CrawlMetrics) is set, and doing nothing
+    otherwise.
+    '''
+    if crawl_metrics is None:
+        return contextlib.nullcontext()
+    return crawl_metrics.time(stage, url)
+
+def fetch_page(url, session=None):
+    '''
+    Fetches the raw HTML of a webpage.
+
+    Args:
+        url (str): The URL of the webpage to fetch.
+        session (requests.Session): Optional pooled session to fetch with.
+
+    Returns:
+        bytes: The HTML of the page, or "" if the request fails.
+    '''
+    request = util.get_request(url, session)
+    if request is None:
+        return ""
+    return util.read_request(request)
+
+def parse_html(html, parser=DEFAULT_PARSER, parse_only=None):
+    '''
+    Parses HTML with one of the PARSERS backends.
+
+    Args:
+        html (bytes): The HTML to parse.
+        parser (str): A key of PARSERS.
+        parse_only (SoupStrainer): The tags to keep when the backend is a
+            strained one (ignored otherwise).
+
+    Returns:
+        BeautifulSoup: Parsed HTML as a BeautifulSoup object.
+    '''
+    features, strained = PARSERS[parser]
+    if not strained:
+        parse_only = None
+    return bs4.BeautifulSoup(html, features, parse_only=parse_only)
+
+def process_page(url, session=None, parser=DEFAULT_PARSER, parse_only=None,
+                 crawl_metrics=None, html=None):
     '''
     Fetches and parses a webpage from the given URL.
 
     Args:
         url (str): The URL of the webpage to fetch and parse.
+        session (requests.Session): Optional pooled session to fetch with.
+        parser (str): A key of PARSERS.
+        parse_only (SoupStrainer): The tags a strained parser keeps.
+        crawl_metrics (CrawlMetrics): Optional metrics to time parsing with.
+        html (bytes): The page's HTML, if it was fetched already.
 
     Returns:
         BeautifulSoup: Parsed HTML as a BeautifulSoup object, or None if the request fails.
     '''
-    request = util.get_request(url)
-    if request is None:
-        return []
-    html = util.read_request(request)
+    if html is None:
+        html = fetch_page(url, session)
     if not html:
         return []
-    soup = bs4.BeautifulSoup(html, 'html.parser')
+    with timing(crawl_metrics, "parse", url):
+        soup = parse_html(html, parser, parse_only)
     return soup
 
 def extract_links(soup, current_url, limiting_domain):
@@ -58,8 +153,8 @@ def extract_links(soup, current_url, limiting_domain):
     for link in soup.find_all('a'):
         href = link.get('href')
         if href:
-            absolute_url = util.convert_if_relative_url(current_url, href)
-            if absolute_url and util.is_url_ok_to_follow(absolute_url, limiting_domain):
+            absolute_url = util.resolve_link(current_url, href, limiting_domain)
+            if absolute_url:
                 links.add(absolute_url)
     return links
 
@@ -78,19 +173,7 @@ def extract_course_codes(title_text):
     Returns:
         list: A list of all course codes found in the text
     """
-
-    pattern = r'([A-Z]+)\s+((?:\d{5}(?:-\d{5})*))'
-    matches = re.finditer(pattern, title_text)
-    course_codes = []
-
-    for match in matches:
-        dept = match.group(1)
-        print(dept)
-        all_num = match.group(2)
-        num_list = all_num.split('-')
-        for num in num_list:
-            course_codes.append(f"{dept} {num}")
-    return course_codes
+    return TOKENIZER.course_codes(title_text)
 
 def get_valid_words(text):
     """
@@ -105,11 +188,10 @@ def get_valid_words(text):
     Returns:
         set: A set of valid words that aren't in INDEX_IGNORE
     """
-    text = text.lower()
-    words = set(re.findall(r'[a-z][a-z0-9_]*', text))
-    return words - INDEX_IGNORE
+    return TOKENIZER.words(text)
 
-def extract_course_info(url, course_map):
+def extract_course_info(url, course_map, session=None, parser=DEFAULT_PARSER,
+                        crawl_metrics=None, html=None):
     '''
     Helper function that takes a url of a webpage and the 
     text in  that webpage, process it, map its unique id from course map,
@@ -118,31 +200,228 @@ def extract_course_info(url, course_map):
     Input:
         url: page to scrape
         course_map: the dictionary that maps course code to unique identifiers.
+        session: optional pooled session to fetch the page with
+        parser: the PARSERS backend to parse the page with
+        crawl_metrics: optional metrics.CrawlMetrics to time the page with
+        html: the page's body, if it was fetched already ("" to skip it)
 
     Output:
         dictionary of course information
     '''
-    word_to_courses = {}
-    soup = process_page(url)
+    soup = parse_course_page(url, session, parser, crawl_metrics, html)
     if not soup:
         return {}
+    with timing(crawl_metrics, "extract", url):
+        return course_info_from_soup(soup, course_map)
+
+def extract_course_postings(url, course_map, session=None, parser=DEFAULT_PARSER,
+                            crawl_metrics=None, html=None):
+    '''
+    Like extract_course_info, but returns the postings of the page (see
+    page_postings).
+    '''
+    soup = parse_course_page(url, session, parser, crawl_metrics, html)
+    if not soup:
+        return []
+    with timing(crawl_metrics, "extract", url):
+        return page_postings(course_blocks(soup), course_map)
+
+def parse_course_page(url, session=None, parser=DEFAULT_PARSER,
+                      crawl_metrics=None, html=None):
+    '''
+    Fetches a page and parses its course blocks.
+
+    Input:
+        url: page to scrape
+        session: optional pooled session to fetch the page with
+        parser: the PARSERS backend to parse the page with
+        crawl_metrics: optional metrics.CrawlMetrics to time the page with
+        html: the page's body, if it was fetched already ("" to skip it)
+
+    Output:
+        BeautifulSoup object, or None if the page could not be fetched or
+          was skipped
+    '''
+    if html is None:
+        html = fetch_page(url, session)
+    if not html:
+        return None
+    with timing(crawl_metrics, "parse", url):
+        return parse_html(html, parser, COURSE_STRAINER)
+
+def fetch_pages(urls, session=None, num_workers=1):
+    '''
+    Fetches the given pages, num_workers at a time. This is how the crawl
+    fetches pages by default; a function with the same output can take its
+    place (async_crawler fetches on an event loop instead of threads).
+
+    Inputs:
+        urls: iterable of urls
+        session: optional pooled session to fetch the pages with
+        num_workers: the number of pages to fetch concurrently
+
+    Output:
+        iterator of (url, html) pairs in the order of urls, where html is ""
+          for pages that could not be fetched
+    '''
+    urls, fetched_urls = itertools.tee(urls)
+    fetch = functools.partial(fetch_page, session=session)
+    return zip(fetched_urls, map_pages(fetch, urls, num_workers))
+
+def fingerprint_page(page, fingerprints):
+    '''
+    Adds its fingerprint.PageFingerprints fingerprint (None if the page
+    could not be fetched) to a (url, html) pair of a fetch.
+    '''
+    url, html = page
+    return url, html, fingerprints.fingerprint(html) if html else None
+
+def unseen_pages(pages, fingerprints, num_workers=1):
+    '''
+    Fingerprints fetched pages concurrently, but checks them against
+    fingerprints in page order, so the first copy of a page is always the
+    one kept, whatever order the fetches complete in.
+
+    Inputs:
+        pages: iterable of (url, html) pairs of a fetch (see fetch_pages)
+        fingerprints: fingerprint.PageFingerprints
+        num_workers: the number of pages to fingerprint concurrently
+
+    Output:
+        generator of (url, html) pairs, in page order, where html is ""
+          for pages that could not be fetched or were seen already
+    '''
+    fingerprint = functools.partial(fingerprint_page, fingerprints=fingerprints)
+    for url, html, page_fingerprint in map_pages(fingerprint, pages,
+                                                 num_workers):
+        if html and fingerprints.seen(html, page_fingerprint):
+            html = ""
+        yield url, html
+
+def process_fetched_page(page, process):
+    '''
+    Applies process (such as extract_course_info or crawl_links, with its
+    other arguments bound) to a (url, html) pair of a fetch.
+    '''
+    url, html = page
+    return process(url, html=html)
+
+def course_info_from_soup(soup, course_map):
+    '''
+    Maps every word in the course blocks of a parsed page to the unique
+    identifiers of the courses it describes.
+
+    Input:
+        soup: parsed page
+        course_map: the dictionary that maps course code to unique identifiers.
+
+    Output:
+        dictionary of {word: set of course identifiers}
+    '''
+    return course_info_from_blocks(course_blocks(soup), course_map)
+
+def course_blocks(soup):
+    '''
+    Pulls the title and description text out of every course block of a
+    parsed page, in document order.
+
+    The page is walked once: from each main block, util.find_sequence
+    picks up the subsequence blocks that follow it, and the next block
+    is looked for after the last of them (course blocks are not nested
+    in each other). Titles and
+    descriptions are looked up among a block's children rather than by
+    searching its whole subtree.
+
+    Input:
+        soup: parsed page
+
+    Output:
+        list of (title text, description text) pairs
+    '''
+    blocks = []
     # 'courseblock main' and 'courseblock subsequence' has the same html structure
-    for block in soup.find_all('div', class_=['courseblock main', 'courseblock subsequence']):
-       #  process courseb title
-        title_tag = block.find('p', class_='courseblocktitle')
-        title_text = title_tag.get_text(strip = True)
-        # extract course code from title
-        course_codes = extract_course_codes(title_text)
-        # map each course code to unique identifier
-        identifiers = set()
-        for code in course_codes:
-            if code in course_map:
-                identifiers.add(course_map[code])
-        # process course description
-        descrip_tag = block.find('p', class_ = 'courseblockdesc')
-        # combine text and create list
-        all_text = title_text + " " + descrip_tag.get_text(strip = True)
-        word_list = get_valid_words(all_text)
+    block = soup.find('div', class_=COURSEBLOCK_CLASSES)
+    while block is not None:
+        blocks.append(block_text(block))
+        last = block
+        if not util.is_subsequence(block):
+            # a sequence header is followed by the courses of the sequence
+            for member in util.find_sequence(block):
+                blocks.append(block_text(member))
+                last = member
+        block = next_course_block(last)
+    return blocks
+
+def is_course_block(tag):
+    '''
+    Is the tag a course block (main or subsequence)?
+    '''
+    return isinstance(tag, bs4.element.Tag) and tag.name == 'div' and \
+        ' '.join(tag.get('class', ())) in COURSEBLOCK_CLASSES
+
+def next_course_block(tag):
+    '''
+    Returns the first course block after tag in the page, or None. Course
+    blocks are usually siblings, so the next sibling is checked before
+    searching the rest of the page.
+    '''
+    sibling = tag.next_sibling
+    while util.is_whitespace(sibling):
+        sibling = sibling.next_sibling
+    if is_course_block(sibling):
+        return sibling
+    return tag.find_next('div', class_=COURSEBLOCK_CLASSES)
+
+def block_text(block):
+    '''
+    Returns the (title text, description text) pair of a course block.
+    '''
+    title_tag = block_part(block, 'courseblocktitle')
+    descrip_tag = block_part(block, 'courseblockdesc')
+    return (title_tag.get_text(strip=True), descrip_tag.get_text(strip=True))
+
+def block_part(block, part_class):
+    '''
+    Returns the first <p> of class part_class in a course block, like
+    block.find('p', class_=part_class), but only searching inside the
+    children that come before it (usually none: it is a direct child).
+    '''
+    for child in block.children:
+        if not isinstance(child, bs4.element.Tag):
+            continue
+        if child.name == 'p' and part_class in child.get('class', ()):
+            return child
+        part = child.find('p', class_=part_class)
+        if part is not None:
+            return part
+    return None
+
+def codes_to_ids(course_codes, course_map):
+    '''
+    Returns the set of unique identifiers of the given course codes.
+    '''
+    # map each course code to unique identifier
+    identifiers = set()
+    for code in course_codes:
+        if code in course_map:
+            identifiers.add(course_map[code])
+    return identifiers
+
+def course_info_from_blocks(blocks, course_map):
+    '''
+    Maps every word in the given course blocks to the unique identifiers
+    of the courses it describes.
+
+    Input:
+        blocks: list of (title text, description text) pairs
+        course_map: the dictionary that maps course code to unique identifiers.
+
+    Output:
+        dictionary of {word: set of course identifiers}
+    '''
+    word_to_courses = {}
+    for course_codes, word_list in TOKENIZER.tokenize_blocks(blocks):
+        identifiers = codes_to_ids(course_codes, course_map)
         # map each word to unique identifier of each course
         for word in word_list:
             if word not in word_to_courses:
@@ -150,18 +429,398 @@ def extract_course_info(url, course_map):
             word_to_courses[word].update(identifiers)
     return word_to_courses
 
-def go(num_pages_to_crawl, course_map_filename, index_filename):
+def page_postings(blocks, course_map):
     '''
-    Crawl the college catalog and generates a CSV file with an index.
+    Builds the postings of the course blocks of a page: for every course
+    and word, how often the word appears in the course's blocks, whether
+    it appears in a title and/or a description, and at which positions.
+
+    A course's positions count every word of its blocks in page order
+    (ignored words included, so a phrase query can account for them),
+    title before description, with POSITION_GAP between two fields.
+
+    Input:
+        blocks: list of (title text, description text) pairs
+        course_map: the dictionary that maps course code to unique identifiers.
+
+    Output:
+        list of (course_id, word, term frequency, field flags, positions)
+          tuples, where the field flags combine tokenizer.TITLE and
+          tokenizer.DESCRIPTION
+    '''
+    ignore = TOKENIZER.ignore
+    postings = {}
+    next_position = {}
+    for course_codes, title_words, descrip_words in \
+            TOKENIZER.tokenize_fields(blocks):
+        for course_id in codes_to_ids(course_codes, course_map):
+            position = next_position.get(course_id, 0)
+            for field, words in ((tokenizer.TITLE, title_words),
+                                 (tokenizer.DESCRIPTION, descrip_words)):
+                for offset, word in enumerate(words):
+                    if word in ignore:
+                        continue
+                    posting = postings.get((course_id, word))
+                    if posting is None:
+                        posting = postings[course_id, word] = [0, 0, []]
+                    posting[0] += 1
+                    posting[1] |= field
+                    posting[2].append(position + offset)
+                position += len(words) + POSITION_GAP
+            next_position[course_id] = position
+    return [(course_id, word, tf, fields, positions)
+            for (course_id, word), (tf, fields, positions) in postings.items()]
+
+def extract_changed_course_info(url, course_map, known_digests, session=None,
+                                parser=DEFAULT_PARSER, crawl_metrics=None,
+                                html=None):
+    '''
+    Like extract_course_info, but skips parsing pages whose content has
+    not changed since they were last indexed.
+
+    Input:
+        url: page to scrape
+        course_map: the dictionary that maps course code to unique identifiers.
+        known_digests: dictionary {url: content hash} of indexed pages
+        session: optional pooled session to fetch the page with
+        parser: the PARSERS backend to parse the page with
+        crawl_metrics: optional metrics.CrawlMetrics to time the page with
+        html: the page's body, if it was fetched already
+
+    Output:
+        tuple (url, content hash, dictionary of course information or
+          None if the page is unchanged); a page that could not be fetched
+          counts as unchanged, so a transient error or 404 keeps its rows
+    '''
+    if html is None:
+        html = fetch_page(url, session)
+    if not html:
+        return url, known_digests.get(url), None
+    digest = incremental.page_digest(html)
+    if known_digests.get(url) == digest:
+        return url, digest, None
+    with timing(crawl_metrics, "parse", url):
+        soup = parse_html(html, parser, COURSE_STRAINER)
+    with timing(crawl_metrics, "extract", url):
+        return url, digest, course_info_from_soup(soup, course_map)
+
+def crawl_links(url, limiting_domain, session=None, parser=DEFAULT_PARSER,
+                crawl_metrics=None, html=None):
+    '''
+    Fetches a page and returns the set of links on it that are ok to follow.
+
+    Input:
+        url: page to scrape
+        limiting_domain: the domain to limit the URLs to
+        session: optional pooled session to fetch the page with
+        parser: the PARSERS backend to parse the page with
+        crawl_metrics: optional metrics.CrawlMetrics to time the page with
+        html: the page's body, if it was fetched already
+
+    Output:
+        set of absolute URLs (empty if the page could not be fetched)
+    '''
+    soup = process_page(url, session, parser, LINK_STRAINER, crawl_metrics,
+                        html)
+    if not soup:
+        return set()
+    with timing(crawl_metrics, "links", url):
+        return extract_links(soup, url, limiting_domain)
+
+def map_pages(func, urls, num_workers=1):
+    '''
+    Applies func to every url and yields the results in the order of urls.
+
+    With num_workers > 1 the calls run on a thread pool, so page fetches
+    overlap, but results are still yielded in input order. This keeps the
+    index identical to the serial crawl whatever order the requests
+    complete in. Only a few urls per worker are taken ahead of the
+    results (see bounded_map), so urls can stream from the frontier.
 
     Inputs:
+        func: function that takes a url
+        urls: iterable of urls
+        num_workers: the number of threads to use
+
+    Output:
+        generator of func(url) for each url
+    '''
+    if num_workers <= 1:
+        yield from map(func, urls)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        yield from bounded_map(executor, func, urls,
+                               max(PIPELINE_DEPTH, 2 * num_workers))
+
+def bounded_map(executor, func, items, depth=PIPELINE_DEPTH, crawl_metrics=None,
+                stage=None):
+    '''
+    Like executor.map, but only takes the next item once fewer than depth
+    calls are in flight, so a slow consumer holds at most depth results.
+    Results are yielded in the order of items.
+
+    Inputs:
+        executor: a concurrent.futures executor
+        func: function applied to every item
+        items: iterable (possibly a generator from an earlier stage)
+        depth: the most calls in flight at once
+        crawl_metrics: optional metrics.CrawlMetrics to record the number
+          of calls in flight with, as the depth of the queue named stage
+
+    Output:
+        generator of func(item) for each item
+    '''
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if crawl_metrics is not None:
+            crawl_metrics.queue_depth(stage, len(pending))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def parse_course_blocks(html, parser=DEFAULT_PARSER):
+    '''
+    Parse stage of the pipeline: turns fetched HTML into the text of its
+    course blocks. Runs in a worker process, so it only takes and returns
+    plain data.
+
+    Input:
+        html: page HTML ("" for pages that could not be fetched)
+        parser: the PARSERS backend to parse the page with
+
+    Output:
+        list of (title text, description text) pairs
+    '''
+    if not html:
+        return []
+    return course_blocks(parse_html(html, parser, COURSE_STRAINER))
+
+def tokenize_blocks(blocks, course_map):
+    '''
+    Tokenize stage of the pipeline: yields the (course_id, word) pairs of
+    the given course blocks, in the order a crawl without parse processes
+    writes them (see course_info_from_blocks), so both write the same index.
+
+    Input:
+        blocks: list of (title text, description text) pairs
+        course_map: the dictionary that maps course code to unique identifiers.
+    '''
+    for word, course_ids in course_info_from_blocks(blocks, course_map).items():
+        for course_id in course_ids:
+            yield course_id, word
+
+def stream_page_pairs(pages_to_crawl, course_map, session, num_workers=1,
+                      parse_processes=1, parser=DEFAULT_PARSER,
+                      depth=PIPELINE_DEPTH, crawl_metrics=None,
+                      fingerprints=None, postings=False, fetch=None):
+    '''
+    Streams the given pages through a fetch -> parse -> tokenize pipeline.
+    Fetches run on a thread pool (see fetch_pages), parsing runs on a
+    process pool, and each stage holds a bounded number of pages, so
+    memory does not grow with the size of the crawl.
+
+    Inputs:
+        pages_to_crawl: iterable of urls to index
+        course_map: the dictionary that maps course code to unique identifiers.
+        session: pooled session to fetch the pages with
+        num_workers: the number of pages to fetch concurrently
+        parse_processes: the number of processes parsing pages
+        parser: the PARSERS backend to parse pages with
+        depth: the most pages in flight in the parse stage
+        crawl_metrics: optional metrics.CrawlMetrics to time the pages
+          and record the depth of the stages with
+        fingerprints: optional fingerprint.PageFingerprints; pages it has
+          seen already are not parsed
+        postings: yield the postings of every page (see page_postings)
+          instead of its pairs
+        fetch: function to fetch the pages with instead of session (see
+          fetch_pages)
+
+    Output:
+        generator of the list of (course_id, word) pairs of every page, in
+          page order
+    '''
+    if fetch is None:
+        fetch = functools.partial(fetch_pages, session=session,
+                                  num_workers=num_workers)
+    parse = functools.partial(metrics.timed,
+                              functools.partial(parse_course_blocks,
+                                                parser=parser))
+    # spawn, since forking while fetch threads hold locks is unsafe
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(parse_processes,
+                                                mp_context=context) as parsers:
+        fetched = fetch(pages_to_crawl)
+        if fingerprints is not None:
+            fetched = unseen_pages(fetched, fingerprints, num_workers)
+        fetched, parsed_pages = itertools.tee(fetched)
+        parsed = bounded_map(parsers, parse, (html for _, html in fetched),
+                             depth, crawl_metrics, "parse")
+        # results come back in page order, so they line up with the urls
+        for (url, _), (seconds, blocks) in zip(parsed_pages, parsed):
+            if crawl_metrics is not None:
+                crawl_metrics.record("parse", seconds, url)
+            with timing(crawl_metrics, "extract", url):
+                if postings:
+                    pairs = page_postings(blocks, course_map)
+                else:
+                    pairs = list(tokenize_blocks(blocks, course_map))
+            yield pairs
+
+def stream_index_pairs(pages_to_crawl, course_map, session, num_workers=1,
+                       parse_processes=1, parser=DEFAULT_PARSER,
+                       depth=PIPELINE_DEPTH, crawl_metrics=None):
+    '''
+    Streams the (course_id, word) pairs of the given pages through the
+    pipeline of stream_page_pairs (which takes the same inputs).
+
+    Output:
+        generator of (course_id, word) pairs, in page order
+    '''
+    for pairs in stream_page_pairs(pages_to_crawl, course_map, session,
+                                   num_workers, parse_processes, parser, depth,
+                                   crawl_metrics):
+        yield from pairs
+
+def page_priority(url):
+    '''
+    Frontier priority of a page when the crawl is prioritized: program
+    pages (which hold the course blocks) come before index pages.
+    '''
+    path = url.rsplit('/', 1)[-1]
+    if path in ('', 'index.html'):
+        return 1
+    return 0
+
+def collect_pages(starting_url, limiting_domain, num_pages_to_crawl,
+                  session, num_workers=1, parser=DEFAULT_PARSER,
+                  prioritize=False, crawl_metrics=None, fetch=None):
+    '''
+    Crawls the starting page and the pages it links to, and yields the
+    pages to index straight from the frontier, so the crawl never holds
+    the list of pages in memory.
+
+    Inputs:
+        starting_url: the page the crawl starts from
+        limiting_domain: the domain the crawl stays in
+        num_pages_to_crawl: the number of pages to process during the crawl
+        session: pooled session to fetch the pages with
+        num_workers: the number of pages to fetch concurrently
+        parser: the PARSERS backend to parse pages with
+        prioritize: crawl program pages before index pages
+        crawl_metrics: optional metrics.CrawlMetrics to time the pages
+          and record the depth of the frontier with
+        fetch: function to fetch the pages with instead of session (see
+          fetch_pages)
+
+    Outputs:
+        generator of urls to index
+    '''
+    if fetch is None:
+        fetch = functools.partial(fetch_pages, session=session,
+                                  num_workers=num_workers)
+    crawl_page = functools.partial(crawl_links, limiting_domain=limiting_domain,
+                                   parser=parser, crawl_metrics=crawl_metrics)
+    # the queue and the visited set spill to disk on large crawls
+    store = frontier.FrontierStore()
+    try:
+        url_queue = frontier.Frontier(store)
+        visited_urls = frontier.SeenSet(store)
+        visited_urls.add(starting_url)
+        i = 1
+        ((_, html),) = fetch([starting_url])
+        lv1_links = crawl_page(starting_url, html=html)
+        lv1_urls = []
+        for url in lv1_links:
+            if visited_urls.add(url):
+                lv1_urls.append(url)
+                i += 1
+        crawl_lv1 = functools.partial(process_fetched_page, process=crawl_page)
+        for lv2_links in map_pages(crawl_lv1, fetch(lv1_urls), num_workers):
+            for lv2_link in lv2_links:
+                # a link seen before is already crawled or ahead in the queue
+                if visited_urls.add(lv2_link):
+                    url_queue.put(lv2_link,
+                                  page_priority(lv2_link) if prioritize else 0)
+        # level 2 pages do not add links to the queue, so the pages within
+        # the budget are known before any of them is fetched
+        while not url_queue.empty() and i <= num_pages_to_crawl:
+            if crawl_metrics is not None:
+                crawl_metrics.queue_depth("frontier", len(url_queue))
+            yield url_queue.get()
+            i += 1
+    finally:
+        store.close()
+
+def go(num_pages_to_crawl, course_map_filename, index_filename, *, num_workers=1,
+       cache_dir=CACHE_DIR, offline=OFFLINE, incremental_index=False,
+       parser=DEFAULT_PARSER, parse_processes=None,
+       index_format=index_writers.DEFAULT_FORMAT, max_rate=None,
+       prioritize=False, checkpoint_dir=None, resume=False,
+       report_metrics=False, trace_filename=None, num_shards=None,
+       skip_duplicates=None, postings=False, fetch=None):
+    '''
+    Crawl the college catalog and generates a CSV file with an index.
+
+    Inputs (all but the first three are keyword-only, so that options
+    cannot be passed in the wrong order):
         num_pages_to_crawl: the number of pages to process during the crawl
         course_map_filename: the name of a JSON file that contains the mapping
           course codes to course identifiers
         index_filename: the name for the CSV of the index.
+        num_workers: the number of pages to fetch concurrently (1 crawls
+          serially)
+        cache_dir: directory of the on-disk page cache (None disables it)
+        offline: only serve pages from the cache, never the network
+        incremental_index: only re-parse pages that changed since the last
+          incremental crawl and patch the existing index with the
+          difference
+        parser: the PARSERS backend to parse pages with
+        parse_processes: if set, index the pages through the streaming
+          pipeline with this many parser processes (not used by the
+          incremental mode)
+        index_format: "csv" for the pipe-delimited CSV, "binary" for
+          the binary_index format or "sqlite" to load the catalog_index
+          table of the SQLite database index_filename (the incremental
+          mode always uses CSV)
+        max_rate: if set, pace requests with a scheduler.PoliteScheduler
+          that sends at most max_rate requests per second, adapts to the
+          host's responses and follows its robots.txt
+        prioritize: crawl program pages before index pages (see
+          page_priority) instead of in the order they were found
+        checkpoint_dir: if set, save the crawl's progress there every
+          checkpoint.CHECKPOINT_EVERY pages (full CSV crawls only); the
+          checkpoint is removed once the index is complete
+        resume: continue the crawl saved in checkpoint_dir, without
+          fetching the pages already indexed or writing their rows again
+          (a ValueError if there is no checkpoint there)
+        report_metrics: time every stage of every page (see metrics.py)
+          and print a summary at the end of the crawl
+        trace_filename: if set, also write the summary and every timing
+          to this JSON file
+        num_shards: if set, index the pages with this many crawl
+          processes, each owning a hash partition of the pages, and merge
+          their index shards (see write_sharded_index); not used by the
+          incremental or checkpointed modes
+        skip_duplicates: "exact" to skip parsing pages whose body was
+          already indexed, "near" to skip near duplicates as well (see
+          fingerprint.py; this can drop rows); not used by the
+          incremental or sharded modes
+        postings: write postings with term frequencies, title/description
+          flags and word positions (see page_postings) instead of
+          (course_id, word) pairs, as CSV or into the catalog_postings
+          table of a SQLite database; full, unsharded crawls only
+        fetch: if set, a function fetch(urls, crawl_metrics) to fetch the
+          pages with (see fetch_pages) instead of a session of num_workers
+          threads; the cache and the scheduler of cache_dir, offline and
+          max_rate are then up to it (async_crawler.go fetches on an event
+          loop this way); not used by sharded crawls
 
     Outputs:
-        CSV file of the index index.
+        CSV file of the index index; the incremental mode also returns the
+        pair (number of rows added, number of rows removed)
     '''
 
     starting_url = ("http://www.classes.cs.uchicago.edu/archive/2015/winter"
@@ -169,66 +828,455 @@ def go(num_pages_to_crawl, course_map_filename, index_filename):
     limiting_domain = "classes.cs.uchicago.edu"
 
     # YOUR CODE HERE
-    url_queue = queue.Queue()
-    visited_urls = set()
-    visited_urls.add(starting_url)
-    word_course_pair = set()
-    i = 1
+    if resume and checkpoint_dir is None:
+        raise ValueError("resuming needs a checkpoint_dir")
+    if resume and not checkpoint.exists(checkpoint_dir):
+        raise ValueError("there is no checkpoint to resume in {}".format(
+            checkpoint_dir))
+    if checkpoint_dir is not None and (incremental_index or index_format != 'csv'):
+        raise ValueError("checkpoints are only supported for full CSV crawls")
+    if num_shards and (incremental_index or checkpoint_dir is not None
+                       or fetch is not None):
+        raise ValueError("sharded crawls cannot be incremental or checkpointed,"
+                         " and fetch with sessions of their own")
+    fingerprints = None
+    if skip_duplicates is not None:
+        if incremental_index or num_shards:
+            raise ValueError("duplicates can only be skipped by full,"
+                             " unsharded crawls")
+        fingerprints = fingerprint.PageFingerprints(skip_duplicates)
+    if postings and (incremental_index or num_shards or checkpoint_dir is not None
+                     or index_format not in index_writers.POSTINGS_WRITERS):
+        raise ValueError("postings are written by full, unsharded crawls to"
+                         " {}".format(" or ".join(index_writers.POSTINGS_WRITERS)))
     # load json formatted course_map into a dictionary
     with open(course_map_filename, 'r') as f:
         course_map = json.load(f)
-    # Organize and manage links in a hierarchical structure
-    link_hierarchy = {
-        1: set(),
-        2: set()
-        }
-    lv1_soup = process_page(starting_url)
-    lv1_links = extract_links(lv1_soup, starting_url, limiting_domain)
-    link_hierarchy[1].update(lv1_links)
-    for url in lv1_links:
-        if url not in visited_urls:
-            visited_urls.add(url)
-            i += 1
-            lv2_soup = process_page(url)
-            lv2_links = extract_links(lv2_soup, url, limiting_domain)
-            for lv2_link in lv2_links:
-                url_queue.put(lv2_link)
-            link_hierarchy[2].update(lv2_links) # for tracking
-    # write csv and track word in the mean time to avoid repetitive loops
-    with open(index_filename, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile, delimiter='|')
-        # check each url and scrape if not empty and not reaching the limit
-        while not url_queue.empty() and i <= num_pages_to_crawl:
-            link = url_queue.get()
-            if link in visited_urls:
-                continue
-            visited_urls.add(link)
-            i += 1
+    crawl_metrics = None
+    if report_metrics or trace_filename is not None:
+        crawl_metrics = metrics.CrawlMetrics(trace=trace_filename is not None)
+    cache = None
+    polite = None
+    session = None
+    if fetch is not None:
+        fetch = functools.partial(fetch, crawl_metrics=crawl_metrics)
+    else:
+        if cache_dir is not None:
+            cache = page_cache.PageCache(cache_dir, offline=offline)
+        if max_rate is not None:
+            polite = scheduler.PoliteScheduler(
+                max_rate=max_rate, max_concurrency=max(num_workers, 1))
+        # one keep-alive connection per worker to the catalog host
+        session = util.make_session(pool_size=max(num_workers, 1), cache=cache,
+                                    scheduler=polite, metrics=crawl_metrics)
+        fetch = functools.partial(fetch_pages, session=session,
+                                  num_workers=num_workers)
+    crawl_state = None
+    pages_to_crawl = None
+    if checkpoint_dir is not None:
+        crawl_state = checkpoint.Checkpoint(checkpoint_dir)
+        if resume and crawl_state.has_pages():
+            pages_to_crawl = crawl_state.pages()
+    if pages_to_crawl is None:
+        # the pages stream from the frontier into the indexing below
+        pages_to_crawl = collect_pages(starting_url, limiting_domain,
+                                       num_pages_to_crawl, session,
+                                       num_workers=num_workers, parser=parser,
+                                       prioritize=prioritize,
+                                       crawl_metrics=crawl_metrics, fetch=fetch)
+        if crawl_state is not None:
+            # saved before any is indexed, so a resumed crawl indexes the
+            # same pages
+            crawl_state.save_pages(pages_to_crawl)
+            pages_to_crawl = crawl_state.pages()
+    counts = None
+    if incremental_index:
+        counts = update_index(index_filename, pages_to_crawl, course_map,
+                              session, num_workers=num_workers, parser=parser,
+                              crawl_metrics=crawl_metrics, fetch=fetch)
+    elif num_shards:
+        write_sharded_index(index_filename, pages_to_crawl, course_map_filename,
+                            num_shards, num_workers=num_workers,
+                            cache_dir=cache_dir, offline=offline, parser=parser,
+                            index_format=index_format, max_rate=max_rate)
+    else:
+        write_index(index_filename, pages_to_crawl, course_map, session,
+                    num_workers=num_workers, parser=parser,
+                    parse_processes=parse_processes, index_format=index_format,
+                    crawl_state=crawl_state, crawl_metrics=crawl_metrics,
+                    fingerprints=fingerprints, postings=postings, fetch=fetch)
+    if crawl_state is not None:
+        # the index is complete, there is nothing left to resume
+        crawl_state.remove()
+    if session is not None:
+        session.close()
+    if cache is not None:
+        cache.close()
+        cache.report()
+    if polite is not None:
+        polite.report()
+    if fingerprints is not None:
+        fingerprints.report()
+    if crawl_metrics is not None:
+        crawl_metrics.finish()
+        crawl_metrics.report()
+        if trace_filename is not None:
+            crawl_metrics.write_trace(trace_filename)
+    if counts is not None:
+        print("{} rows added to the index, {} rows removed".format(*counts))
+    return counts
+
+def write_index(index_filename, pages_to_crawl, course_map, session,
+                num_workers=1, parser=DEFAULT_PARSER, parse_processes=None,
+                index_format=index_writers.DEFAULT_FORMAT, crawl_state=None,
+                crawl_metrics=None, fingerprints=None, postings=False,
+                fetch=None):
+    '''
+    Indexes the given pages and writes the index from scratch.
+
+    Inputs:
+        index_filename: the name for the file of the index.
+        pages_to_crawl: iterable of urls to index (read once; with
+          crawl_state, the pages it saved)
+        course_map: the dictionary that maps course code to unique identifiers.
+        session: pooled session to fetch the pages with
+        num_workers: the number of pages to fetch concurrently
+        parser: the PARSERS backend to parse pages with
+        parse_processes: if set, stream the pages through the pipeline
+          with this many parser processes
+        index_format: a key of index_writers.INDEX_WRITERS
+        crawl_state: if set, a checkpoint.Checkpoint (CSV only) to save
+          the progress to and to resume from
+        crawl_metrics: optional metrics.CrawlMetrics to time the pages with
+        fingerprints: optional fingerprint.PageFingerprints; pages it has
+          seen already are not parsed or indexed
+        postings: write postings (see page_postings) with a writer of
+          index_writers.POSTINGS_WRITERS; the posting of a course and
+          word comes from the first page that has them
+        fetch: function to fetch the pages with instead of session (see
+          fetch_pages)
+    '''
+    if fetch is None:
+        fetch = functools.partial(fetch_pages, session=session,
+                                  num_workers=num_workers)
+    pages_done = 0
+    word_course_pair = set()
+    if postings:
+        writer = index_writers.POSTINGS_WRITERS[index_format](index_filename)
+    elif crawl_state is None:
+        writer = index_writers.INDEX_WRITERS[index_format](index_filename)
+    else:
+        progress = crawl_state.progress()
+        index_offset = None
+        if progress is not None:
+            # drop the rows written after the checkpoint, their pages are
+            # indexed again
+            pages_done, index_offset = progress
+            word_course_pair = crawl_state.pairs()
+        writer = index_writers.CsvIndexWriter(index_filename, index_offset)
+    # the urls are read twice, by the fetches and by the loop below, which
+    # trails them by at most the fetches in flight
+    pages_left, written_urls = itertools.tee(
+        itertools.islice(pages_to_crawl, pages_done, None))
+    if parse_processes:
+        page_pairs = stream_page_pairs(pages_left, course_map, session,
+                                       num_workers, parse_processes, parser,
+                                       crawl_metrics=crawl_metrics,
+                                       fingerprints=fingerprints,
+                                       postings=postings, fetch=fetch)
+    else:
+        extract_page = functools.partial(
+            process_fetched_page, process=functools.partial(
+                extract_course_postings if postings else extract_course_info,
+                course_map=course_map, parser=parser,
+                crawl_metrics=crawl_metrics))
+        fetched = fetch(pages_left)
+        if fingerprints is not None:
+            # the pages seen already are not parsed
+            fetched = unseen_pages(fetched, fingerprints, num_workers)
+        pages = map_pages(extract_page, fetched, num_workers)
+        if postings:
+            page_pairs = pages
+        else:
             # process page(of the url) into a dictionary of {word: string, courseid:set}
-            page = extract_course_info(link, course_map)
-            # for every word and courseid, create a unique pair of each and write into csv file
+            page_pairs = ([(course_id, word) for word, course_ids in page.items()
+                           for course_id in course_ids] for page in pages)
+    new_pairs = []
+    # write the index and track word in the mean time to avoid repetitive loops
+    # page_pairs first, so zip runs the pipeline generator to its end
+    for pages_done, (pairs, url) in enumerate(zip(page_pairs, written_urls),
+                                              pages_done + 1):
+        start = time.perf_counter()
+        rows = 0
+        # for every word and courseid, create a unique pair of each and write it out
+        for pair in pairs:
+            # a pair, or a posting that starts with the pair
+            course_id, word = pair[0], pair[1]
+            if (word, course_id) not in word_course_pair:
+                word_course_pair.add((word, course_id))
+                writer.add(*pair)
+                new_pairs.append((course_id, word))
+                rows += 1
+        if crawl_metrics is not None:
+            crawl_metrics.record("write", time.perf_counter() - start, url,
+                                 tokens=len(pairs), rows=rows)
+        if crawl_state is not None and pages_done % crawl_state.every == 0:
+            crawl_state.save_progress(pages_done, writer.sync(), new_pairs)
+            new_pairs = []
+    with timing(crawl_metrics, "write"):
+        writer.close()
+
+def crawl_shard(prefix, urls_filename, course_map_filename, num_workers=1,
+                cache_dir=None, offline=False, parser=DEFAULT_PARSER,
+                max_rate=None):
+    '''
+    Indexes one shard of the pages into sorted runs (see shards.RunWriter).
+    Runs in a crawl process of write_sharded_index, so it sets up its own
+    session, cache and scheduler.
+
+    Inputs:
+        prefix: the runs are written to prefix.run0, prefix.run1, ...
+        urls_filename: file of the urls of the shard, one per line
+        course_map_filename: the name of the JSON course map
+        num_workers: the number of pages to fetch concurrently
+        cache_dir: directory of the on-disk page cache (None disables it)
+        offline: only serve pages from the cache, never the network
+        parser: the PARSERS backend to parse pages with
+        max_rate: if set, the most requests per second this process sends
+
+    Outputs:
+        list of the run filenames
+    '''
+    with open(course_map_filename, 'r') as f:
+        course_map = json.load(f)
+    cache = None
+    if cache_dir is not None:
+        cache = page_cache.PageCache(cache_dir, offline=offline)
+    polite = None
+    if max_rate is not None:
+        polite = scheduler.PoliteScheduler(max_rate=max_rate,
+                                           max_concurrency=max(num_workers, 1))
+    session = util.make_session(pool_size=max(num_workers, 1), cache=cache,
+                                scheduler=polite)
+    extract_page = functools.partial(extract_course_info, course_map=course_map,
+                                     session=session, parser=parser)
+    writer = shards.RunWriter(prefix)
+    with open(urls_filename) as urls:
+        pages_to_crawl = (url.rstrip("\n") for url in urls)
+        for page in map_pages(extract_page, pages_to_crawl, num_workers):
             for word, course_ids in page.items():
                 for course_id in course_ids:
-                    if (word, course_id) not in word_course_pair:
-                        word_course_pair.add((word, course_id))
-                        writer.writerow([course_id, word])
-        return
+                    writer.add(course_id, word)
+    session.close()
+    if cache is not None:
+        cache.close()
+        cache.report()
+    return writer.close()
+
+def write_sharded_index(index_filename, pages_to_crawl, course_map_filename,
+                        num_shards, num_workers=1, cache_dir=None, offline=False,
+                        parser=DEFAULT_PARSER,
+                        index_format=index_writers.DEFAULT_FORMAT,
+                        max_rate=None):
+    '''
+    Indexes the given pages with num_shards crawl processes and writes the
+    index from scratch. Every page goes to the process of its
+    shards.shard_of; each process writes its pairs as sorted runs, and the
+    runs of all shards are merged into the index, which removes the
+    duplicate pairs without any process holding every pair.
+
+    Inputs:
+        index_filename: the name for the file of the index.
+        pages_to_crawl: iterable of urls to index
+        course_map_filename: the name of the JSON course map
+        num_shards: the number of crawl processes
+        num_workers: the number of pages each process fetches concurrently
+        cache_dir: directory of the on-disk page cache (None disables it)
+        offline: only serve pages from the cache, never the network
+        parser: the PARSERS backend to parse pages with
+        index_format: a key of index_writers.INDEX_WRITERS
+        max_rate: if set, the most requests per second all the processes
+          send together
+
+    Outputs:
+        the number of rows in the index
+    '''
+    if max_rate is not None:
+        # each process paces itself, so split the rate between them
+        max_rate = max_rate / num_shards
+    run_dir = tempfile.mkdtemp(prefix="shards")
+    context = multiprocessing.get_context("spawn")
+    try:
+        # the urls of every shard stream to a file its process reads
+        url_filenames = [os.path.join(run_dir, "{}.urls".format(shard))
+                         for shard in range(num_shards)]
+        with contextlib.ExitStack() as stack:
+            url_files = [stack.enter_context(open(filename, 'w'))
+                         for filename in url_filenames]
+            for url in pages_to_crawl:
+                url_files[shards.shard_of(url, num_shards)].write(url + "\n")
+        with concurrent.futures.ProcessPoolExecutor(num_shards,
+                                                    mp_context=context) as crawlers:
+            futures = [crawlers.submit(functools.partial(
+                crawl_shard, os.path.join(run_dir, str(shard)), filename,
+                course_map_filename, num_workers=num_workers,
+                cache_dir=cache_dir, offline=offline, parser=parser,
+                max_rate=max_rate)) for shard, filename in enumerate(url_filenames)]
+            runs = [run for future in futures for run in future.result()]
+        writer = index_writers.INDEX_WRITERS[index_format](index_filename)
+        return shards.merge_runs(runs, writer)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+def update_index(index_filename, pages_to_crawl, course_map, session,
+                 num_workers=1, parser=DEFAULT_PARSER, crawl_metrics=None,
+                 fetch=None):
+    '''
+    Brings an incrementally maintained index up to date with the given
+    pages, re-parsing only the pages whose content changed.
+
+    Inputs:
+        index_filename: the name for the CSV of the index.
+        pages_to_crawl: iterable of urls to index
+        course_map: the dictionary that maps course code to unique identifiers.
+        session: pooled session to fetch the pages with
+        num_workers: the number of pages to fetch concurrently
+        parser: the PARSERS backend to parse pages with
+        crawl_metrics: optional metrics.CrawlMetrics to time the pages with
+        fetch: function to fetch the pages with instead of session (see
+          fetch_pages)
+
+    Outputs:
+        pair (number of rows added, number of rows removed)
+    '''
+    if fetch is None:
+        fetch = functools.partial(fetch_pages, session=session,
+                                  num_workers=num_workers)
+    state = incremental.IndexState(index_filename)
+    extract_page = functools.partial(
+        process_fetched_page, process=functools.partial(
+            extract_changed_course_info, course_map=course_map,
+            known_digests=state.digests(), parser=parser,
+            crawl_metrics=crawl_metrics))
+    for url, digest, page in map_pages(extract_page, fetch(pages_to_crawl),
+                                       num_workers):
+        state.keep(url)
+        if page is not None:
+            state.update_page(url, digest, page)
+    state.drop_unkept()
+    counts = state.patch_index()
+    state.close()
+    return counts
+
+def add_crawl_arguments(arg_parser, max_rate=None):
+    '''
+    Add the command line arguments of the options every crawl takes (the
+    crawler.py and async_crawler.py command lines) to arg_parser.
+
+    Inputs:
+        arg_parser: an argparse.ArgumentParser
+        max_rate: the default of --max-rate (None does not pace requests)
+    '''
+    arg_parser.add_argument("num_pages_to_crawl", nargs="?", type=int,
+                            default=1000, help="number of pages to crawl")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="patch the existing index with changed pages")
+    arg_parser.add_argument("--parser", choices=sorted(PARSERS),
+                            default=DEFAULT_PARSER,
+                            help="HTML parser backend")
+    arg_parser.add_argument("--parse-processes", type=int,
+                            help="stream pages through a pipeline with this"
+                                 " many parser processes")
+    arg_parser.add_argument("--format", choices=sorted(index_writers.INDEX_WRITERS),
+                            default=index_writers.DEFAULT_FORMAT,
+                            help="index output format")
+    arg_parser.add_argument("--max-rate", type=float, default=max_rate,
+                            help="pace requests politely, sending at most"
+                                 " this many per second (0 does not pace"
+                                 " them; default: {})".format(max_rate or 0))
+    arg_parser.add_argument("--prioritize", action="store_true",
+                            help="crawl program pages before index pages")
+    arg_parser.add_argument("--checkpoint-dir",
+                            help="save the progress of full CSV crawls in"
+                                 " this directory so they can be resumed"
+                                 " (default: the index file name followed"
+                                 " by .checkpoint)")
+    arg_parser.add_argument("--no-checkpoint", action="store_true",
+                            help="do not save the crawl's progress")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="continue the crawl saved in the checkpoint"
+                                 " directory")
+    arg_parser.add_argument("--metrics", action="store_true",
+                            help="time every stage of the crawl and print a"
+                                 " summary")
+    arg_parser.add_argument("--trace",
+                            help="also write the timings to this JSON file")
+    arg_parser.add_argument("--skip-duplicates", choices=fingerprint.MODES,
+                            help="do not parse pages already seen: exact"
+                                 " copies, or near copies as well")
+    arg_parser.add_argument("--postings", action="store_true",
+                            help="write term frequencies, fields and positions"
+                                 " with every (course_id, word) pair")
+    arg_parser.add_argument("--output", help="index file name (default"
+                            " catalog_index.csv, .bin or .sqlite3 for the"
+                            " binary and sqlite formats)")
+
+def crawl_options(args, arg_parser):
+    '''
+    Turn the arguments of add_crawl_arguments into the options of go,
+    exiting through arg_parser on a crawl that cannot be resumed.
+
+    Inputs:
+        args: the parsed arguments
+        arg_parser: the argparse.ArgumentParser that parsed them
+
+    Outputs:
+        pair (index file name, dictionary of go's keyword options)
+    '''
+    index_filename = args.output
+    if index_filename is None:
+        index_filename = {"binary": "catalog_index.bin",
+                          "sqlite": "catalog_index.sqlite3"}.get(
+                              args.format, "catalog_index.csv")
+    # full CSV crawls (the only ones that can be) are checkpointed by default
+    checkpoint_dir = args.checkpoint_dir
+    if checkpoint_dir is None and not (args.no_checkpoint or args.incremental
+                                       or getattr(args, "shards", None)
+                                       or args.postings
+                                       or args.format != "csv"):
+        checkpoint_dir = index_filename + ".checkpoint"
+    if args.no_checkpoint:
+        checkpoint_dir = None
+    if args.resume and checkpoint_dir is None:
+        arg_parser.error("--resume needs a checkpointed crawl (a full CSV"
+                         " crawl without --no-checkpoint)")
+    if args.resume and not checkpoint.exists(checkpoint_dir):
+        arg_parser.error("there is no checkpoint to resume in "
+                         + checkpoint_dir)
+    return index_filename, {
+        "incremental_index": args.incremental, "parser": args.parser,
+        "parse_processes": args.parse_processes, "index_format": args.format,
+        "max_rate": args.max_rate or None, "prioritize": args.prioritize,
+        "checkpoint_dir": checkpoint_dir, "resume": args.resume,
+        "report_metrics": args.metrics, "trace_filename": args.trace,
+        "skip_duplicates": args.skip_duplicates, "postings": args.postings}
 
 if __name__ == "__main__":
-    usage = "python3 crawl.py <number of pages to crawl>"
-    args_len = len(sys.argv)
+    arg_parser = argparse.ArgumentParser(prog="python3 crawler.py")
+    add_crawl_arguments(arg_parser)
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="number of pages to fetch concurrently")
+    arg_parser.add_argument("--cache-dir", default=CACHE_DIR,
+                            help="directory to cache fetched pages in")
+    arg_parser.add_argument("--offline", action="store_true", default=OFFLINE,
+                            help="replay pages from the cache only")
+    arg_parser.add_argument("--shards", type=int,
+                            help="index the pages with this many crawl"
+                                 " processes and merge their shards")
+    args = arg_parser.parse_args()
     course_map_filename = "course_map.json"
-    index_filename = "catalog_index.csv"
-    if args_len == 1:
-        num_pages_to_crawl = 1000
-    elif args_len == 2:
-        try:
-            num_pages_to_crawl = int(sys.argv[1])
-        except ValueError:
-            print(usage)
-            sys.exit(0)
-    else:
-        print(usage)
-        sys.exit(0)
+    index_filename, options = crawl_options(args, arg_parser)
 
-    go(num_pages_to_crawl, course_map_filename, index_filename)
+    go(args.num_pages_to_crawl, course_map_filename, index_filename,
+       num_workers=args.workers, cache_dir=args.cache_dir,
+       offline=args.offline, num_shards=args.shards, **options)
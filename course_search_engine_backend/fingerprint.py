@@ -0,0 +1,161 @@
+'''
+Duplicate and near-duplicate page detection.
+
+The archived catalog reaches many pages by several URLs, and some
+program listings are near copies of each other. PageFingerprints
+remembers a fingerprint of every page body the crawl indexes so that it
+can skip parsing the ones it has effectively seen already:
+
+    exact   the SHA-256 of the body (incremental.page_digest); skipping
+            an exact duplicate never changes the index
+    near    also a 64-bit SimHash of the page text's word shingles; pages
+            within max_distance differing bits of a page already seen
+            are skipped too, which can drop the few rows only they have
+
+SimHashes are found by splitting them into max_distance + 1 bands: two
+hashes that differ in at most max_distance bits agree exactly on at least
+one band, so only the pages sharing a band are compared.
+
+Which of two near copies is kept depends on which one is checked first,
+so a concurrent crawl computes fingerprints in its fetch threads but
+checks them (seen) in crawl order, which keeps the index the same
+whatever order the fetches complete in.
+'''
+# pylint: disable-msg=invalid-name
+
+import hashlib
+import re
+import threading
+
+import incremental
+import tokenizer
+
+MODES = ("exact", "near")
+SIMHASH_BITS = 64
+MAX_DISTANCE = 3
+SHINGLE_SIZE = 3
+TAG_RE = re.compile(rb'<[^>]*>')
+
+
+def simhash(html):
+    '''
+    64-bit SimHash of the word shingles of the text of a page.
+
+    Inputs:
+        html: page HTML (bytes)
+    '''
+    text = TAG_RE.sub(b' ', html).decode("utf-8", "replace").lower()
+    words = tokenizer.WORD_RE.findall(text)
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE])
+                for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    # count every byte value at every byte position, then add up the
+    # counts of the values with each bit set: far fewer operations than
+    # touching all 64 bits of every shingle
+    byte_counts = [[0] * 256 for _ in range(SIMHASH_BITS // 8)]
+    for shingle in shingles:
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        for position, value in enumerate(digest):
+            byte_counts[position][value] += 1
+    half = len(shingles) / 2
+    fingerprint = 0
+    for position, counts in enumerate(byte_counts):
+        for bit in range(8):
+            ones = sum(count for value, count in enumerate(counts)
+                       if value >> bit & 1)
+            if ones > half:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+
+class PageFingerprints:
+    '''
+    Thread-safe record of the pages seen by a crawl.
+
+    Inputs:
+        mode: "exact" to skip exact duplicates only, "near" to skip near
+          duplicates as well
+        max_distance: the most SimHash bits a near duplicate differs in
+    '''
+
+    def __init__(self, mode="exact", max_distance=MAX_DISTANCE):
+        if mode not in MODES:
+            raise ValueError("unknown duplicate mode {!r}".format(mode))
+        self.mode = mode
+        self.max_distance = max_distance
+        self.band_bits = SIMHASH_BITS // (max_distance + 1)
+        self.digests = set()
+        self.bands = [{} for _ in range(max_distance + 1)]
+        self.pages = 0
+        self.exact = 0
+        self.near = 0
+        self.bytes_skipped = 0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [fingerprint >> (band * self.band_bits) & mask
+                for band in range(len(self.bands))]
+
+    def _near_seen(self, fingerprint, keys):
+        for band, key in zip(self.bands, keys):
+            for other in band.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return True
+        return False
+
+    def fingerprint(self, html):
+        '''
+        The fingerprint seen checks a page body by: the pair (SHA-256
+        digest, SimHash or None in exact mode). Safe to call from any
+        thread, in any order.
+        '''
+        if self.mode == "near":
+            return incremental.page_digest(html), simhash(html)
+        return incremental.page_digest(html), None
+
+    def seen(self, html, page_fingerprint=None):
+        '''
+        Check a page body against the pages seen so far, and remember it
+        if it is new. Pages must be checked in crawl order for the first
+        copy of a page to be the one kept.
+
+        Inputs:
+            html: page HTML (bytes)
+            page_fingerprint: the page's fingerprint, if it was computed
+              already
+
+        Outputs:
+            True if the page is a duplicate (or near duplicate) whose
+            parsing can be skipped
+        '''
+        if page_fingerprint is None:
+            page_fingerprint = self.fingerprint(html)
+        digest, fingerprint = page_fingerprint
+        keys = None
+        if fingerprint is not None:
+            keys = self._band_keys(fingerprint)
+        with self._lock:
+            self.pages += 1
+            if digest in self.digests:
+                self.exact += 1
+                self.bytes_skipped += len(html)
+                return True
+            self.digests.add(digest)
+            if fingerprint is None:
+                return False
+            if self._near_seen(fingerprint, keys):
+                self.near += 1
+                self.bytes_skipped += len(html)
+                return True
+            for band, key in zip(self.bands, keys):
+                band.setdefault(key, []).append(fingerprint)
+            return False
+
+    def report(self):
+        '''
+        Print how much work skipping duplicates saved.
+        '''
+        skipped = self.exact + self.near
+        print("skipped {} of {} pages ({} exact, {} near duplicates),"
+              " {} bytes not parsed".format(skipped, self.pages, self.exact,
+                                            self.near, self.bytes_skipped))
@@ -0,0 +1,221 @@
+'''
+Memory-bounded URL frontier for the crawler.
+
+SeenSet remembers every URL the crawl has seen. The first max_in_memory
+URLs are kept in an exact in-memory set; past that they are written to a
+SQLite table in batches, and a Bloom filter over the written URLs answers
+"definitely new" for almost every new URL without touching disk. Only
+when it says "maybe seen" is the table asked.
+
+Frontier is a priority queue of URLs to crawl (lowest priority first,
+first in first out within a priority). The first max_in_memory entries
+live in a heap; past that, new entries spill to a SQLite table and every
+pop takes the smaller of the two heads, so the order is exactly that of
+one big queue.
+'''
+# pylint: disable-msg=invalid-name
+
+import hashlib
+import heapq
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+
+EXPECTED_URLS = 100000
+FALSE_POSITIVE_RATE = 0.01
+MAX_IN_MEMORY = 10000
+
+
+class BloomFilter:
+    '''
+    Bloom filter over strings.
+
+    Inputs:
+        capacity: the number of items expected
+        error_rate: the false positive rate wanted at that capacity
+    '''
+
+    def __init__(self, capacity=EXPECTED_URLS, error_rate=FALSE_POSITIVE_RATE):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) /
+                                   math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: position i is h1 + i * h2
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        '''
+        Add item to the filter.
+        '''
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class FrontierStore:
+    '''
+    The SQLite database the SeenSet and Frontier keep their overflow in.
+
+    Inputs:
+        directory: where to keep the database; None uses a temporary
+          directory that is removed on close
+    '''
+
+    def __init__(self, directory=None):
+        self._temporary = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="frontier")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.db = sqlite3.connect(os.path.join(directory, "frontier.sqlite3"))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY)
+                WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS queue (
+                priority INTEGER, seq INTEGER, url TEXT,
+                PRIMARY KEY (priority, seq)) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        '''
+        Save and close the database (removing it if it is temporary).
+        '''
+        self.db.commit()
+        self.db.close()
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SeenSet:
+    '''
+    Set of URLs kept in memory, spilling to disk (behind a Bloom filter)
+    past max_in_memory of them.
+
+    Inputs:
+        store: the FrontierStore to spill to
+        capacity: the number of URLs expected (sizes the Bloom filter)
+        max_in_memory: the most URLs kept in memory; they are written to
+          disk together once there are that many
+    '''
+
+    def __init__(self, store, capacity=EXPECTED_URLS,
+                 max_in_memory=MAX_IN_MEMORY):
+        self.db = store.db
+        self.max_in_memory = max_in_memory
+        self.in_memory = set()
+        self.bloom = BloomFilter(capacity)
+        self.on_disk = 0
+        self.false_positives = 0
+        for (url,) in self.db.execute("SELECT url FROM seen"):
+            self.bloom.add(url)
+            self.on_disk += 1
+
+    def __len__(self):
+        return len(self.in_memory) + self.on_disk
+
+    def __contains__(self, url):
+        if url in self.in_memory:
+            return True
+        if url not in self.bloom:
+            return False
+        if self.db.execute("SELECT 1 FROM seen WHERE url = ?",
+                           (url,)).fetchone() is not None:
+            return True
+        self.false_positives += 1
+        return False
+
+    def add(self, url):
+        '''
+        Add url to the set.
+
+        Outputs:
+            True if url was not in the set before
+        '''
+        if url in self:
+            return False
+        self.in_memory.add(url)
+        if len(self.in_memory) >= self.max_in_memory:
+            self.spill()
+        return True
+
+    def spill(self):
+        '''
+        Write the URLs kept in memory to disk.
+        '''
+        self.db.executemany("INSERT INTO seen VALUES (?)",
+                            ((url,) for url in self.in_memory))
+        for url in self.in_memory:
+            self.bloom.add(url)
+        self.on_disk += len(self.in_memory)
+        self.in_memory = set()
+
+
+class Frontier:
+    '''
+    Priority queue of URLs that keeps at most max_in_memory of them in
+    memory and spills the rest to disk.
+
+    Inputs:
+        store: the FrontierStore to spill to
+        max_in_memory: the most URLs kept in memory
+    '''
+
+    def __init__(self, store, max_in_memory=MAX_IN_MEMORY):
+        self.db = store.db
+        self.max_in_memory = max_in_memory
+        self.heap = []
+        (self.on_disk,) = self.db.execute(
+            "SELECT COUNT(*) FROM queue").fetchone()
+        (last_seq,) = self.db.execute(
+            "SELECT COALESCE(MAX(seq), -1) FROM queue").fetchone()
+        self.seq = last_seq + 1
+
+    def __len__(self):
+        return len(self.heap) + self.on_disk
+
+    def empty(self):
+        '''
+        Is the frontier empty?
+        '''
+        return len(self) == 0
+
+    def put(self, url, priority=0):
+        '''
+        Add url to the frontier.
+        '''
+        entry = (priority, self.seq, url)
+        self.seq += 1
+        if len(self.heap) < self.max_in_memory:
+            heapq.heappush(self.heap, entry)
+        else:
+            self.db.execute("INSERT INTO queue VALUES (?, ?, ?)", entry)
+            self.on_disk += 1
+
+    def _disk_head(self):
+        if not self.on_disk:
+            return None
+        return self.db.execute("SELECT priority, seq, url FROM queue"
+                               " ORDER BY priority, seq LIMIT 1").fetchone()
+
+    def get(self):
+        '''
+        Remove and return the URL with the lowest priority (the oldest one
+        among equals).
+        '''
+        disk_head = self._disk_head()
+        if disk_head is not None and (not self.heap or disk_head < self.heap[0]):
+            self.db.execute("DELETE FROM queue WHERE priority = ? AND seq = ?",
+                            disk_head[:2])
+            self.on_disk -= 1
+            return disk_head[2]
+        return heapq.heappop(self.heap)[2]
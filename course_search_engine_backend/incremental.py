@@ -0,0 +1,162 @@
+"""
+Incremental re-indexing of the crawler's CSV index.
+
+IndexState remembers, in a SQLite file next to the index, the content hash
+of every indexed page and the (course_id, word) pairs that page produced.
+On the next crawl only pages whose hash changed are parsed again, and the
+index file is patched with the pairs that appeared or disappeared instead
+of being written from scratch.
+"""
+# pylint: disable-msg=invalid-name
+
+import csv
+import hashlib
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    url TEXT NOT NULL,
+    course_id INTEGER NOT NULL,
+    word TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS postings_url ON postings (url);
+CREATE INDEX IF NOT EXISTS postings_pair ON postings (course_id, word);
+CREATE TEMP TABLE IF NOT EXISTS kept (url TEXT PRIMARY KEY);
+"""
+
+
+def page_digest(html):
+    '''
+    Content hash of a fetched page.
+    '''
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    return hashlib.sha256(html).hexdigest()
+
+
+class IndexState:
+    '''
+    Per-page hashes and postings behind an incrementally maintained index.
+
+    Inputs:
+        index_filename: the CSV index the state belongs to; the state is
+          kept in index_filename + ".state"
+    '''
+
+    def __init__(self, index_filename):
+        self.index_filename = index_filename
+        self.db = sqlite3.connect(index_filename + ".state")
+        self.db.executescript(SCHEMA)
+        # without saved pages (or without the index they describe) the
+        # index is written from scratch
+        self.fresh = (not os.path.exists(index_filename) or
+                      not self.db.execute("SELECT 1 FROM pages").fetchone())
+        if self.fresh:
+            self.db.execute("DELETE FROM pages")
+            self.db.execute("DELETE FROM postings")
+        self.added = []
+        self.removed = set()
+
+    def digests(self):
+        '''
+        Returns a dictionary {url: content hash} of the indexed pages.
+        '''
+        return dict(self.db.execute("SELECT url, digest FROM pages"))
+
+    def _has_pair(self, course_id, word):
+        return self.db.execute(
+            "SELECT 1 FROM postings WHERE course_id = ? AND word = ? LIMIT 1",
+            (course_id, word)).fetchone() is not None
+
+    def _drop_page(self, url):
+        old_pairs = self.db.execute(
+            "SELECT DISTINCT course_id, word FROM postings WHERE url = ?",
+            (url,)).fetchall()
+        self.db.execute("DELETE FROM postings WHERE url = ?", (url,))
+        self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+        for pair in old_pairs:
+            if not self._has_pair(*pair):
+                self.removed.add(pair)
+
+    def update_page(self, url, digest, word_to_courses):
+        '''
+        Replace the postings of url with the pairs in word_to_courses
+        ({word: set of course ids}), recording which pairs enter or leave
+        the index.
+        '''
+        self._drop_page(url)
+        self.db.execute("INSERT INTO pages VALUES (?, ?)", (url, digest))
+        for word, course_ids in word_to_courses.items():
+            for course_id in course_ids:
+                pair = (course_id, word)
+                if not self._has_pair(course_id, word):
+                    if pair in self.removed:
+                        self.removed.discard(pair)
+                    else:
+                        self.added.append(pair)
+                self.db.execute("INSERT INTO postings VALUES (?, ?, ?)",
+                                (url, course_id, word))
+
+    def keep(self, url):
+        '''
+        Record that url is still part of the crawl (see drop_unkept).
+        '''
+        self.db.execute("INSERT OR IGNORE INTO kept VALUES (?)", (url,))
+
+    def drop_unkept(self):
+        '''
+        Drop the postings of every indexed page not given to keep since the
+        last call.
+        '''
+        dropped = [url for (url,) in self.db.execute(
+            "SELECT url FROM pages WHERE url NOT IN (SELECT url FROM kept)")]
+        for url in dropped:
+            self._drop_page(url)
+        self.db.execute("DELETE FROM kept")
+
+    def keep_only(self, urls):
+        '''
+        Drop the postings of every indexed page that is not in urls.
+        '''
+        for url in urls:
+            self.keep(url)
+        self.drop_unkept()
+
+    def patch_index(self):
+        '''
+        Apply the recorded changes to the CSV index and save the state.
+
+        Outputs:
+            pair (number of rows added, number of rows removed)
+        '''
+        if self.removed or self.fresh:
+            tmp_filename = self.index_filename + ".tmp"
+            with open(tmp_filename, 'w', newline='') as out:
+                writer = csv.writer(out, delimiter='|')
+                if not self.fresh:
+                    with open(self.index_filename, newline='') as f:
+                        for row in csv.reader(f, delimiter='|'):
+                            if (int(row[0]), row[1]) not in self.removed:
+                                writer.writerow(row)
+                writer.writerows(self.added)
+            os.replace(tmp_filename, self.index_filename)
+        elif self.added:
+            with open(self.index_filename, 'a', newline='') as f:
+                csv.writer(f, delimiter='|').writerows(self.added)
+        self.db.commit()
+        counts = (len(self.added), len(self.removed))
+        self.added = []
+        self.removed = set()
+        self.fresh = False
+        return counts
+
+    def close(self):
+        '''
+        Close the state file, discarding changes that were not patched in.
+        '''
+        self.db.close()
@@ -0,0 +1,235 @@
+'''
+Output formats for the crawler's index.
+
+Every writer takes the name of its output file, receives the deduplicated
+(course_id, word) pairs one at a time through add, and finishes the output
+in close.
+
+Postings writers work the same way, but add also takes the posting's term
+frequency, field flags (tokenizer.TITLE | tokenizer.DESCRIPTION) and word
+positions.
+'''
+# pylint: disable-msg=invalid-name
+
+import csv
+import os
+import sqlite3
+import time
+
+import binary_index
+import tokenizer
+
+# rows sent to SQLite per executemany call
+SQLITE_BATCH_SIZE = 10000
+
+
+class CsvIndexWriter:
+    '''
+    Writes the index as course_id|word rows.
+
+    Inputs:
+        filename: the name for the CSV of the index
+        offset: if set, keep the first offset bytes of an existing CSV
+          and append after them (used to resume a checkpointed crawl)
+    '''
+
+    def __init__(self, filename, offset=None):
+        if offset is None:
+            self._file = open(filename, 'w', newline='')
+        else:
+            self._file = open(filename, 'r+', newline='')
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        self._writer = csv.writer(self._file, delimiter='|')
+
+    def add(self, course_id, word):
+        '''
+        Write one (course_id, word) row.
+        '''
+        self._writer.writerow([course_id, word])
+
+    def sync(self):
+        '''
+        Flush the rows written so far to disk.
+
+        Outputs:
+            the length of the CSV file in bytes
+        '''
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        '''
+        Close the CSV file.
+        '''
+        self._file.close()
+
+
+class SqliteIndexWriter:
+    '''
+    Loads the index straight into the catalog_index table of a SQLite
+    database, replacing its rows.
+
+    The rows go in with batched executemany calls inside one transaction,
+    and the table's indexes (catalog_index_word, and any other, such as
+    the ones tune_db adds) are dropped first and only built again once
+    the rows are all in, which is much cheaper than keeping them up to
+    date row by row. A table clustered on its (word, course_id) primary
+    key by tune_db does not get catalog_index_word.
+
+    Inputs:
+        filename: the SQLite database (for example course_information.sqlite3)
+    '''
+
+    def __init__(self, filename):
+        self._db = sqlite3.connect(filename)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS catalog_index
+            (course_id integer, word varchar(100))""")
+        # the indexes created with the table (sqlite_master has no sql for
+        # them) cannot be dropped
+        self._indexes = self._db.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index'"
+            " AND tbl_name = 'catalog_index' AND sql IS NOT NULL").fetchall()
+        for name, _ in self._indexes:
+            self._db.execute('DROP INDEX "{}"'.format(name))
+        self._clustered = any(
+            origin == "pk" for _, _, _, origin, _ in
+            self._db.execute("PRAGMA index_list(catalog_index)"))
+        self._db.execute("DELETE FROM catalog_index")
+        self._batch = []
+        self.rows = 0
+        # time spent in SQLite, leaving out the crawl feeding the rows
+        self.elapsed = 0.0
+
+    def _flush(self):
+        start = time.perf_counter()
+        self._db.executemany("INSERT INTO catalog_index VALUES (?, ?)",
+                             self._batch)
+        self.elapsed += time.perf_counter() - start
+        self.rows += len(self._batch)
+        self._batch = []
+
+    def add(self, course_id, word):
+        '''
+        Queue one (course_id, word) row for insertion.
+        '''
+        self._batch.append((course_id, word))
+        if len(self._batch) >= SQLITE_BATCH_SIZE:
+            self._flush()
+
+    def close(self):
+        '''
+        Insert the remaining rows, build the indexes, commit and report the
+        load rate.
+        '''
+        self._flush()
+        start = time.perf_counter()
+        for _, sql in self._indexes:
+            self._db.execute(sql)
+        if not self._clustered:
+            self._db.execute("CREATE INDEX IF NOT EXISTS catalog_index_word"
+                             " ON catalog_index (word, course_id)")
+        self._db.commit()
+        self.elapsed += time.perf_counter() - start
+        self._db.close()
+        print("loaded {} rows into catalog_index in {:.2f}s ({:.0f} rows/sec)"
+              .format(self.rows, self.elapsed,
+                      self.rows / self.elapsed if self.elapsed else 0))
+
+
+def field_names(fields):
+    '''
+    The CSV spelling of field flags: "t", "d" or "td".
+    '''
+    return ("t" if fields & tokenizer.TITLE else "") + \
+        ("d" if fields & tokenizer.DESCRIPTION else "")
+
+
+class CsvPostingsWriter:
+    '''
+    Writes postings as course_id|word|tf|fields|positions rows, where
+    fields is "t", "d" or "td" (title and/or description) and positions
+    are space-separated.
+
+    Inputs:
+        filename: the name for the CSV of the postings
+    '''
+
+    def __init__(self, filename):
+        self._file = open(filename, 'w', newline='')
+        self._writer = csv.writer(self._file, delimiter='|')
+
+    def add(self, course_id, word, tf, fields, positions):
+        '''
+        Write one posting.
+        '''
+        self._writer.writerow([course_id, word, tf, field_names(fields),
+                               " ".join(map(str, positions))])
+
+    def close(self):
+        '''
+        Close the CSV file.
+        '''
+        self._file.close()
+
+
+class SqlitePostingsWriter:
+    '''
+    Loads postings into the catalog_postings table of a SQLite database,
+    replacing its rows, with the same batching as SqliteIndexWriter.
+
+    Inputs:
+        filename: the SQLite database (for example course_information.sqlite3)
+    '''
+
+    def __init__(self, filename):
+        self._db = sqlite3.connect(filename)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS catalog_postings
+            (course_id integer, word varchar(100), tf integer,
+             in_title integer, in_description integer, positions text)""")
+        self._db.execute("DROP INDEX IF EXISTS catalog_postings_word")
+        self._db.execute("DELETE FROM catalog_postings")
+        self._batch = []
+        self.rows = 0
+
+    def _flush(self):
+        self._db.executemany(
+            "INSERT INTO catalog_postings VALUES (?, ?, ?, ?, ?, ?)",
+            self._batch)
+        self.rows += len(self._batch)
+        self._batch = []
+
+    def add(self, course_id, word, tf, fields, positions):
+        '''
+        Queue one posting for insertion.
+        '''
+        self._batch.append((course_id, word, tf,
+                            int(bool(fields & tokenizer.TITLE)),
+                            int(bool(fields & tokenizer.DESCRIPTION)),
+                            " ".join(map(str, positions))))
+        if len(self._batch) >= SQLITE_BATCH_SIZE:
+            self._flush()
+
+    def close(self):
+        '''
+        Insert the remaining postings, build the index and commit.
+        '''
+        self._flush()
+        self._db.execute("CREATE INDEX catalog_postings_word"
+                         " ON catalog_postings (word, course_id)")
+        self._db.commit()
+        self._db.close()
+
+
+INDEX_WRITERS = {
+    'csv': CsvIndexWriter,
+    'binary': binary_index.BinaryIndexWriter,
+    'sqlite': SqliteIndexWriter,
+}
+DEFAULT_FORMAT = 'csv'
+
+POSTINGS_WRITERS = {
+    'csv': CsvPostingsWriter,
+    'sqlite': SqlitePostingsWriter,
+}
@@ -0,0 +1,216 @@
+'''
+Crawl instrumentation.
+
+CrawlMetrics collects how long every stage of the crawl takes for every
+page (fetch, parse, link extraction, extracting the index words and
+writing the index), the bytes fetched, the (course_id, word) pairs
+emitted and the depth of the crawl's queues. At the end of a crawl it
+summarizes them (percentiles per stage, pages per second) and can dump
+every recorded event as a JSON trace.
+
+Fetches are timed by MetricsAdapter, which plugs into a requests.Session
+(see util.make_session); the other stages are timed by the crawler.
+'''
+# pylint: disable-msg=invalid-name
+
+import collections
+import contextlib
+import json
+import threading
+import time
+
+import requests.adapters
+
+# the order stages are reported in
+STAGES = ("fetch", "parse", "links", "extract", "write")
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    '''
+    The p-th percentile (nearest rank) of a sorted, non-empty list.
+    '''
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[rank - 1]
+
+
+def timed(func, *args):
+    '''
+    Call func(*args) and return the pair (seconds taken, result). Handy
+    for timing work done in another process.
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+class CrawlMetrics:
+    '''
+    Thread-safe collector of per-page crawl measurements.
+
+    Inputs:
+        trace: keep every event for write_trace (otherwise only the
+          per-stage timings and totals are kept)
+    '''
+
+    def __init__(self, trace=False):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.timings = collections.defaultdict(list)
+        self.totals = collections.Counter()
+        self.depths = collections.defaultdict(list)
+        self.events = [] if trace else None
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, url=None, **counts):
+        '''
+        Record that stage took seconds for the page url, adding counts
+        (e.g. bytes=...) to the crawl's totals.
+        '''
+        with self._lock:
+            self.timings[stage].append(seconds)
+            self.totals.update(counts)
+            if self.events is not None:
+                event = {"t": time.perf_counter() - self.started,
+                         "stage": stage, "seconds": seconds, "url": url}
+                event.update(counts)
+                self.events.append(event)
+
+    @contextlib.contextmanager
+    def time(self, stage, url=None):
+        '''
+        Context manager recording the time its body takes as stage.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, url)
+
+    def queue_depth(self, queue, depth):
+        '''
+        Record the current number of items waiting in queue.
+        '''
+        with self._lock:
+            self.depths[queue].append(depth)
+            if self.events is not None:
+                self.events.append({"t": time.perf_counter() - self.started,
+                                    "queue": queue, "depth": depth})
+
+    def adapter(self, inner):
+        '''
+        Create a transport adapter that times the requests it sends on to
+        the adapter inner.
+        '''
+        return MetricsAdapter(self, inner)
+
+    def finish(self):
+        '''
+        Mark the end of the crawl.
+        '''
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        '''
+        Returns a dictionary summarizing the crawl: elapsed seconds, pages
+        fetched per second, the totals, and for every stage and queue
+        its count, total, mean, percentiles and maximum.
+        '''
+        with self._lock:
+            finished = self.finished or time.perf_counter()
+            elapsed = finished - self.started
+            pages = len(self.timings.get("fetch", ()))
+            stages = {}
+            for stage in sorted(self.timings, key=stage_order):
+                stages[stage] = describe(self.timings[stage])
+            return {
+                "elapsed": elapsed,
+                "pages": pages,
+                "pages_per_sec": pages / elapsed if elapsed else 0.0,
+                "totals": dict(self.totals),
+                "stages": stages,
+                "queues": {queue: describe(depths)
+                           for queue, depths in sorted(self.depths.items())},
+            }
+
+    def report(self):
+        '''
+        Print the summary.
+        '''
+        summary = self.summary()
+        print("{pages} pages in {elapsed:.2f}s ({pages_per_sec:.1f} pages/sec)"
+              .format(**summary))
+        for name, value in sorted(summary["totals"].items()):
+            print("  {:<8} {:>12}".format(name, value))
+        print("  {:<8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            "stage", "count", "total s",
+            *["p{} ms".format(p) for p in PERCENTILES], "max ms"))
+        for stage, stats in summary["stages"].items():
+            print("  {:<8} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}"
+                  .format(stage, stats["count"], stats["total"],
+                          *[stats["p{}".format(p)] * 1000 for p in PERCENTILES],
+                          stats["max"] * 1000))
+        for queue, stats in summary["queues"].items():
+            print("  queue {:<10} mean depth {:.1f}, max {}".format(
+                queue, stats["mean"], stats["max"]))
+
+    def write_trace(self, filename):
+        '''
+        Write the summary and every recorded event as JSON to filename.
+        '''
+        summary = self.summary()
+        with self._lock:
+            events = list(self.events or [])
+        with open(filename, "w") as f:
+            json.dump({"summary": summary, "events": events}, f, indent=1)
+
+
+def stage_order(stage):
+    '''
+    Sort key putting the known STAGES first, in pipeline order.
+    '''
+    if stage in STAGES:
+        return (STAGES.index(stage), stage)
+    return (len(STAGES), stage)
+
+
+def describe(values):
+    '''
+    Count, total, mean, PERCENTILES and maximum of a non-empty list.
+    '''
+    ordered = sorted(values)
+    stats = {"count": len(ordered), "total": sum(ordered),
+             "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+    for p in PERCENTILES:
+        stats["p{}".format(p)] = percentile(ordered, p)
+    return stats
+
+
+class MetricsAdapter(requests.adapters.BaseAdapter):
+    '''
+    Transport adapter that records the latency and size of every
+    response as the "fetch" stage.
+
+    Inputs:
+        metrics: the CrawlMetrics
+        inner: the adapter that actually sends the requests
+    '''
+
+    def __init__(self, metrics, inner):
+        super().__init__()
+        self.metrics = metrics
+        self.inner = inner
+
+    def close(self):
+        self.inner.close()
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        size = 0
+        try:
+            response = self.inner.send(request, **kwargs)
+            size = len(response.content)
+            return response
+        finally:
+            self.metrics.record("fetch", time.perf_counter() - start,
+                                request.url, bytes=size)
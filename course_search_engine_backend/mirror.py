@@ -0,0 +1,332 @@
+'''
+Local stand-in for the catalog host.
+
+Serves catalog pages over HTTP from one of two sources:
+
+    SnapshotSource   a page cache directory recorded by a crawl
+                     (python3 crawler.py --cache-dir <directory>)
+    SyntheticCatalog a generated catalog of any size, with the same
+                     index -> area -> program page structure and
+                     courseblock markup as the real one
+
+The server is an HTTP proxy as well as a plain server, so the crawler
+needs no change to use it: with HTTP_PROXY pointing at the mirror,
+requests sends it the catalog URLs and it answers them.
+
+    python3 mirror.py snapshot <page cache directory> [--port 8000]
+    python3 mirror.py synthetic <number of pages> [--port 8000]
+    HTTP_PROXY=http://127.0.0.1:8000 python3 crawler.py 1000
+'''
+# pylint: disable-msg=invalid-name
+
+import argparse
+import http.server
+import json
+import random
+import threading
+import urllib.parse
+
+import page_cache
+
+HOST = "www.classes.cs.uchicago.edu"
+CATALOG_URL = ("http://www.classes.cs.uchicago.edu/archive/2015/winter"
+               "/12200-1/new.collegecatalog.uchicago.edu/")
+START_PAGE = "index.html"
+PORT = 8000
+
+# synthetic catalog shape: program pages per area page, and course
+# blocks per program page
+PROGRAMS_PER_AREA = 50
+MIN_COURSES = 4
+MAX_COURSES = 24
+# share of the courses of a program page that are part of a sequence
+SEQUENCE_RATE = 0.15
+DESCRIPTION_WORDS = (60, 160)
+VOCABULARY = (
+    "introduction advanced theory methods history language culture society"
+    " analysis data computation systems structure design research seminar"
+    " students course topics reading writing survey problems evidence"
+    " modern ancient political economic social scientific literary critical"
+    " quantitative qualitative field laboratory practice texts sources"
+    " policy law health biology chemistry physics mathematics statistics"
+    " philosophy religion music art film media visual global urban"
+    " environment energy evolution genetics cognition language learning"
+    " programming algorithms networks security models inference").split()
+STOP_WORDS = "the and of a an to in for on with is are this that we".split()
+
+
+class SnapshotSource:
+    '''
+    Pages recorded in a page_cache.PageCache directory.
+
+    Inputs:
+        directory: the page cache directory
+    '''
+
+    def __init__(self, directory):
+        self.cache = page_cache.PageCache(directory, offline=True)
+
+    def get(self, url):
+        '''
+        Returns the body (bytes) of url, or None if it was not recorded.
+        '''
+        entry = self.cache.get(url)
+        return None if entry is None else entry["body"]
+
+
+class SyntheticCatalog:
+    '''
+    A generated catalog of about num_pages pages. Every page is built
+    from its URL and the seed when it is requested, so the catalog costs
+    no memory or disk whatever its size, and the same seed always gives
+    the same pages.
+
+    Inputs:
+        num_pages: the number of pages the crawl can reach (start page,
+          area pages and program pages)
+        course_codes: the course codes to describe (e.g. the keys of
+          course_map.json), so the pages produce index rows
+        seed: the random seed of the catalog
+    '''
+
+    def __init__(self, num_pages, course_codes, seed=0):
+        self.course_codes = sorted(course_codes)
+        self.seed = seed
+        # 1 start page + areas + programs, with PROGRAMS_PER_AREA
+        # programs per area
+        areas = max(1, -(-(num_pages - 1) // (PROGRAMS_PER_AREA + 1)))
+        self.num_programs = max(1, num_pages - 1 - areas)
+        self.num_areas = -(-self.num_programs // PROGRAMS_PER_AREA)
+
+    def __len__(self):
+        return 1 + self.num_areas + self.num_programs
+
+    def area_url(self, area):
+        '''
+        The URL of an area page.
+        '''
+        return "{}thecollege/area{}/".format(CATALOG_URL, area)
+
+    def program_url(self, program):
+        '''
+        The URL of a program page.
+        '''
+        return "{}thecollege/area{}/program{}.html".format(
+            CATALOG_URL, program // PROGRAMS_PER_AREA, program)
+
+    def urls(self):
+        '''
+        Generates the URL of every page of the catalog.
+        '''
+        yield CATALOG_URL + START_PAGE
+        for area in range(self.num_areas):
+            yield self.area_url(area)
+        for program in range(self.num_programs):
+            yield self.program_url(program)
+
+    def get(self, url):
+        '''
+        Returns the body (bytes) of url, or None if it is not in the
+        catalog.
+        '''
+        if not url.startswith(CATALOG_URL):
+            return None
+        path = url[len(CATALOG_URL):]
+        if path in ("", START_PAGE):
+            html = self._start_page()
+        elif path.startswith("thecollege/area"):
+            area, _, page = path[len("thecollege/area"):].partition("/")
+            if not area.isdigit():
+                return None
+            if page == "":
+                html = self._area_page(int(area))
+            elif page.startswith("program") and page.endswith(".html") and \
+                    page[7:-5].isdigit():
+                html = self._program_page(int(area), int(page[7:-5]))
+            else:
+                return None
+        else:
+            return None
+        return None if html is None else html.encode("utf-8")
+
+    def _page(self, title, body):
+        # the catalog's navigation links repeat on every page
+        return ('<html><head><title>{0}</title></head><body>'
+                '<div id="header"><a href="{1}{2}">Catalog</a>'
+                '<a href="{1}thecollege/area0/">The College</a>'
+                '<a href="mailto:catalog@uchicago.edu">Contact</a>'
+                '<a href="http://www.uchicago.edu/">UChicago</a></div>'
+                '<div id="content"><h1 class="page-title">{0}</h1>{3}</div>'
+                '</body></html>').format(title, CATALOG_URL, START_PAGE, body)
+
+    def _start_page(self):
+        links = "".join('<li><a href="thecollege/area{0}/">Area {0}</a></li>'
+                        .format(area) for area in range(self.num_areas))
+        return self._page("College Catalog", "<ul>{}</ul>".format(links))
+
+    def _area_page(self, area):
+        if area >= self.num_areas:
+            return None
+        first = area * PROGRAMS_PER_AREA
+        last = min(first + PROGRAMS_PER_AREA, self.num_programs)
+        # relative, root-relative and absolute links, as in the catalog
+        links = []
+        for program in range(first, last):
+            if program % 3 == 0:
+                href = "program{}.html".format(program)
+            elif program % 3 == 1:
+                href = urllib.parse.urlsplit(self.program_url(program)).path
+            else:
+                href = self.program_url(program)
+            links.append('<li><a href="{}">Program {}</a></li>'.format(
+                href, program))
+        return self._page("Area {}".format(area),
+                          "<ul>{}</ul>".format("".join(links)))
+
+    def _program_page(self, area, program):
+        if program >= self.num_programs or program // PROGRAMS_PER_AREA != area:
+            return None
+        rnd = random.Random("{}:{}".format(self.seed, program))
+        blocks = []
+        for _ in range(rnd.randint(MIN_COURSES, MAX_COURSES)):
+            if rnd.random() < SEQUENCE_RATE:
+                blocks.append(self._sequence(rnd))
+            else:
+                blocks.append(self._course_block(
+                    "courseblock main", rnd.choice(self.course_codes), rnd))
+        return self._page("Program {}".format(program),
+                          '<div class="courses">{}</div>'.format("".join(blocks)))
+
+    def _sequence(self, rnd):
+        dept = rnd.choice(self.course_codes).split()[0]
+        start = rnd.randrange(10000, 29000, 100)
+        numbers = [str(start + 100 * k) for k in range(rnd.randint(2, 3))]
+        header = self._course_block(
+            "courseblock main", "{} {}".format(dept, "-".join(numbers)), rnd)
+        return header + "".join(
+            self._course_block("courseblock subsequence",
+                               "{} {}".format(dept, number), rnd)
+            for number in numbers)
+
+    def _course_block(self, block_class, code, rnd):
+        dept, _, number = code.partition(" ")
+        title = " ".join(rnd.choice(VOCABULARY).capitalize()
+                         for _ in range(rnd.randint(2, 5)))
+        words = []
+        for _ in range(rnd.randint(*DESCRIPTION_WORDS)):
+            roll = rnd.random()
+            if roll < 0.35:
+                words.append(rnd.choice(STOP_WORDS))
+            elif roll < 0.4:
+                words.append(rnd.choice(VOCABULARY) + str(rnd.randint(1, 99)))
+            else:
+                words.append(rnd.choice(VOCABULARY))
+        return ('<div class="{}"><p class="courseblocktitle"><strong>'
+                '{}&#160;{}.  {}.  100 Units.</strong></p>'
+                '<p class="courseblockdesc">{}.</p>'
+                '<p class="courseblockdetail">Instructor(s): Staff'
+                '     Terms Offered: Autumn</p></div>').format(
+                    block_class, dept, number, title, " ".join(words).capitalize())
+
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Answers GET requests from the server's source, both as an HTTP proxy
+    (absolute URL in the request line) and as a plain server (paths are
+    taken to be on HOST).
+    '''
+    protocol_version = "HTTP/1.1"
+    # the headers and the body go out in separate writes; with Nagle's
+    # algorithm the body waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        Serve one page, or a 404.
+        '''
+        url = self.path
+        if not url.startswith(("http://", "https://")):
+            url = "http://" + HOST + url
+        body = self.server.source.get(url)
+        self.server.count(body)
+        if body is None:
+            self.send_response(404)
+            body = b""
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MirrorServer(http.server.ThreadingHTTPServer):
+    '''
+    Threaded HTTP server for a page source (see SnapshotSource and
+    SyntheticCatalog) that counts what it serves.
+
+    Inputs:
+        source: an object whose get(url) returns a page body or None
+        port: the port to listen on (0 picks a free one)
+    '''
+    daemon_threads = True
+    # socketserver's default backlog of 5 drops the connections of a
+    # crawl with many requests in flight (see async_crawler.py)
+    request_queue_size = 1024
+
+    def __init__(self, source, port=PORT):
+        super().__init__(("127.0.0.1", port), MirrorHandler)
+        self.source = source
+        self.requests = 0
+        self.not_found = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        '''
+        The URL to use as HTTP_PROXY.
+        '''
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def count(self, body):
+        '''
+        Count one request answered with body (None for a 404).
+        '''
+        with self._lock:
+            self.requests += 1
+            if body is None:
+                self.not_found += 1
+            else:
+                self.bytes += len(body)
+
+    def start(self):
+        '''
+        Serve on a background thread; returns the server.
+        '''
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python3 mirror.py")
+    arg_parser.add_argument("source", choices=["snapshot", "synthetic"])
+    arg_parser.add_argument("location", help="page cache directory, or number"
+                                             " of synthetic pages")
+    arg_parser.add_argument("--port", type=int, default=PORT)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--course-map", default="course_map.json")
+    args = arg_parser.parse_args()
+
+    if args.source == "snapshot":
+        page_source = SnapshotSource(args.location)
+    else:
+        with open(args.course_map) as f:
+            page_source = SyntheticCatalog(int(args.location), json.load(f),
+                                           args.seed)
+    server = MirrorServer(page_source, args.port)
+    print("serving the catalog; crawl with HTTP_PROXY={}".format(server.url))
+    server.serve_forever()
@@ -0,0 +1,329 @@
+"""
+On-disk cache of fetched catalog pages.
+
+Page bodies are stored once per distinct content, named by their SHA-256,
+and a small SQLite table maps each normalized URL to its body together
+with the validators (ETag / Last-Modified) needed to revalidate it. The
+cache is bounded by the total size of the stored bodies and evicts the
+least recently used URLs first.
+
+CachingAdapter plugs the cache into a requests.Session (see
+util.make_session) in front of the adapter that goes to the network, so
+util.get_request serves cached pages without any change to its callers.
+
+Several processes can share a cache directory (the shards of a sharded
+crawl do): the index is in WAL mode, so readers never wait for a writer,
+and every write is committed at once, so no process holds the write lock
+for longer than one page. A write that still cannot get the lock within
+BUSY_TIMEOUT seconds is counted in write_errors and the page is served
+uncached.
+"""
+# pylint: disable-msg=invalid-name, arguments-differ
+
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+import requests.adapters
+import requests.structures
+
+import util
+
+MAX_BYTES = 512 * 1024 * 1024
+# hits whose last use is remembered before it is written to the index
+TOUCH_BATCH = 256
+# seconds a write waits for another process to release the index
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    encoding TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used);
+CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest);
+"""
+
+
+class PageCache:
+    '''
+    Persistent, size-bounded LRU cache of page bodies keyed by URL.
+
+    The total size of the bodies is added up when the cache is opened and
+    kept up to date by put and eviction. Every put is committed at once
+    (cheaply: the index is in WAL mode and only syncs at checkpoints), and
+    the last use of pages read by get is written TOUCH_BATCH pages at a
+    time, before eviction and on close, so hits do not cost a write each.
+
+    Inputs:
+        directory: where the bodies and the index are stored (created if
+          it does not exist)
+        max_bytes: upper bound on the total size of the stored bodies
+        offline: if True, pages are only ever served from the cache and
+          a miss behaves like a 404 instead of going to the network
+    '''
+
+    def __init__(self, directory, max_bytes=MAX_BYTES, offline=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.write_errors = 0
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"),
+                                   timeout=BUSY_TIMEOUT,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+        self._bytes = self._stored_bytes()
+        self._touched = {}
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def _stored_bytes(self):
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM"
+            " (SELECT DISTINCT digest, size FROM pages)").fetchone()
+        return total
+
+    def record(self, hit, revalidated=False):
+        '''
+        Count a lookup answered from the cache (hit) or not.
+        '''
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if revalidated:
+                self.revalidated += 1
+
+    def get(self, url):
+        '''
+        Look up url in the cache.
+
+        Outputs:
+            dictionary with the body and its validators, or None
+        '''
+        key = util.normalize_url(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, size, encoding, etag, last_modified FROM pages"
+                " WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            digest, size, encoding, etag, last_modified = row
+            try:
+                with open(self._object_path(digest), "rb") as f:
+                    body = f.read()
+            except OSError:
+                self._touched.pop(key, None)
+                with self._writing():
+                    self._db.execute("DELETE FROM pages WHERE url = ?", (key,))
+                    self._release(digest, size)
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                with self._writing():
+                    self._flush_touched()
+        return {"url": url, "body": body, "encoding": encoding,
+                "etag": etag, "last_modified": last_modified}
+
+    def put(self, url, body, encoding=None, etag=None, last_modified=None):
+        '''
+        Store body as the content of url, then evict least recently used
+        pages until the cache fits in max_bytes.
+        '''
+        key = util.normalize_url(url)
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            with self._writing():
+                old = self._db.execute(
+                    "SELECT digest, size FROM pages WHERE url = ?",
+                    (key,)).fetchone()
+                if old is None or old[0] != digest:
+                    if not self._in_use(digest):
+                        self._bytes += len(body)
+                self._touched.pop(key, None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, digest, len(body), encoding, etag, last_modified,
+                     time.time()))
+                if old is not None and old[0] != digest:
+                    self._release(*old)
+                self._evict()
+
+    @contextlib.contextmanager
+    def _writing(self):
+        '''
+        Commit the writes of the with block, or, if another process kept
+        the index locked past BUSY_TIMEOUT, roll them back and count a
+        write error.
+        '''
+        size = self._bytes
+        try:
+            yield
+            self._db.commit()
+        except sqlite3.OperationalError:
+            self._db.rollback()
+            self._bytes = size
+            self.write_errors += 1
+
+    def _in_use(self, digest):
+        return self._db.execute("SELECT 1 FROM pages WHERE digest = ?",
+                                (digest,)).fetchone() is not None
+
+    def _release(self, digest, size):
+        '''
+        Delete the body of digest, and stop counting its size, if no URL
+        refers to it any more.
+        '''
+        if self._in_use(digest):
+            return
+        self._bytes -= size
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE pages SET last_used = ? WHERE url = ?",
+                                 [(used, key) for key, used in
+                                  self._touched.items()])
+            self._touched.clear()
+
+    def size(self):
+        '''
+        Total size in bytes of the distinct bodies in the cache.
+        '''
+        with self._lock:
+            return self._bytes
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        # evict in the order of the pages' real last uses
+        self._flush_touched()
+        rows = self._db.execute(
+            "SELECT url, digest, size FROM pages ORDER BY last_used")
+        for url, digest, size in rows.fetchall():
+            if self._bytes <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._release(digest, size)
+
+    def report(self):
+        '''
+        Print the writes to the cache that failed, if any did.
+        '''
+        if self.write_errors:
+            print("{} writes to the page cache in {} failed: its index was"
+                  " locked by another process".format(self.write_errors,
+                                                      self.directory))
+
+    def adapter(self, inner):
+        '''
+        Create a transport adapter that serves requests from this cache
+        and sends the others on to the adapter inner.
+        '''
+        return CachingAdapter(self, inner)
+
+    def close(self):
+        '''
+        Write out the pending changes and close the cache index.
+        '''
+        with self._lock:
+            with self._writing():
+                self._flush_touched()
+            self._db.close()
+
+
+def build_response(request, entry):
+    '''
+    Build a requests.Response from a cache entry (or an empty 404 when
+    entry is None) so it can be returned by an adapter.
+    '''
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = 200
+    response.headers = requests.structures.CaseInsensitiveDict()
+    if entry is None:
+        response.status_code = 404
+        response._content = b""
+        return response
+    response._content = entry["body"]
+    response.encoding = entry["encoding"]
+    if entry["etag"]:
+        response.headers["ETag"] = entry["etag"]
+    if entry["last_modified"]:
+        response.headers["Last-Modified"] = entry["last_modified"]
+    return response
+
+
+class CachingAdapter(requests.adapters.BaseAdapter):
+    '''
+    Transport adapter that answers GETs from a PageCache.
+
+    Cached pages are revalidated with If-None-Match / If-Modified-Since;
+    a 304 is answered from the cache and a 200 refreshes it. In offline
+    mode the network is never used.
+
+    Inputs:
+        cache: the PageCache
+        inner: the adapter that sends requests the cache cannot answer
+    '''
+
+    def __init__(self, cache, inner):
+        super().__init__()
+        self.cache = cache
+        self.inner = inner
+
+    def close(self):
+        self.inner.close()
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            return self.inner.send(request, **kwargs)
+        entry = self.cache.get(request.url)
+        if self.cache.offline:
+            self.cache.record(entry is not None)
+            return build_response(request, entry)
+        if entry is not None:
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.inner.send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.record(True, revalidated=True)
+            return build_response(request, entry)
+        self.cache.record(False)
+        if response.status_code == 200:
+            self.cache.put(request.url, response.content,
+                           encoding=response.encoding,
+                           etag=response.headers.get("ETag"),
+                           last_modified=response.headers.get("Last-Modified"))
+        return response
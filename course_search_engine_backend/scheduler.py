@@ -0,0 +1,372 @@
+'''
+Polite, adaptive request scheduling for the crawler.
+
+PoliteScheduler keeps one HostState per host. Before a request goes out
+it waits for two things: a free slot under the host's concurrency limit
+and a token from the host's token bucket. Both limits adapt to what the
+host reports back: they grow slowly while responses come back quickly
+and are halved on a 429 or 5xx, waiting out Retry-After when the server
+sends one. The host's robots.txt is read once; disallowed pages are not
+fetched, and a Crawl-delay caps the request rate.
+
+SchedulingAdapter plugs the scheduler into a requests.Session (see
+util.make_session) in front of the adapter that goes to the network, and
+retries requests itself so that every attempt is paced.
+async_crawler.PoliteTransport does the same for the asyncio crawl.
+'''
+# pylint: disable-msg=invalid-name, too-many-instance-attributes
+
+import threading
+import time
+import urllib.parse
+import urllib.robotparser
+
+import requests
+import requests.adapters
+import requests.structures
+
+MAX_RATE = 10.0
+MIN_RATE = 0.2
+MAX_CONCURRENCY = 16
+# responses slower than this (in seconds) stop the concurrency from growing
+TARGET_LATENCY = 1.0
+ROBOTS_TIMEOUT = 10
+USER_AGENT = "*"
+BACKOFF_STATUSES = (429, 500, 502, 503, 504)
+# errors a request is retried on, as urllib3 retries them
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)
+# as util.BACKOFF_FACTOR
+BACKOFF_FACTOR = 0.5
+
+
+class HostState:
+    '''
+    Token bucket, concurrency limit and robots.txt rules for one host.
+
+    Inputs:
+        max_rate: the most requests per second ever sent to the host
+        max_concurrency: the most requests ever in flight to the host
+    '''
+
+    def __init__(self, max_rate=MAX_RATE, max_concurrency=MAX_CONCURRENCY):
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        # start gently and let successful responses open things up
+        self.rate = max(MIN_RATE, max_rate / 2)
+        self.concurrency = 1.0
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.robots = None
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens +
+                          (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def try_acquire(self):
+        '''
+        Take the right to send a request to the host if it is free now.
+
+        Outputs:
+            0 if it was taken, else the seconds to wait before trying
+            again (None: until a request to the host finishes)
+        '''
+        with self.condition:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                return None
+            if self.tokens < 1.0:
+                return (1.0 - self.tokens) / self.rate
+            self.tokens -= 1.0
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        '''
+        Block until a request may be sent to the host.
+        '''
+        with self.condition:
+            while True:
+                wait = self.try_acquire()
+                if wait == 0:
+                    return
+                self.condition.wait(wait)
+
+    def release(self, status_code, latency, retry_after=None):
+        '''
+        Record the outcome of a request and adapt the limits to it.
+
+        Inputs:
+            status_code: HTTP status of the response (None on failure)
+            latency: seconds the request took
+            retry_after: seconds the server asked us to wait, if any
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            if status_code is None or status_code in BACKOFF_STATUSES:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(MIN_RATE, self.rate / 2)
+                if retry_after:
+                    self.paused_until = time.monotonic() + retry_after
+            else:
+                self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate)
+                if latency <= TARGET_LATENCY:
+                    self.concurrency = min(self.max_concurrency,
+                                           self.concurrency +
+                                           1.0 / self.concurrency)
+            self.condition.notify_all()
+
+    def set_crawl_delay(self, delay):
+        '''
+        Cap the request rate to one request every delay seconds.
+        '''
+        with self.condition:
+            self.max_rate = min(self.max_rate, 1.0 / delay)
+            self.rate = min(self.rate, self.max_rate)
+
+
+def host_key(url):
+    '''
+    The (scheme, host) pair the scheduler keeps the state of url's host
+    under.
+    '''
+    parsed_url = urllib.parse.urlsplit(url)
+    return (parsed_url.scheme, parsed_url.netloc)
+
+
+def robots_url(url):
+    '''
+    The URL of the robots.txt of url's host.
+    '''
+    return urllib.parse.urlunsplit(host_key(url) + ("/robots.txt", "", ""))
+
+
+def parse_retry_after(value):
+    '''
+    Seconds to wait from a Retry-After header given in seconds (the
+    HTTP-date form is ignored).
+    '''
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class PoliteScheduler:
+    '''
+    Per-host rate limiting, adaptive concurrency and robots.txt handling.
+
+    Inputs:
+        max_rate: the most requests per second sent to any one host
+        max_concurrency: the most requests in flight to any one host
+        user_agent: the agent robots.txt rules are looked up for
+    '''
+
+    def __init__(self, max_rate=MAX_RATE, max_concurrency=MAX_CONCURRENCY,
+                 user_agent=USER_AGENT):
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.user_agent = user_agent
+        self.hosts = {}
+        self.requests = 0
+        self.errors = 0
+        self.disallowed = 0
+        self.started = None
+        self.finished = None
+        # reentrant, so host can add the host it holds the lock for
+        self._lock = threading.RLock()
+
+    def host(self, url, inner, proxies=None):
+        '''
+        Returns the HostState of the host of url, reading its robots.txt
+        through the adapter inner (with the given proxies) the first time
+        the host is seen.
+        '''
+        with self._lock:
+            state = self.known_host(url)
+            if state is None:
+                # hold the lock so the other threads wait for the rules
+                state = self.add_host(url, self._read_robots(url, inner,
+                                                             proxies))
+        return state
+
+    def known_host(self, url):
+        '''
+        Returns the HostState of the host of url, or None if the host has
+        not been added yet.
+        '''
+        with self._lock:
+            return self.hosts.get(host_key(url))
+
+    def add_host(self, url, robots_text):
+        '''
+        Add the host of url, following the rules of robots_text (the text of
+        its robots.txt, "" if it has none), and return its HostState.
+        '''
+        state = HostState(self.max_rate, self.max_concurrency)
+        robots = urllib.robotparser.RobotFileParser(robots_url(url))
+        robots.parse(robots_text.splitlines())
+        state.robots = robots
+        delay = robots.crawl_delay(self.user_agent)
+        if delay:
+            state.set_crawl_delay(float(delay))
+        with self._lock:
+            self.hosts[host_key(url)] = state
+        return state
+
+    @staticmethod
+    def _read_robots(url, inner, proxies=None):
+        try:
+            request = requests.Request("GET", robots_url(url)).prepare()
+            response = inner.send(request, timeout=ROBOTS_TIMEOUT,
+                                  proxies=proxies)
+            return response.text if response.status_code == 200 else ""
+        except Exception:  # pylint: disable=broad-except
+            # no readable robots.txt means no restrictions
+            return ""
+
+    def can_fetch(self, state, url):
+        '''
+        Does the host's robots.txt allow fetching url?
+        '''
+        return state.robots is None or \
+            state.robots.can_fetch(self.user_agent, url)
+
+    def record(self, status_code, start):
+        '''
+        Count a request that was sent at start (time.monotonic) and just
+        finished, for the throughput report.
+        '''
+        with self._lock:
+            if self.started is None or start < self.started:
+                self.started = start
+            self.finished = time.monotonic()
+            self.requests += 1
+            if status_code is None or status_code >= 400:
+                self.errors += 1
+
+    def record_disallowed(self):
+        '''
+        Count a page robots.txt kept us from fetching.
+        '''
+        with self._lock:
+            self.disallowed += 1
+
+    def report(self):
+        '''
+        Print the requests the scheduler sent and its throughput.
+        '''
+        print("{requests} requests ({errors} failed, {disallowed} disallowed"
+              " by robots.txt) at {pages_per_sec:.1f} pages/sec".format(
+                  **self.throughput()))
+
+    def throughput(self):
+        '''
+        Returns a dictionary describing what the scheduler achieved: the
+        number of requests, errors and disallowed pages, the pages per
+        second, and the current rate and concurrency of every host.
+        '''
+        with self._lock:
+            elapsed = 0.0
+            if self.started is not None:
+                elapsed = self.finished - self.started
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "disallowed": self.disallowed,
+                "elapsed": elapsed,
+                "pages_per_sec": self.requests / elapsed if elapsed else 0.0,
+                "hosts": {netloc: {"rate": state.rate,
+                                   "concurrency": int(state.concurrency)}
+                          for (_, netloc), state in self.hosts.items()},
+            }
+
+    def adapter(self, inner, retries=0, backoff_factor=BACKOFF_FACTOR):
+        '''
+        Create a transport adapter that schedules requests and sends them
+        on to the adapter inner (which should not retry them itself),
+        retrying them as SchedulingAdapter does.
+        '''
+        return SchedulingAdapter(self, inner, retries, backoff_factor)
+
+
+def disallowed_response(request):
+    '''
+    An empty 403 for a page robots.txt does not allow us to fetch.
+    '''
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = 403
+    response.headers = requests.structures.CaseInsensitiveDict()
+    response._content = b""
+    return response
+
+
+class SchedulingAdapter(requests.adapters.BaseAdapter):
+    '''
+    Transport adapter that sends every request through a PoliteScheduler.
+
+    Requests that fail to connect or time out, or are answered with one
+    of BACKOFF_STATUSES, are retried up to retries more times, sleeping
+    backoff_factor * 2 ** (retry - 1) seconds between attempts. Every
+    attempt waits for the scheduler, so retries are paced like any other
+    request and wait out the Retry-After of the answer before them.
+
+    Inputs:
+        scheduler: the PoliteScheduler
+        inner: the adapter that actually sends the requests
+        retries: the most times a request is sent again
+        backoff_factor: the base of the sleep between two attempts
+    '''
+
+    def __init__(self, scheduler, inner, retries=0,
+                 backoff_factor=BACKOFF_FACTOR):
+        super().__init__()
+        self.scheduler = scheduler
+        self.inner = inner
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+    def close(self):
+        self.inner.close()
+
+    def send(self, request, **kwargs):
+        state = self.scheduler.host(request.url, self.inner,
+                                    kwargs.get("proxies"))
+        if not self.scheduler.can_fetch(state, request.url):
+            self.scheduler.record_disallowed()
+            return disallowed_response(request)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            state.acquire()
+            start = time.monotonic()
+            status_code = None
+            retry_after = None
+            try:
+                response = self.inner.send(request, **kwargs)
+                status_code = response.status_code
+                retry_after = parse_retry_after(
+                    response.headers.get("Retry-After"))
+            except RETRY_ERRORS:
+                if attempt == self.retries:
+                    raise
+                continue
+            finally:
+                state.release(status_code, time.monotonic() - start,
+                              retry_after)
+                self.scheduler.record(status_code, start)
+            if status_code not in BACKOFF_STATUSES or attempt == self.retries:
+                return response
+            # read the body so that its connection can be reused
+            response.content  # pylint: disable=pointless-statement
+            response.close()
+        return response
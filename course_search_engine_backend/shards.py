@@ -0,0 +1,102 @@
+'''
+Index shards for the multi-process crawl.
+
+Each crawl process owns the pages whose URL hashes to its shard (see
+shard_of) and writes the (course_id, word) pairs it finds as runs: files
+of at most run_size pairs, sorted and deduplicated. merge_runs then does
+an external k-way merge of every run of every shard, dropping the pairs
+several runs share, into any of the index_writers formats. No process
+ever holds more than one run's worth of pairs in memory.
+'''
+# pylint: disable-msg=invalid-name
+
+import csv
+import hashlib
+import heapq
+
+# pairs sorted in memory before they are written out as a run
+RUN_SIZE = 1000000
+
+
+def shard_of(url, num_shards):
+    '''
+    The shard (0 to num_shards - 1) that owns url. Stable across runs and
+    processes, unlike hash().
+    '''
+    digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+class RunWriter:
+    '''
+    Writes (course_id, word) pairs as sorted, deduplicated run files.
+
+    Inputs:
+        prefix: run files are named prefix.run0, prefix.run1, ...
+        run_size: the most pairs held in memory before a run is written
+    '''
+
+    def __init__(self, prefix, run_size=RUN_SIZE):
+        self.prefix = prefix
+        self.run_size = run_size
+        self.runs = []
+        self._pairs = set()
+
+    def add(self, course_id, word):
+        '''
+        Add one (course_id, word) pair.
+        '''
+        self._pairs.add((course_id, word))
+        if len(self._pairs) >= self.run_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pairs:
+            return
+        filename = "{}.run{}".format(self.prefix, len(self.runs))
+        with open(filename, 'w', newline='') as f:
+            csv.writer(f, delimiter='|').writerows(sorted(self._pairs))
+        self.runs.append(filename)
+        self._pairs = set()
+
+    def close(self):
+        '''
+        Write the last run.
+
+        Outputs:
+            list of the run filenames
+        '''
+        self._flush()
+        return self.runs
+
+
+def read_run(filename):
+    '''
+    Generates the (course_id, word) pairs of a run file, in order.
+    '''
+    with open(filename, newline='') as f:
+        for course_id, word in csv.reader(f, delimiter='|'):
+            yield int(course_id), word
+
+
+def merge_runs(run_filenames, writer):
+    '''
+    Merge sorted runs into an index, keeping one copy of every pair.
+
+    Inputs:
+        run_filenames: the runs, from any number of shards
+        writer: an index_writers writer (closed once all pairs are added)
+
+    Outputs:
+        the number of pairs written
+    '''
+    rows = 0
+    previous = None
+    for pair in heapq.merge(*[read_run(filename) for filename in run_filenames]):
+        # equal pairs come out of the merge next to each other
+        if pair != previous:
+            writer.add(*pair)
+            rows += 1
+            previous = pair
+    writer.close()
+    return rows
@@ -0,0 +1,309 @@
+'''
+Tests for the asyncio crawl (async_crawler.py): its transports against
+local servers, and async_crawler.go against crawler.go on the synthetic
+catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import asyncio
+import gzip
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import async_crawler
+import crawler
+import scheduler
+from conftest import COURSE_MAP_FILENAME, TEST_DIR
+
+ROBOTS = b"User-agent: *\nDisallow: /private/\n"
+
+
+def read_file(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+def read_rows(filename):
+    # the pages linked from a page are a set, whose order changes from
+    # one process to the next
+    with open(filename) as f:
+        return sorted(f)
+
+
+class ScriptedServer:
+    '''
+    HTTP/1.1 server on asyncio streams answering every path with the raw
+    responses of its script in turn (the last one repeats), on keep-alive
+    connections; counts the requests and connections.
+    '''
+
+    def __init__(self, script):
+        self.script = script
+        self.requests = []
+        self.connections = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return "http://127.0.0.1:{}".format(
+            self.server.sockets[0].getsockname()[1])
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(None, 2)[1].decode()
+                self.requests.append(path)
+                responses = self.script[path]
+                response = responses.pop(0) if len(responses) > 1 \
+                    else responses[0]
+                writer.write(response)
+                await writer.drain()
+                if b"Connection: close" in response:
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def response(status, body=b"", headers=()):
+    head = ["HTTP/1.1 {} X".format(status)] + list(headers)
+    if not any(h.startswith(("Content-Length", "Transfer-Encoding",
+                             "Connection")) for h in headers):
+        head.append("Content-Length: {}".format(len(body)))
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+def chunked(*chunks):
+    return b"".join(b"%x\r\n%s\r\n" % (len(c), c) for c in chunks) + \
+        b"0\r\nX-Trailer: 1\r\n\r\n"
+
+
+@pytest.fixture
+def no_proxy(monkeypatch):
+    for name in ("http_proxy", "HTTP_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def serve(script, test, **options):
+    '''
+    Run test(transport, url, server) against a ScriptedServer for script.
+    '''
+    async def run():
+        server = ScriptedServer(script)
+        url = await server.start()
+        transport = async_crawler.StreamTransport(**options)
+        try:
+            return await test(transport, url, server)
+        finally:
+            await transport.close()
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_stream_transport_reads_every_kind_of_body(no_proxy):
+    page = b"<html>" + b"x" * 5000 + b"</html>"
+    script = {
+        "/length": [response(200, page)],
+        "/chunked": [response(200, chunked(page[:100], page[100:]),
+                              ["Transfer-Encoding: chunked"])],
+        "/gzip": [response(200, gzip.compress(page),
+                           ["Content-Encoding: gzip"])],
+        "/close": [response(200, page, ["Connection: close"])],
+        "/redirect": [response(302, headers=["Location: /length",
+                                             "Content-Length: 0"])],
+        "/missing": [response(404)],
+    }
+
+    async def test(transport, url, server):
+        for path in ("/length", "/chunked", "/gzip", "/close", "/redirect"):
+            got = await transport.get(url + path)
+            assert (got.status, got.body) == (200, page)
+        assert got.url == url + "/length"
+        assert (await transport.get(url + "/missing")).status == 404
+        # one connection is reopened, after the server closed it
+        assert server.connections == 2
+        assert len(server.requests) == 7
+
+    serve(script, test)
+
+
+def test_stream_transport_retries(no_proxy):
+    script = {"/flaky": [response(503), response(503), response(200, b"ok")]}
+
+    async def test(transport, url, server):
+        got = await transport.get(url + "/flaky")
+        assert (got.status, got.body) == (200, b"ok")
+        assert server.requests == ["/flaky"] * 3
+
+    serve(script, test, retries=2, backoff_factor=0)
+
+    async def test_once(transport, url, server):
+        got = await transport.get(url + "/flaky")
+        assert got.status == 503 and len(server.requests) == 1
+
+    serve({"/flaky": [response(503), response(200)]}, test_once, retries=0)
+
+
+def test_stream_transport_fails_to_connect(no_proxy):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    transport = async_crawler.StreamTransport(retries=0)
+    with pytest.raises(OSError):
+        asyncio.run(transport.get("http://127.0.0.1:{}/".format(port)))
+
+
+def test_stream_transport_goes_through_the_proxy(catalog_server, catalog):
+    url = catalog.program_url(0)
+
+    async def run():
+        transport = async_crawler.StreamTransport()
+        pages = [await transport.get(url) for _ in range(3)]
+        missing = await transport.get(url + "x")
+        await transport.close()
+        return pages, missing
+
+    pages, missing = asyncio.run(run())
+    assert all((page.status, page.body) == (200, catalog.get(url))
+               for page in pages)
+    assert missing.status == 404
+    assert catalog_server.requests == 4
+
+
+class ScriptedTransport:
+    '''
+    Answers robots.txt with ROBOTS and the other requests with the
+    statuses of script in turn (an exception instance is raised), then
+    with 200 after delay seconds; records the requests in flight.
+    '''
+
+    def __init__(self, script=(), delay=0):
+        self.script = list(script)
+        self.delay = delay
+        self.sent = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def get(self, url):
+        if url.endswith("/robots.txt"):
+            return async_crawler.Response(url, 200, {}, ROBOTS)
+        self.sent.append(url)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        status = self.script.pop(0) if self.script else 200
+        if isinstance(status, Exception):
+            raise status
+        return async_crawler.Response(url, status, {}, b"page")
+
+    async def close(self):
+        pass
+
+
+def test_polite_transport_follows_robots_and_retries():
+    inner = ScriptedTransport([503, ConnectionError("reset")])
+    polite = scheduler.PoliteScheduler(max_rate=100)
+    transport = async_crawler.PoliteTransport(inner, polite, retries=3,
+                                              backoff_factor=0.01)
+
+    async def run():
+        private = await transport.get("http://host/private/page")
+        page = await transport.get("http://host/page")
+        return private, page
+
+    private, page = asyncio.run(run())
+    assert private.status == 403
+    assert page.status == 200
+    assert inner.sent == ["http://host/page"] * 3
+    throughput = polite.throughput()
+    assert (throughput["requests"], throughput["errors"],
+            throughput["disallowed"]) == (3, 2, 1)
+
+
+def test_polite_transport_limits_each_host():
+    inner = ScriptedTransport(delay=0.01)
+    polite = scheduler.PoliteScheduler(max_rate=1000, max_concurrency=2)
+    transport = async_crawler.PoliteTransport(inner, polite)
+
+    async def run():
+        return await asyncio.gather(*(
+            transport.get("http://host/{}".format(i)) for i in range(20)))
+
+    assert all(page.status == 200 for page in asyncio.run(run()))
+    assert 1 <= inner.most_in_flight <= 2
+    assert len(polite.hosts) == 1
+
+
+def test_event_loop_thread_runs_coroutines():
+    async def double(x):
+        await asyncio.sleep(0.01 * (3 - x))
+        return 2 * x
+
+    async def forever():
+        await asyncio.sleep(3600)
+
+    with async_crawler.EventLoopThread() as loop:
+        assert list(crawler.bounded_map(loop, double, range(4), 2)) == \
+            [0, 2, 4, 6]
+        left_running = loop.submit(forever)
+    # closing the loop cancels what is still running
+    assert left_running.cancelled()
+
+
+@pytest.mark.parametrize("options", [
+    {"max_rate": None, "concurrency": 50},
+    {"max_rate": 1000},
+    {"max_rate": None, "parse_processes": 2},
+    {"max_rate": None, "skip_duplicates": "exact", "num_workers": 4},
+])
+def test_go_writes_the_index_of_crawler(catalog_server, tmp_path, options):
+    index = str(tmp_path / "index.csv")
+    async_index = str(tmp_path / "async.csv")
+    crawl_options = {key: value for key, value in options.items()
+                     if key not in ("max_rate", "concurrency")}
+    crawler.go(100, COURSE_MAP_FILENAME, index, **crawl_options)
+    async_crawler.go(100, COURSE_MAP_FILENAME, async_index, **options)
+    assert read_file(async_index) == read_file(index)
+
+
+def test_go_from_a_page_source(catalog, tmp_path, no_proxy):
+    index = str(tmp_path / "index.csv")
+    transport = async_crawler.SourceTransport(catalog)
+    async_crawler.go(100, COURSE_MAP_FILENAME, index, transport=transport,
+                     max_rate=None, postings=True)
+    # the start page, and the area and program pages once each
+    assert transport.requests == len(catalog)
+    assert read_file(index)
+
+
+def test_go_rejects_session_options(tmp_path):
+    with pytest.raises(TypeError):
+        async_crawler.go(1, COURSE_MAP_FILENAME, str(tmp_path / "index.csv"),
+                         cache_dir=str(tmp_path))
+
+
+def test_command_line_matches_crawler(catalog_server, tmp_path):
+    index = str(tmp_path / "index.csv")
+    cli_index = str(tmp_path / "cli.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index, prioritize=True)
+    result = subprocess.run([sys.executable, "async_crawler.py", "100",
+                             "--prioritize", "--max-rate", "1000",
+                             "--output", cli_index],
+                            cwd=TEST_DIR, env=dict(os.environ), check=True,
+                            capture_output=True, text=True)
+    assert read_rows(cli_index) == read_rows(index)
+    assert "disallowed by robots.txt" in result.stdout
+    # the crawl was checkpointed, and the checkpoint removed at the end
+    assert not os.path.exists(cli_index + ".checkpoint")
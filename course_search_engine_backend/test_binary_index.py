@@ -0,0 +1,72 @@
+'''
+Tests for the binary inverted index (binary_index.py), written directly
+and by crawler.go for the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import csv
+
+import pytest
+
+import binary_index
+import crawler
+from conftest import COURSE_MAP_FILENAME
+
+
+def test_varints_round_trip():
+    out = bytearray()
+    numbers = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 40]
+    for n in numbers:
+        binary_index.encode_varint(n, out)
+    assert len(out) == 1 + 1 + 1 + 2 + 2 + 2 + 3 + 6
+    # decode_postings sums the deltas
+    sums = [sum(numbers[:i + 1]) for i in range(len(numbers))]
+    assert binary_index.decode_postings(out, 0, len(numbers)) == sums
+
+
+def test_write_and_look_up(tmp_path):
+    filename = str(tmp_path / "index.bin")
+    writer = binary_index.BinaryIndexWriter(filename)
+    pairs = [(3, "theory"), (1, "theory"), (2 ** 20, "theory"), (1, "zebra"),
+             (7, "café"), (3, "theory"), (5, "a")]
+    for course_id, word in pairs:
+        writer.add(course_id, word)
+    writer.close()
+
+    index = binary_index.BinaryIndex(filename)
+    assert len(index) == 4
+    assert list(index.terms()) == ["a", "café", "theory", "zebra"]
+    assert index.lookup("theory") == [1, 3, 2 ** 20]
+    assert index.lookup("café") == [7]
+    assert index.lookup("missing") == [] and "missing" not in index
+    assert "zebra" in index and "zebr" not in index
+    assert list(index.pairs()) == sorted(set(pairs), key=lambda p: (p[1], p[0]))
+    index.close()
+
+
+def test_empty_index(tmp_path):
+    filename = str(tmp_path / "index.bin")
+    binary_index.write_binary_index({}, filename)
+    index = binary_index.BinaryIndex(filename)
+    assert len(index) == 0 and index.lookup("a") == []
+    index.close()
+
+
+def test_rejects_other_files(tmp_path):
+    filename = tmp_path / "index.csv"
+    filename.write_bytes(b"1|theory\n" * 10)
+    with pytest.raises(ValueError):
+        binary_index.BinaryIndex(str(filename))
+
+
+def test_crawl_matches_csv(catalog_server, tmp_path):
+    csv_index = str(tmp_path / "index.csv")
+    bin_index = str(tmp_path / "index.bin")
+    crawler.go(100, COURSE_MAP_FILENAME, csv_index)
+    crawler.go(100, COURSE_MAP_FILENAME, bin_index, index_format="binary")
+    with open(csv_index, newline="") as f:
+        rows = {(int(course_id), word)
+                for course_id, word in csv.reader(f, delimiter="|")}
+    index = binary_index.BinaryIndex(bin_index)
+    assert rows and set(index.pairs()) == rows
+    index.close()
@@ -0,0 +1,97 @@
+'''
+Tests for crawl checkpoints (checkpoint.py and crawler.go with
+checkpoint_dir and resume), crawling the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import functools
+import subprocess
+import sys
+
+import pytest
+
+import checkpoint
+import crawler
+from conftest import COURSE_MAP_FILENAME, TEST_DIR
+
+
+class Interrupted(Exception):
+    pass
+
+
+def read_rows(filename):
+    with open(filename) as f:
+        return sorted(f)
+
+
+def test_checkpoint_state(tmp_path):
+    directory = str(tmp_path / "state")
+    assert not checkpoint.exists(directory)
+    state = checkpoint.Checkpoint(directory)
+    assert checkpoint.exists(directory)
+    assert list(state.pages()) == [] and state.progress() is None
+    state.save_pages(["a", "b", "c"])
+    state.save_progress(2, 40, [(1, "x"), (2, "y")])
+    state.close()
+
+    state = checkpoint.Checkpoint(directory)
+    assert list(state.pages()) == ["a", "b", "c"]
+    assert state.progress() == (2, 40)
+    assert state.pairs() == {("x", 1), ("y", 2)}
+    # a new crawl starts from scratch
+    state.save_pages(["d"])
+    assert state.progress() is None and state.pairs() == set()
+    state.remove()
+    assert not checkpoint.exists(directory)
+
+
+def test_resume_needs_a_checkpoint(tmp_path):
+    with pytest.raises(ValueError):
+        crawler.go(1, COURSE_MAP_FILENAME, str(tmp_path / "index.csv"),
+                   checkpoint_dir=str(tmp_path / "missing"), resume=True)
+
+
+def test_resumed_crawl_matches_full_crawl(catalog_server, tmp_path,
+                                          monkeypatch):
+    full = str(tmp_path / "full.csv")
+    index = str(tmp_path / "index.csv")
+    directory = str(tmp_path / "index.csv.checkpoint")
+    crawler.go(100, COURSE_MAP_FILENAME, full)
+
+    monkeypatch.setattr(checkpoint, "Checkpoint",
+                        functools.partial(checkpoint.Checkpoint, every=10))
+    extract_course_info = crawler.extract_course_info
+    fetched = []
+
+    def interrupt_after(limit, url, **kwargs):
+        if len(fetched) == limit:
+            raise Interrupted()
+        fetched.append(url)
+        return extract_course_info(url, **kwargs)
+
+    monkeypatch.setattr(crawler, "extract_course_info",
+                        functools.partial(interrupt_after, 25))
+    with pytest.raises(Interrupted):
+        crawler.go(100, COURSE_MAP_FILENAME, index, checkpoint_dir=directory)
+    state = checkpoint.Checkpoint(directory)
+    pages = list(state.pages())
+    assert state.progress()[0] == 20
+    state.close()
+
+    fetched.clear()
+    monkeypatch.setattr(crawler, "extract_course_info",
+                        functools.partial(interrupt_after, None))
+    crawler.go(100, COURSE_MAP_FILENAME, index, checkpoint_dir=directory,
+               resume=True)
+    # only the pages after the last checkpoint are fetched again
+    assert fetched == pages[20:]
+    assert read_rows(index) == read_rows(full)
+    assert not checkpoint.exists(directory)
+
+
+def test_command_line_resume_without_checkpoint(tmp_path):
+    result = subprocess.run([sys.executable, "crawler.py", "1", "--resume",
+                             "--output", str(tmp_path / "index.csv")],
+                            cwd=TEST_DIR, capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "no checkpoint to resume" in result.stderr
@@ -0,0 +1,109 @@
+'''
+Tests for finding the course blocks of a page (crawler.course_blocks and
+util.find_sequence) against BeautifulSoup's find_all, and for the parser
+backends of crawler.PARSERS against html.parser.
+'''
+# pylint: skip-file
+
+import importlib.util
+
+import pytest
+
+import crawler
+import mirror
+import util
+
+DOMAIN = "classes.cs.uchicago.edu"
+
+
+def block(kind, code, title, descrip):
+    return ('<div class="courseblock {}">\n'
+            '  <p class="courseblocktitle"><strong>{}. {}.</strong></p>\n'
+            '  <p class="courseblockdesc">{}</p>\n'
+            '</div>').format(kind, code, title, descrip)
+
+
+# a sequence whose courses are separated by whitespace, text, a comment
+# and non-course tags between blocks, a sequence course away from its
+# header, a block that only looks like one, and blocks nested in a wrapper
+PAGE = """<html><body><div id="content">
+<h2>Computer Science</h2>
+{}
+{}
+
+{}
+<p>Students take the sequence in order.</p>
+{}
+stray text
+{}
+<div class="courseblock">not a course</div>
+<div class="wrapper"><div>
+{}
+{}<!-- the end of the sequence -->
+</div></div>
+{}
+<p><a href="../other.html">Other</a> <a href="#top">top</a>
+<a name="anchor">no href</a> <a href="mailto:a@b.edu">mail</a>
+<a href="https://other.edu/e.html">away</a><a href="/sub/dir/">dir</a></p>
+</div></body></html>""".format(
+    block("main", "CMSC 12100-12200", "Programming I-II", "A sequence."),
+    block("subsequence", "CMSC 12100", "Programming I", "The first."),
+    block("subsequence", "CMSC 12200", "Programming II", "The second."),
+    block("main", "CMSC 14100", "Systems", "Alone."),
+    block("subsequence", "CMSC 14200", "Orphan", "After text."),
+    block("main", "CMSC 15100-15200", "Honors I-II", "Another sequence."),
+    block("subsequence", "CMSC 15100", "Honors I", "Nested."),
+    block("main", "MATH 15100", "Calculus", "Last."))
+
+
+def find_all_blocks(soup):
+    return [(block.find('p', class_='courseblocktitle').get_text(strip=True),
+             block.find('p', class_='courseblockdesc').get_text(strip=True))
+            for block in soup.find_all('div',
+                                       class_=crawler.COURSEBLOCK_CLASSES)]
+
+
+def test_course_blocks_match_find_all():
+    soup = crawler.parse_html(PAGE)
+    blocks = crawler.course_blocks(soup)
+    assert blocks == find_all_blocks(soup)
+    assert [title.split(".")[0] for title, _ in blocks] == [
+        "CMSC 12100-12200", "CMSC 12100", "CMSC 12200", "CMSC 14100",
+        "CMSC 14200", "CMSC 15100-15200", "CMSC 15100", "MATH 15100"]
+    assert crawler.course_blocks(crawler.parse_html("<p>no courses</p>")) \
+        == []
+
+
+def test_find_sequence_skips_whitespace():
+    soup = crawler.parse_html(PAGE)
+    headers = soup.find_all('div', class_='courseblock main')
+    # whitespace between siblings used to end the sequence at once
+    assert [tag.p.get_text(strip=True) for tag in
+            util.find_sequence(headers[0])] == \
+        ["CMSC 12100. Programming I.", "CMSC 12200. Programming II."]
+    # text ends it, a comment after the last course does not matter
+    assert util.find_sequence(headers[1]) == []
+    assert len(util.find_sequence(headers[2])) == 1
+
+
+@pytest.mark.parametrize("parser", [
+    parser for parser in crawler.PARSERS if parser != "html.parser"])
+def test_parsers_find_the_blocks_and_links_of_html_parser(parser, course_map):
+    if crawler.PARSERS[parser][0] == "lxml" and \
+            importlib.util.find_spec("lxml") is None:
+        pytest.skip("lxml is not installed")
+    catalog = mirror.SyntheticCatalog(40, course_map)
+    url = "http://www.{}/a/b/page.html".format(DOMAIN)
+    pages = [(url, PAGE.encode())] + [
+        (catalog.program_url(program), catalog.get(catalog.program_url(program)))
+        for program in range(0, 38, 5)]
+    for url, html in pages:
+        soup = crawler.parse_html(html)
+        blocks = crawler.course_blocks(soup)
+        links = crawler.extract_links(soup, url, DOMAIN)
+        assert crawler.course_blocks(crawler.parse_html(
+            html, parser, crawler.COURSE_STRAINER)) == blocks
+        assert crawler.extract_links(crawler.parse_html(
+            html, parser, crawler.LINK_STRAINER), url, DOMAIN) == links
+    # the pages had something to find
+    assert blocks and links
@@ -0,0 +1,63 @@
+'''
+Tests for the crawl options of crawler.go and its command line, crawling
+the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import crawler
+from conftest import COURSE_MAP_FILENAME, TEST_DIR
+
+
+def read_rows(filename):
+    # the pages linked from a page are a set, whose order changes from
+    # one process to the next
+    with open(filename) as f:
+        return sorted(f)
+
+
+def test_go_options_are_keyword_only(tmp_path):
+    with pytest.raises(TypeError):
+        crawler.go(1, COURSE_MAP_FILENAME, str(tmp_path / "index.csv"), 4)
+
+
+@pytest.mark.parametrize("options", [
+    {"num_shards": 2, "incremental_index": True},
+    {"skip_duplicates": "near", "num_shards": 2},
+    {"postings": True, "index_format": "binary"},
+    {"resume": True},
+])
+def test_go_rejects_conflicting_modes(options, tmp_path):
+    with pytest.raises(ValueError):
+        crawler.go(1, COURSE_MAP_FILENAME, str(tmp_path / "index.csv"),
+                   **options)
+
+
+def test_command_line_matches_go(catalog_server, tmp_path):
+    index = str(tmp_path / "index.csv")
+    cli_index = str(tmp_path / "cli.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index, num_workers=3,
+               prioritize=True)
+    subprocess.run([sys.executable, "crawler.py", "100", "--workers", "3",
+                    "--prioritize", "--output", cli_index],
+                   cwd=TEST_DIR, env=dict(os.environ), check=True,
+                   capture_output=True)
+    assert read_rows(cli_index) == read_rows(index)
+
+
+@pytest.mark.parametrize("options", [{}, {"postings": True}])
+def test_parse_processes_write_the_serial_index(catalog_server, tmp_path,
+                                                options):
+    index = str(tmp_path / "index.csv")
+    pipeline_index = str(tmp_path / "pipeline.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index, **options)
+    crawler.go(100, COURSE_MAP_FILENAME, pipeline_index, parse_processes=2,
+               **options)
+    # the rows come in the same order, not just the same rows
+    with open(index) as f, open(pipeline_index) as pipeline:
+        assert pipeline.read() == f.read()
@@ -0,0 +1,112 @@
+'''
+Tests for duplicate page detection (fingerprint.py and crawler.go with
+skip_duplicates), crawling the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import time
+
+import pytest
+
+import crawler
+import fingerprint
+from conftest import COURSE_MAP_FILENAME
+
+TEXT = b" ".join(b"word%d" % i for i in range(300))
+
+
+def page(text):
+    return b"<html><body><p>" + text + b"</p></body></html>"
+
+
+def read_rows(filename):
+    with open(filename) as f:
+        return sorted(f)
+
+
+def test_simhash_distance():
+    near = fingerprint.simhash(page(TEXT + b" extra"))
+    other = fingerprint.simhash(page(TEXT[::-1]))
+    assert bin(fingerprint.simhash(page(TEXT)) ^ near).count("1") <= \
+        fingerprint.MAX_DISTANCE
+    assert bin(fingerprint.simhash(page(TEXT)) ^ other).count("1") > \
+        fingerprint.MAX_DISTANCE
+    # tags are not text
+    assert fingerprint.simhash(page(TEXT)) == \
+        fingerprint.simhash(b"<div>" + TEXT + b"</div>")
+
+
+def test_exact_mode():
+    fingerprints = fingerprint.PageFingerprints("exact")
+    assert fingerprints.fingerprint(page(TEXT))[1] is None
+    assert not fingerprints.seen(page(TEXT))
+    assert fingerprints.seen(page(TEXT))
+    assert not fingerprints.seen(page(TEXT + b" extra"))
+    assert (fingerprints.pages, fingerprints.exact, fingerprints.near) == \
+        (3, 1, 0)
+
+
+def test_near_mode():
+    fingerprints = fingerprint.PageFingerprints("near")
+    # computing a fingerprint does not record the page
+    fingerprints.fingerprint(page(TEXT))
+    assert not fingerprints.seen(page(TEXT))
+    assert fingerprints.seen(page(TEXT + b" extra"),
+                             fingerprints.fingerprint(page(TEXT + b" extra")))
+    assert not fingerprints.seen(page(TEXT[::-1]))
+    assert (fingerprints.exact, fingerprints.near) == (0, 1)
+    with pytest.raises(ValueError):
+        fingerprint.PageFingerprints("fuzzy")
+
+
+def test_first_copy_is_kept_whatever_the_fetch_order(monkeypatch):
+    bodies = {"a": page(TEXT), "b": page(TEXT + b" extra"),
+              "c": page(TEXT[::-1]), "d": page(TEXT)}
+
+    def fetch_page(url, session=None):
+        # the first pages take the longest
+        time.sleep(0.05 * (3 - "abcd".index(url)))
+        return bodies[url]
+
+    monkeypatch.setattr(crawler, "fetch_page", fetch_page)
+    fingerprints = fingerprint.PageFingerprints("near")
+    pages = crawler.unseen_pages(crawler.fetch_pages("abcd", num_workers=4),
+                                 fingerprints, num_workers=4)
+    assert list(pages) == [("a", bodies["a"]), ("b", ""),
+                           ("c", bodies["c"]), ("d", "")]
+
+
+@pytest.mark.parametrize("options", [{"num_workers": 4},
+                                     {"parse_processes": 2}])
+def test_skipping_exact_duplicates_keeps_the_index(catalog_server, catalog,
+                                                   tmp_path, capsys, options):
+    # three programs are copies of the first
+    source = catalog_server.source
+    for program in (3, 7, 11):
+        source.pages[catalog.program_url(program)] = \
+            catalog.get(catalog.program_url(0))
+    full = str(tmp_path / "full.csv")
+    index = str(tmp_path / "index.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, full)
+    crawler.go(100, COURSE_MAP_FILENAME, index, skip_duplicates="exact",
+               **options)
+    assert read_rows(index) == read_rows(full)
+    assert "(3 exact, 0 near duplicates)" in capsys.readouterr().out
+
+
+def test_near_duplicates_do_not_depend_on_the_workers(catalog_server, catalog,
+                                                      tmp_path):
+    # near copies of program 0, each missing a different course block
+    source = catalog_server.source
+    first = catalog.get(catalog.program_url(0))
+    separator = b'<div class="courseblock'
+    blocks = first.split(separator)
+    for program in (3, 7, 11):
+        source.pages[catalog.program_url(program)] = separator.join(
+            blocks[:program % 4 + 1] + blocks[program % 4 + 2:])
+    serial = str(tmp_path / "serial.csv")
+    concurrent = str(tmp_path / "concurrent.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, serial, skip_duplicates="near")
+    crawler.go(100, COURSE_MAP_FILENAME, concurrent, skip_duplicates="near",
+               num_workers=8)
+    assert read_rows(concurrent) == read_rows(serial)
@@ -0,0 +1,92 @@
+'''
+Tests for the URL frontier (frontier.py) and the crawl streaming from it,
+crawling the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import itertools
+import os
+import random
+
+import crawler
+import frontier
+import util
+from conftest import COURSE_MAP_FILENAME
+
+STARTING_URL = ("http://www.classes.cs.uchicago.edu/archive/2015/winter"
+                "/12200-1/new.collegecatalog.uchicago.edu/index.html")
+LIMITING_DOMAIN = "classes.cs.uchicago.edu"
+
+
+def read_rows(filename):
+    with open(filename) as f:
+        return sorted(f)
+
+
+def test_bloom_filter():
+    bloom = frontier.BloomFilter(1000)
+    for i in range(1000):
+        bloom.add(str(i))
+    assert all(str(i) in bloom for i in range(1000))
+    false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_seen_set_spills_in_batches(tmp_path):
+    store = frontier.FrontierStore(str(tmp_path))
+    seen = frontier.SeenSet(store, capacity=100, max_in_memory=10)
+    for i in range(9):
+        assert seen.add(str(i))
+    # nothing is written before max_in_memory urls are seen
+    assert seen.db.execute("SELECT COUNT(*) FROM seen").fetchone() == (0,)
+    assert seen.add("9")
+    assert seen.db.execute("SELECT COUNT(*) FROM seen").fetchone() == (10,)
+    for i in range(10, 25):
+        assert seen.add(str(i))
+    assert all(not seen.add(str(i)) for i in range(25))
+    assert str(25) not in seen and len(seen) == 25
+    seen.spill()
+    store.close()
+
+    store = frontier.FrontierStore(str(tmp_path))
+    seen = frontier.SeenSet(store, capacity=100, max_in_memory=10)
+    assert len(seen) == 25 and all(str(i) in seen for i in range(25))
+    store.close()
+
+
+def test_frontier_order_survives_spilling():
+    rnd = random.Random(0)
+    store = frontier.FrontierStore()
+    queue = frontier.Frontier(store, max_in_memory=5)
+    entries = [(rnd.randrange(3), i) for i in range(50)]
+    for priority, i in entries:
+        queue.put(str(i), priority)
+    assert len(queue) == 50
+    assert [queue.get() for _ in range(50)] == \
+        [str(i) for _, i in sorted(entries)]
+    assert queue.empty()
+    store.close()
+    assert not os.path.exists(store.directory)
+
+
+def test_collect_pages_streams_from_the_frontier(catalog_server, catalog):
+    session = util.make_session()
+    pages = crawler.collect_pages(STARTING_URL, LIMITING_DOMAIN, 100, session)
+    first = list(itertools.islice(pages, 3))
+    assert len(first) == 3
+    # the frontier is left open until the generator is done with
+    assert pages.gi_frame is not None
+    rest = list(pages)
+    assert len(set(first + rest)) == len(first + rest) == len(catalog) - 2
+    session.close()
+
+
+def test_sharded_and_pipelined_crawls_match(catalog_server, tmp_path):
+    full = str(tmp_path / "full.csv")
+    sharded = str(tmp_path / "sharded.csv")
+    pipelined = str(tmp_path / "pipelined.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, full, num_workers=4)
+    crawler.go(100, COURSE_MAP_FILENAME, sharded, num_shards=2)
+    crawler.go(100, COURSE_MAP_FILENAME, pipelined, parse_processes=2)
+    assert read_rows(sharded) == read_rows(full)
+    assert read_rows(pipelined) == read_rows(full)
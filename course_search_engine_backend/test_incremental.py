@@ -0,0 +1,81 @@
+'''
+Tests for the incremental index (incremental.py and crawler.go with
+incremental_index), crawling the synthetic catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import csv
+
+import crawler
+import incremental
+import mirror
+from conftest import COURSE_MAP_FILENAME
+
+
+def read_index(filename):
+    with open(filename, newline='') as f:
+        return [(int(course_id), word)
+                for course_id, word in csv.reader(f, delimiter='|')]
+
+
+def test_page_digest():
+    assert incremental.page_digest("abc") == incremental.page_digest(b"abc")
+    assert incremental.page_digest(b"abc") != incremental.page_digest(b"abd")
+
+
+def test_index_state_patches_index(tmp_path):
+    index = str(tmp_path / "index.csv")
+    state = incremental.IndexState(index)
+    assert state.fresh
+    state.update_page("a", "1", {"x": {1, 2}, "y": {1}})
+    state.update_page("b", "1", {"x": {1}})
+    assert state.patch_index() == (3, 0)
+    assert sorted(read_index(index)) == [(1, "x"), (1, "y"), (2, "x")]
+    state.close()
+
+    state = incremental.IndexState(index)
+    assert not state.fresh
+    # (1, x) is still on page b
+    state.update_page("a", "2", {"z": {2}})
+    assert state.patch_index() == (1, 2)
+    assert sorted(read_index(index)) == [(1, "x"), (2, "z")]
+    state.keep_only(["a"])
+    assert state.patch_index() == (0, 1)
+    assert read_index(index) == [(2, "z")]
+    state.close()
+
+
+def test_incremental_crawl(catalog_server, catalog, tmp_path):
+    full = str(tmp_path / "full.csv")
+    index = str(tmp_path / "index.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, full)
+    assert crawler.go(100, COURSE_MAP_FILENAME, index,
+                      incremental_index=True) == (len(read_index(full)), 0)
+    assert sorted(read_index(index)) == sorted(read_index(full))
+    assert crawler.go(100, COURSE_MAP_FILENAME, index,
+                      incremental_index=True) == (0, 0)
+
+    # a page that changed is parsed again
+    changed = catalog.program_url(5)
+    other = mirror.SyntheticCatalog(len(catalog), catalog.course_codes, seed=1)
+    catalog_server.source.pages[changed] = other.get(changed)
+    added, removed = crawler.go(100, COURSE_MAP_FILENAME, index,
+                                incremental_index=True)
+    assert added and removed
+    crawler.go(100, COURSE_MAP_FILENAME, full)
+    assert sorted(read_index(index)) == sorted(read_index(full))
+
+
+def test_failed_fetch_keeps_rows(catalog_server, catalog, tmp_path):
+    index = str(tmp_path / "index.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index, incremental_index=True)
+    rows = sorted(read_index(index))
+    # a transient 404 is not a page without courses
+    for program in range(10):
+        catalog_server.source.pages[catalog.program_url(program)] = None
+    assert crawler.go(100, COURSE_MAP_FILENAME, index,
+                      incremental_index=True) == (0, 0)
+    assert sorted(read_index(index)) == rows
+    catalog_server.source.pages.clear()
+    assert crawler.go(100, COURSE_MAP_FILENAME, index,
+                      incremental_index=True) == (0, 0)
@@ -0,0 +1,150 @@
+'''
+Tests for the index writers (index_writers.py): loading the index into
+SQLite, crawling the synthetic catalog of conftest.py into copies of the
+course database of the frontend, and writing the postings of
+crawler.page_postings.
+'''
+# pylint: skip-file
+
+import csv
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import crawler
+import index_writers
+from conftest import COURSE_MAP_FILENAME, TEST_DIR
+
+DATABASE = os.path.join(TEST_DIR, os.pardir, "course_search_engine_frontend",
+                        "course_information.sqlite3")
+
+
+@pytest.fixture
+def database(tmp_path):
+    if not os.path.exists(DATABASE):
+        pytest.skip("no course database")
+    filename = str(tmp_path / "course_information.sqlite3")
+    shutil.copyfile(DATABASE, filename)
+    return filename
+
+
+COURSE_MAP = {"CMSC 12100": 1, "CMSC 12200": 2, "MATH 15100": 4}
+
+# a sequence header for courses 1 and 2, then a block of course 1 alone
+# (its positions go on from the header's), one of course 4 and one of a
+# course missing from the course map
+BLOCKS = [
+    ("CMSC 12100-12200. Programming with Data I-II.",
+     "Programming and data. Data in the programming of data."),
+    ("CMSC 12100. Python.", "Programming in Python."),
+    ("MATH 15100. Calculus.", "Limits."),
+    ("CMSC 99999. Unknown.", "Nothing."),
+]
+
+# course_id, word, tf, fields, positions
+POSTINGS = [
+    (1, "cmsc", 2, "t", [0, 215]),
+    (1, "data", 4, "td", [3, 108, 109, 114]),
+    (1, "programming", 4, "td", [1, 106, 112, 317]),
+    (1, "python", 2, "td", [216, 319]),
+    (2, "cmsc", 1, "t", [0]),
+    (2, "data", 4, "td", [3, 108, 109, 114]),
+    (2, "programming", 3, "td", [1, 106, 112]),
+    (4, "calculus", 1, "t", [1]),
+    (4, "limits", 1, "d", [102]),
+    (4, "math", 1, "t", [0]),
+]
+
+
+def page_postings():
+    return sorted(crawler.page_postings(BLOCKS, COURSE_MAP))
+
+
+def csv_rows(filename):
+    with open(filename, newline='') as f:
+        return sorted((int(course_id), word)
+                      for course_id, word in csv.reader(f, delimiter='|'))
+
+
+def table_rows(db):
+    return sorted(db.execute("SELECT course_id, word FROM catalog_index"))
+
+
+def indexes(db):
+    return dict(db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index'"
+        " AND tbl_name = 'catalog_index' AND sql IS NOT NULL"))
+
+
+def test_loads_the_rows_of_the_csv(catalog_server, database, tmp_path, capsys):
+    index = str(tmp_path / "index.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index)
+    for _ in range(2):
+        # loading again replaces the rows and the index
+        crawler.go(100, COURSE_MAP_FILENAME, database, index_format="sqlite")
+        db = sqlite3.connect(database)
+        assert table_rows(db) == csv_rows(index)
+        assert list(indexes(db)) == ["catalog_index_word"]
+        db.close()
+    assert "rows into catalog_index" in capsys.readouterr().out
+
+
+def test_keeps_the_indexes_of_a_tuned_database(catalog_server, database,
+                                               tmp_path):
+    # the schema tune_db migrates catalog_index to
+    db = sqlite3.connect(database)
+    db.executescript("""
+        DROP TABLE catalog_index;
+        CREATE TABLE catalog_index (course_id integer, word varchar(100),
+            PRIMARY KEY (word, course_id)) WITHOUT ROWID;
+        CREATE INDEX catalog_index_course_id ON catalog_index (course_id, word);
+        """)
+    tuned = indexes(db)
+    db.close()
+    index = str(tmp_path / "index.csv")
+    crawler.go(100, COURSE_MAP_FILENAME, index)
+    crawler.go(100, COURSE_MAP_FILENAME, database, index_format="sqlite")
+    db = sqlite3.connect(database)
+    assert table_rows(db) == csv_rows(index)
+    # clustered on (word, course_id), it needs no catalog_index_word
+    assert indexes(db) == tuned
+    assert db.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    db.close()
+
+
+def test_page_postings():
+    assert [(course_id, word, tf, index_writers.field_names(fields),
+             positions)
+            for course_id, word, tf, fields, positions in page_postings()] \
+        == POSTINGS
+
+
+def test_csv_postings_writer(tmp_path):
+    filename = str(tmp_path / "postings.csv")
+    writer = index_writers.CsvPostingsWriter(filename)
+    for posting in page_postings():
+        writer.add(*posting)
+    writer.close()
+    with open(filename, newline='') as f:
+        assert list(csv.reader(f, delimiter='|')) == [
+            [str(course_id), word, str(tf), fields,
+             " ".join(map(str, positions))]
+            for course_id, word, tf, fields, positions in POSTINGS]
+
+
+def test_sqlite_postings_writer(tmp_path):
+    filename = str(tmp_path / "postings.sqlite3")
+    for _ in range(2):
+        # loading again replaces the postings
+        writer = index_writers.SqlitePostingsWriter(filename)
+        for posting in page_postings():
+            writer.add(*posting)
+        writer.close()
+    db = sqlite3.connect(filename)
+    assert sorted(db.execute("SELECT * FROM catalog_postings")) == [
+        (course_id, word, tf, int("t" in fields), int("d" in fields),
+         " ".join(map(str, positions)))
+        for course_id, word, tf, fields, positions in POSTINGS]
+    db.close()
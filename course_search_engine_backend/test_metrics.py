@@ -0,0 +1,93 @@
+'''
+Tests for the crawl instrumentation (metrics.py): stage timings and their
+percentiles, queue depths, and the trace of a crawl of the synthetic
+catalog of conftest.py.
+'''
+# pylint: skip-file
+
+import concurrent.futures
+import json
+
+import pytest
+
+import crawler
+import metrics
+from conftest import COURSE_MAP_FILENAME
+
+
+def test_percentile():
+    values = list(range(1, 11))
+    assert [metrics.percentile(values, p) for p in (1, 50, 90, 99, 100)] \
+        == [1, 5, 9, 10, 10]
+    assert metrics.percentile([7], 50) == 7
+
+
+def test_stage_timings_and_totals():
+    crawl_metrics = metrics.CrawlMetrics()
+    for i in range(1, 101):
+        crawl_metrics.record("fetch", i / 1000, "u{}".format(i), bytes=10)
+    crawl_metrics.record("write", 0.5)
+    crawl_metrics.record("custom", 0.25)
+    crawl_metrics.record("parse", 0.125, pairs=3)
+    with pytest.raises(KeyError):
+        with crawl_metrics.time("extract"):
+            raise KeyError
+    crawl_metrics.finish()
+    summary = crawl_metrics.summary()
+    assert summary["pages"] == 100
+    assert summary["pages_per_sec"] == 100 / summary["elapsed"]
+    assert summary["totals"] == {"bytes": 1000, "pairs": 3}
+    # the known stages in pipeline order, then the others
+    assert list(summary["stages"]) == ["fetch", "parse", "extract", "write",
+                                       "custom"]
+    fetch = summary["stages"]["fetch"]
+    assert fetch["count"] == 100
+    assert fetch["total"] == pytest.approx(5.05)
+    assert fetch["mean"] == pytest.approx(0.0505)
+    assert (fetch["p50"], fetch["p90"], fetch["p99"], fetch["max"]) == \
+        (0.05, 0.09, 0.099, 0.1)
+    # a stage that raised is still timed
+    assert summary["stages"]["extract"]["count"] == 1
+    # nothing is kept for a trace unless asked
+    assert crawl_metrics.events is None
+
+
+def test_queue_depths():
+    crawl_metrics = metrics.CrawlMetrics(trace=True)
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        results = list(crawler.bounded_map(executor, abs, range(-10, 0), 3,
+                                           crawl_metrics, "fetch"))
+    assert results == list(range(10, 0, -1))
+    # each item is queued after the previous one was taken, once the
+    # queue is full
+    assert crawl_metrics.depths["fetch"] == [1, 2] + [3] * 8
+    queue = crawl_metrics.summary()["queues"]["fetch"]
+    assert (queue["count"], queue["max"], queue["mean"]) == (10, 3, 2.7)
+    assert [event["depth"] for event in crawl_metrics.events] == \
+        crawl_metrics.depths["fetch"]
+
+
+def test_crawl_writes_a_trace(catalog_server, tmp_path, capsys):
+    trace = str(tmp_path / "trace.json")
+    crawler.go(100, COURSE_MAP_FILENAME, str(tmp_path / "index.csv"),
+               trace_filename=trace)
+    with open(trace) as f:
+        written = json.load(f)
+    summary, events = written["summary"], written["events"]
+    fetches = [event for event in events if event.get("stage") == "fetch"]
+    # every request was timed, with its size
+    assert summary["pages"] == len(fetches) == catalog_server.requests
+    assert summary["totals"]["bytes"] == \
+        sum(event["bytes"] for event in fetches) > 0
+    assert set(summary["stages"]) == set(metrics.STAGES)
+    for stage, stats in summary["stages"].items():
+        timings = [event["seconds"] for event in events
+                   if event.get("stage") == stage]
+        assert stats["count"] == len(timings)
+        assert stats["max"] == max(timings)
+    assert summary["queues"]["frontier"]["count"] == \
+        sum(1 for event in events if event.get("queue") == "frontier")
+    # events are in the order they were recorded
+    times = [event["t"] for event in events]
+    assert times == sorted(times)
+    assert "{} pages in".format(summary["pages"]) in capsys.readouterr().out
@@ -0,0 +1,189 @@
+'''
+Tests for the on-disk page cache (page_cache.py).
+'''
+# pylint: skip-file
+
+import random
+import sqlite3
+import threading
+
+import requests
+import requests.adapters
+
+import page_cache
+import util
+
+
+class StaticAdapter(requests.adapters.BaseAdapter):
+    '''
+    Answers every request with status and body, counting the requests
+    and remembering their headers.
+    '''
+
+    def __init__(self, status=200, body=b"page", headers=None):
+        super().__init__()
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(dict(request.headers))
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = self.status
+        response.headers = requests.structures.CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        return response
+
+    def close(self):
+        pass
+
+
+def session_for(adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    return session
+
+
+def test_put_get(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    assert cache.get("http://example.edu/a.html") is None
+    cache.put("http://example.edu/a.html", b"<html>a</html>", encoding="utf-8",
+              etag='"1"', last_modified="Mon, 05 Jan 2015 00:00:00 GMT")
+    entry = cache.get("HTTP://Example.edu:80/a.html#top")
+    assert entry["body"] == b"<html>a</html>"
+    assert entry["encoding"] == "utf-8"
+    assert entry["etag"] == '"1"'
+    assert entry["last_modified"] == "Mon, 05 Jan 2015 00:00:00 GMT"
+    cache.close()
+
+
+def test_size_counts_each_body_once(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    cache.put("http://example.edu/a", b"x" * 10)
+    cache.put("http://example.edu/b", b"x" * 10)
+    assert cache.size() == 10
+    cache.put("http://example.edu/a", b"y" * 7)
+    assert cache.size() == 17
+    cache.put("http://example.edu/b", b"y" * 7)
+    assert cache.size() == 7
+    cache.close()
+
+
+def test_size_survives_random_puts_and_reopening(tmp_path):
+    rnd = random.Random(0)
+    cache = page_cache.PageCache(str(tmp_path), max_bytes=2000)
+    for _ in range(500):
+        url = "http://example.edu/{}".format(rnd.randrange(40))
+        cache.put(url, bytes([rnd.randrange(5)]) * rnd.randrange(1, 200))
+        assert cache.size() == cache._stored_bytes() <= 2000
+    size = cache.size()
+    cache.close()
+    cache = page_cache.PageCache(str(tmp_path), max_bytes=2000)
+    assert cache.size() == size
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path), max_bytes=30)
+    for name in "abc":
+        cache.put("http://example.edu/" + name, name.encode() * 10)
+    # a is read after b was written, so b is the least recently used
+    assert cache.get("http://example.edu/a") is not None
+    cache.put("http://example.edu/d", b"d" * 10)
+    assert cache.get("http://example.edu/b") is None
+    for name in "acd":
+        assert cache.get("http://example.edu/" + name) is not None
+    assert cache.size() == 30
+    cache.close()
+
+
+def test_entries_persist(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    for i in range(page_cache.TOUCH_BATCH + 5):
+        cache.put("http://example.edu/{}".format(i), str(i).encode())
+    cache.get("http://example.edu/3")
+    cache.close()
+    cache = page_cache.PageCache(str(tmp_path))
+    for i in range(page_cache.TOUCH_BATCH + 5):
+        assert cache.get("http://example.edu/{}".format(i))["body"] == \
+            str(i).encode()
+    cache.close()
+
+
+def test_offline_session(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path), offline=True)
+    cache.put("http://example.edu/a", b"cached")
+    session = util.make_session(cache=cache)
+    assert util.read_request(util.get_request("http://example.edu/a",
+                                              session)) == b"cached"
+    assert util.get_request("http://example.edu/b", session) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_revalidation(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    network = StaticAdapter(body=b"fresh", headers={"ETag": '"v1"'})
+    session = session_for(cache.adapter(network))
+    assert session.get("http://example.edu/a").content == b"fresh"
+    network.status, network.body = 304, b""
+    assert session.get("http://example.edu/a").content == b"fresh"
+    assert network.sent[-1]["If-None-Match"] == '"v1"'
+    assert (cache.hits, cache.misses, cache.revalidated) == (1, 1, 1)
+    cache.close()
+
+
+def test_counters_are_thread_safe(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path), offline=True)
+    cache.put("http://example.edu/a", b"cached")
+    session = session_for(cache.adapter(StaticAdapter()))
+
+    def read():
+        for _ in range(200):
+            session.get("http://example.edu/a")
+            session.get("http://example.edu/b")
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (1600, 1600)
+    cache.close()
+
+
+def test_caches_share_a_directory(tmp_path, monkeypatch):
+    # what the crawl processes of a sharded crawl do
+    monkeypatch.setattr(page_cache, "BUSY_TIMEOUT", 0.5)
+    first = page_cache.PageCache(str(tmp_path))
+    second = page_cache.PageCache(str(tmp_path))
+    for i in range(20):
+        first.put("http://example.edu/a{}".format(i), b"a%d" % i)
+        second.put("http://example.edu/b{}".format(i), b"b%d" % i)
+    assert first.get("http://example.edu/b3")["body"] == b"b3"
+    assert second.get("http://example.edu/a3")["body"] == b"a3"
+    assert first.write_errors == second.write_errors == 0
+    first.close()
+    second.close()
+
+
+def test_locked_writes_are_counted_and_pages_still_served(tmp_path,
+                                                          monkeypatch, capsys):
+    monkeypatch.setattr(page_cache, "BUSY_TIMEOUT", 0.05)
+    cache = page_cache.PageCache(str(tmp_path))
+    other = sqlite3.connect(str(tmp_path / "index.sqlite3"))
+    other.execute("BEGIN IMMEDIATE")
+    session = session_for(cache.adapter(StaticAdapter(body=b"fresh")))
+    assert session.get("http://example.edu/a").content == b"fresh"
+    assert cache.write_errors == 1 and cache.size() == 0
+    other.rollback()
+    other.close()
+    assert session.get("http://example.edu/a").content == b"fresh"
+    assert cache.get("http://example.edu/a")["body"] == b"fresh"
+    assert cache.size() == 5
+    cache.close()
+    cache.report()
+    assert "1 writes to the page cache" in capsys.readouterr().out
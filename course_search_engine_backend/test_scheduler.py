@@ -0,0 +1,125 @@
+'''
+Tests for the polite request scheduler (scheduler.py).
+'''
+# pylint: skip-file
+
+import time
+
+import requests
+import requests.adapters
+import pytest
+
+import scheduler
+import util
+
+ROBOTS = b"User-agent: *\nDisallow: /private/\n"
+
+
+class ScriptedAdapter(requests.adapters.BaseAdapter):
+    '''
+    Answers robots.txt with ROBOTS and the other requests with the
+    statuses of script in turn (an exception instance is raised), then
+    with 200; records when each request was sent.
+    '''
+
+    def __init__(self, script=()):
+        super().__init__()
+        self.script = list(script)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.headers = requests.structures.CaseInsensitiveDict()
+        if request.url.endswith("/robots.txt"):
+            response.status_code = 200
+            response._content = ROBOTS
+            return response
+        self.sent.append(time.monotonic())
+        status = self.script.pop(0) if self.script else 200
+        if isinstance(status, Exception):
+            raise status
+        if isinstance(status, tuple):
+            status, retry_after = status
+            response.headers["Retry-After"] = str(retry_after)
+        response.status_code = status
+        response._content = b"page"
+        return response
+
+    def close(self):
+        pass
+
+
+def session_for(polite, inner, retries=3, backoff_factor=0.01):
+    session = requests.Session()
+    session.mount("http://", polite.adapter(inner, retries, backoff_factor))
+    return session
+
+
+def test_retries_go_through_the_scheduler():
+    polite = scheduler.PoliteScheduler(max_rate=1000)
+    inner = ScriptedAdapter([503, 503])
+    session = session_for(polite, inner)
+    assert session.get("http://example.edu/a").status_code == 200
+    assert len(inner.sent) == 3
+    assert polite.throughput()["requests"] == 3
+    assert polite.throughput()["errors"] == 2
+
+
+def test_gives_up_after_retries():
+    polite = scheduler.PoliteScheduler(max_rate=1000)
+    inner = ScriptedAdapter([500] * 10)
+    session = session_for(polite, inner, retries=2)
+    assert session.get("http://example.edu/a").status_code == 500
+    assert len(inner.sent) == 3
+
+
+def test_connection_errors_are_retried():
+    polite = scheduler.PoliteScheduler(max_rate=1000)
+    inner = ScriptedAdapter([requests.exceptions.ConnectionError("down")])
+    session = session_for(polite, inner)
+    assert session.get("http://example.edu/a").status_code == 200
+    inner = ScriptedAdapter([requests.exceptions.ConnectionError("down")] * 5)
+    session = session_for(polite, inner, retries=1)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get("http://example.edu/a")
+
+
+def test_retry_after_paces_the_retry():
+    polite = scheduler.PoliteScheduler(max_rate=1000)
+    inner = ScriptedAdapter([(429, 0.3)])
+    session = session_for(polite, inner)
+    assert session.get("http://example.edu/a").status_code == 200
+    assert inner.sent[1] - inner.sent[0] >= 0.3
+
+
+def test_robots_txt():
+    polite = scheduler.PoliteScheduler(max_rate=1000)
+    inner = ScriptedAdapter()
+    session = session_for(polite, inner)
+    assert session.get("http://example.edu/private/a").status_code == 403
+    assert session.get("http://example.edu/public/a").status_code == 200
+    assert polite.throughput()["disallowed"] == 1
+    assert len(inner.sent) == 1
+
+
+def test_rate_limit():
+    polite = scheduler.PoliteScheduler(max_rate=20)
+    inner = ScriptedAdapter()
+    session = session_for(polite, inner)
+    for _ in range(6):
+        session.get("http://example.edu/a")
+    # the bucket starts at half the rate, with a single token
+    assert inner.sent[-1] - inner.sent[0] >= 5 / 20
+
+
+def test_make_session_leaves_retries_to_the_scheduler():
+    polite = scheduler.PoliteScheduler()
+    session = util.make_session(scheduler=polite, retries=4)
+    adapter = session.get_adapter("http://example.edu/")
+    assert isinstance(adapter, scheduler.SchedulingAdapter)
+    assert adapter.retries == 4
+    assert adapter.inner.max_retries.total == 0
+    plain = util.make_session(retries=4).get_adapter("http://example.edu/")
+    assert plain.max_retries.total == 4
@@ -0,0 +1,74 @@
+'''
+Tests for the index shards of the multi-process crawl (shards.py and
+crawler.go with num_shards).
+'''
+# pylint: skip-file
+
+import collections
+
+import crawler
+import index_writers
+import shards
+from conftest import COURSE_MAP_FILENAME
+
+
+def test_shard_of_is_stable_and_spread():
+    urls = ["http://host/page{}.html".format(i) for i in range(1000)]
+    assignment = [shards.shard_of(url, 4) for url in urls]
+    # blake2b, not hash(): the same in every process and every run
+    assert shards.shard_of("http://host/page0.html", 4) == 2
+    assert assignment == [shards.shard_of(url, 4) for url in urls]
+    counts = collections.Counter(assignment)
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert min(counts.values()) > 200
+
+
+def test_runs_are_sorted_and_deduplicated(tmp_path):
+    writer = shards.RunWriter(str(tmp_path / "shard"), run_size=3)
+    for pair in [(2, "b"), (1, "z"), (2, "b"), (1, "a"), (3, "c"),
+                 (10, "a")]:
+        writer.add(*pair)
+    runs = writer.close()
+    assert runs == [str(tmp_path / "shard.run0"), str(tmp_path / "shard.run1")]
+    assert list(shards.read_run(runs[0])) == [(1, "a"), (1, "z"), (2, "b")]
+    # course ids are read back as numbers, so 10 sorts after 3
+    assert list(shards.read_run(runs[1])) == [(3, "c"), (10, "a")]
+    assert shards.RunWriter(str(tmp_path / "empty")).close() == []
+
+
+def test_merge_drops_the_pairs_runs_share(tmp_path):
+    pairs = [[(1, "a"), (2, "b"), (3, "c")], [(2, "b"), (4, "d")],
+             [(1, "a"), (3, "c"), (3, "d"), (5, "x|y")]]
+    runs = []
+    for shard, shard_pairs in enumerate(pairs):
+        writer = shards.RunWriter(str(tmp_path / str(shard)), run_size=2)
+        for pair in shard_pairs:
+            writer.add(*pair)
+        runs += writer.close()
+    index = str(tmp_path / "index.csv")
+    rows = shards.merge_runs(runs, index_writers.CsvIndexWriter(index))
+    expected = sorted(set(pair for shard_pairs in pairs for pair in shard_pairs))
+    assert rows == len(expected)
+    assert list(shards.read_run(index)) == expected
+
+
+def read_rows(filename):
+    with open(filename) as f:
+        return sorted(f)
+
+
+def test_sharded_crawl_shares_the_page_cache(catalog_server, tmp_path, capfd):
+    serial = str(tmp_path / "serial.csv")
+    sharded = str(tmp_path / "sharded.csv")
+    replayed = str(tmp_path / "replayed.csv")
+    cache_dir = str(tmp_path / "cache")
+    crawler.go(100, COURSE_MAP_FILENAME, serial, cache_dir=None)
+    # the shards write the pages they fetch to the cache the parent has open
+    crawler.go(100, COURSE_MAP_FILENAME, sharded, num_shards=2,
+               cache_dir=cache_dir)
+    assert read_rows(sharded) == read_rows(serial)
+    # so all of them can be replayed from it
+    crawler.go(100, COURSE_MAP_FILENAME, replayed, num_shards=2,
+               cache_dir=cache_dir, offline=True)
+    assert read_rows(replayed) == read_rows(serial)
+    assert "page cache" not in capfd.readouterr().out
@@ -0,0 +1,53 @@
+'''
+Tests for the course block tokenizer (tokenizer.py).
+'''
+# pylint: skip-file
+
+import crawler
+import tokenizer
+
+TOKENIZER = tokenizer.Tokenizer(["the", "and"])
+
+
+def test_words():
+    words = TOKENIZER.words("The Theory and C3PO's 2nd_year snake_case 42")
+    # words start with a letter
+    assert words == {"theory", "c3po", "s", "nd_year", "snake_case"}
+
+
+def test_course_codes():
+    assert TOKENIZER.course_codes("CMSC 12100. Computer Science I.") == \
+        ["CMSC 12100"]
+    assert TOKENIZER.course_codes("ANTH 20701-20702-20703. Intro Sequence") \
+        == ["ANTH 20701", "ANTH 20702", "ANTH 20703"]
+    assert TOKENIZER.course_codes("CMSC 1210. Not a course") == []
+
+
+def test_tokenize_blocks_matches_block_by_block():
+    blocks = [("CMSC 12100. Computer Science I.", "Theory and Practice."),
+              ("MATH 15100-15200. Calculus", "Limits, derivatives.")]
+    assert TOKENIZER.tokenize_blocks(blocks) == [
+        (TOKENIZER.course_codes(title),
+         TOKENIZER.words(title + " " + descrip))
+        for title, descrip in blocks]
+    assert TOKENIZER.tokenize_blocks([]) == []
+
+
+def test_tokenize_blocks_keeps_blocks_apart():
+    blocks = [("CMSC 12100. A\x00B", "x"), ("CMSC 12200. C", "y")]
+    assert TOKENIZER.tokenize_blocks(blocks) == [
+        (["CMSC 12100"], {"cmsc", "a", "b", "x"}),
+        (["CMSC 12200"], {"cmsc", "c", "y"})]
+
+
+def test_tokenize_fields_keeps_every_occurrence():
+    assert TOKENIZER.tokenize_fields([("CMSC 12100. The Data", "data and the data")]) \
+        == [(["CMSC 12100"], ["cmsc", "the", "data"],
+             ["data", "and", "the", "data"])]
+
+
+def test_crawler_words():
+    assert crawler.get_valid_words("The Course covers Graphs, TREES and k9s") \
+        == {"covers", "graphs", "trees", "k9s"}
+    assert crawler.extract_course_codes("CMSC 15100-15200. Intro") == \
+        ["CMSC 15100", "CMSC 15200"]
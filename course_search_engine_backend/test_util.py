@@ -0,0 +1,64 @@
+'''
+Tests for the link resolution of util.py.
+'''
+# pylint: skip-file
+
+import itertools
+
+import pytest
+
+import crawler
+import mirror
+import util
+
+DOMAIN = "classes.cs.uchicago.edu"
+PAGES = [
+    "http://www.classes.cs.uchicago.edu/a/b/page.html",
+    "http://www.classes.cs.uchicago.edu/a/b/",
+    "http://www.classes.cs.uchicago.edu/a/b/other.html?x=1#top",
+    "http://www.classes.cs.uchicago.edu/a/b",
+    "http://www.classes.cs.uchicago.edu",
+    "https://www.classes.cs.uchicago.edu/a/index.html",
+]
+HREFS = ["c.html", "c", "./c.html", "../c.html", "../../../../c.html",
+         "/root.html", "//www.classes.cs.uchicago.edu/x.html",
+         "http://www.classes.cs.uchicago.edu/d/", "https://other.edu/e.html",
+         "www.classes.cs.uchicago.edu/f.html", "uchicago.edu/g.html", "",
+         "#frag", "?q=1", ".", "..", "c.pdf", "mailto:a@b.edu", "sub/dir/",
+         "c.html#part", "c.html?q=1"]
+
+
+def unmemoized(current_url, new_url, limiting_domain):
+    url = util.convert_if_relative_url(current_url, new_url)
+    if url and util.is_url_ok_to_follow(url, limiting_domain):
+        return url
+    return None
+
+
+@pytest.mark.parametrize("page, href", list(itertools.product(PAGES, HREFS)))
+def test_resolve_link_matches_unmemoized(page, href):
+    assert util.resolve_link(page, href, DOMAIN) == \
+        unmemoized(page, href, DOMAIN)
+
+
+def test_link_base():
+    assert util.link_base("http://cs.uchicago.edu/pa/pa1.html", "pa2.html") == \
+        "http://cs.uchicago.edu/pa/"
+    assert util.link_base("http://cs.uchicago.edu/pa/pa1.html?x", "#top") == \
+        "http://cs.uchicago.edu/pa/pa1.html?x"
+
+
+def test_links_of_a_directory_share_the_cache(course_map):
+    catalog = mirror.SyntheticCatalog(120, course_map)
+    util.resolve_link_from.cache_clear()
+    for program in range(40):
+        url = catalog.program_url(program)
+        soup = crawler.parse_html(catalog.get(url),
+                                  parse_only=crawler.LINK_STRAINER)
+        links = crawler.extract_links(soup, url, DOMAIN)
+        assert links == {href for href in
+                         (unmemoized(url, link.get('href'), DOMAIN)
+                          for link in soup.find_all('a')) if href}
+    info = util.resolve_link_from.cache_info()
+    # every program page repeats the same navigation links
+    assert info.hits > info.misses
@@ -0,0 +1,100 @@
+'''
+Tokenizer for course blocks.
+
+Turns the title and description text of course blocks into index words
+and course codes. Patterns are compiled once and their findall methods
+bound once per page in tokenize_blocks, which collects the words of a
+block in one set, dropping the ignored ones in place. Joining a page's
+blocks to lowercase them in one call, and interning the words, both cost
+more than they saved (see bench_crawler.py tokenizer).
+'''
+# pylint: disable-msg=invalid-name
+
+import re
+
+# valid words start with a-z and contain only a-z, 0-9, and/or _
+WORD_RE = re.compile(r'[a-z][a-z0-9_]*')
+# a department followed by one course number or a sequence of them,
+# e.g. "CMSC 12100" or "CMSC 12100-12200-12300"
+COURSE_CODE_RE = re.compile(r'([A-Z]+)\s+((?:\d{5}(?:-\d{5})*))')
+
+# field flags of a posting: where in its course block a word appears
+TITLE = 1
+DESCRIPTION = 2
+
+
+class Tokenizer:
+    '''
+    Extracts index words and course codes from course block text.
+
+    Inputs:
+        ignore: words that are never indexed
+    '''
+
+    def __init__(self, ignore=()):
+        self.ignore = frozenset(ignore)
+
+    def words(self, text):
+        '''
+        Returns the set of valid, non-ignored words in text, lowercased.
+        '''
+        words = set(WORD_RE.findall(text.lower()))
+        words -= self.ignore
+        return words
+
+    def course_codes(self, title_text):
+        '''
+        Returns the list of course codes in a course block title, with
+        sequences expanded, e.g. "ANTH 20701-20702" yields
+        ["ANTH 20701", "ANTH 20702"].
+        '''
+        course_codes = []
+        for dept, all_num in COURSE_CODE_RE.findall(title_text):
+            if '-' in all_num:
+                course_codes.extend([dept + " " + num
+                                     for num in all_num.split('-')])
+            else:
+                course_codes.append(dept + " " + all_num)
+        return course_codes
+
+    def tokenize_blocks(self, blocks):
+        '''
+        Tokenizes all the course blocks of a page at once.
+
+        Inputs:
+            blocks: list of (title text, description text) pairs
+
+        Outputs:
+            list with a (course codes, set of words) pair for every block,
+              where the words come from the title and the description
+        '''
+        findall = WORD_RE.findall
+        course_codes = self.course_codes
+        ignore = self.ignore
+        tokens = []
+        for title, descrip in blocks:
+            # a word never spans the space between title and description
+            words = set(findall(title.lower()))
+            words.update(findall(descrip.lower()))
+            words -= ignore
+            tokens.append((course_codes(title), words))
+        return tokens
+
+    def tokenize_fields(self, blocks):
+        '''
+        Tokenizes course blocks keeping every occurrence of every word,
+        in order, for postings with term frequencies and positions.
+
+        Inputs:
+            blocks: list of (title text, description text) pairs
+
+        Outputs:
+            list with a (course codes, title words, description words)
+              triple for every block, where the words are lists of all the
+              lowercased words, ignored ones included (so positions count
+              them)
+        '''
+        findall = WORD_RE.findall
+        return [(self.course_codes(title), findall(title.lower()),
+                 findall(descrip.lower()))
+                for title, descrip in blocks]
@@ -5,20 +5,85 @@ Utility code
 # pylint: disable-msg=len-as-condition, no-else-return, undefined-variable
 # pylint: disable-msg=too-many-return-statements, superfluous-parens
 # pylint: disable=R1714
+import functools
 import urllib.parse
 import os
+import re
 import requests
+import requests.adapters
+import urllib3.util.retry
 import bs4
 
 ######### DO NOT CHANGE THIS CODE  #########
 
-def get_request(url):
+POOL_SIZE = 10
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+REQUEST_TIMEOUT = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(pool_size=POOL_SIZE, retries=MAX_RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, cache=None, scheduler=None,
+                 metrics=None):
+    '''
+    Create a session that keeps connections to each host alive, so a
+    crawl reuses them instead of opening a new connection per page.
+
+    Inputs:
+        pool_size: number of connections kept open per host (should be
+          at least the number of threads sharing the session)
+        retries: number of times to retry a GET on connection errors
+          and on 429/5xx responses
+        backoff_factor: retries sleep backoff_factor * 2 ** (retry - 1)
+          seconds between attempts
+        cache: optional page_cache.PageCache to answer requests from
+        scheduler: optional scheduler.PoliteScheduler to pace the
+          requests that go to the network (retries included: it retries
+          them instead of urllib3)
+        metrics: optional metrics.CrawlMetrics to time every request
+          with (cache hits included)
+
+    Outputs:
+        requests.Session object
+
+    Examples:
+        get_request("http://www.cs.uchicago.edu", make_session())
+    '''
+    retry = urllib3.util.retry.Retry(total=retries,
+                                     backoff_factor=backoff_factor,
+                                     status_forcelist=RETRY_STATUSES,
+                                     allowed_methods=["GET", "HEAD"],
+                                     raise_on_status=False)
+    if scheduler is not None:
+        # the scheduler retries, so that every attempt waits for it
+        retry = 0
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size,
+                                            max_retries=retry)
+    # cache hits never reach the scheduler; everything else is paced
+    if scheduler is not None:
+        adapter = scheduler.adapter(adapter, retries, backoff_factor)
+    if cache is not None:
+        adapter = cache.adapter(adapter)
+    if metrics is not None:
+        adapter = metrics.adapter(adapter)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_request(url, session=None, timeout=REQUEST_TIMEOUT):
     '''
     Open a connection to the specified URL and if successful
     read the data.
 
     Inputs:
         url: must be an absolute URL
+        session: optional session (see make_session) to send the
+          request through, reusing its pooled connections
+        timeout: seconds to wait for the server before giving up
 
     Outputs:
         request object or None
@@ -29,7 +94,10 @@ def get_request(url):
 
     if is_absolute_url(url):
         try:
-            r = requests.get(url)
+            if session is None:
+                r = requests.get(url, timeout=timeout)
+            else:
+                r = session.get(url, timeout=timeout)
             if r.status_code == 404 or r.status_code == 403:
                 r = None
         except Exception:
@@ -77,6 +145,26 @@ def remove_fragment(url):
     return url
 
 
+def normalize_url(url):
+    '''
+    Put an absolute URL in a canonical form, so that different spellings
+    of the same page compare equal: lowercase scheme and host, no default
+    port, no fragment and a "/" path for the site root.
+
+    Examples:
+        normalize_url("HTTP://Cs.UChicago.edu:80#top") yields
+            'http://cs.uchicago.edu/'
+    '''
+    parsed_url = urllib.parse.urlsplit(url)
+    scheme = parsed_url.scheme.lower()
+    netloc = parsed_url.netloc.lower()
+    if (scheme, netloc[-3:]) == ("http", ":80") or \
+            (scheme, netloc[-4:]) == ("https", ":443"):
+        netloc = netloc[:netloc.rindex(":")]
+    path = parsed_url.path or "/"
+    return urllib.parse.urlunsplit((scheme, netloc, path, parsed_url.query, ""))
+
+
 def convert_if_relative_url(current_url, new_url):
     '''
     Attempt to determine whether new_url is a relative URL and if so,
@@ -101,17 +189,18 @@ def convert_if_relative_url(current_url, new_url):
     if new_url == "" or not is_absolute_url(current_url):
         return None
 
-    if is_absolute_url(new_url):
+    # parse new_url once and reuse the parts below
+    parsed_url = urllib.parse.urlparse(new_url)
+    if parsed_url.netloc != "":
         return new_url
 
-    parsed_url = urllib.parse.urlparse(new_url)
     path_parts = parsed_url.path.split("/")
 
     if len(path_parts) == 0:
         return None
 
     ext = path_parts[0][-4:]
-    if ext in [".edu", ".org", ".com", ".net"]:
+    if ext in TOP_LEVEL_DOMAINS:
         return "http://" + new_url
     elif new_url[:3] == "www":
         return "http://" + new_url
@@ -119,6 +208,9 @@ def convert_if_relative_url(current_url, new_url):
         return urllib.parse.urljoin(current_url, new_url)
 
 
+TOP_LEVEL_DOMAINS = frozenset((".edu", ".org", ".com", ".net"))
+
+
 ARCHIVES = ("https://www.classes.cs.uchicago.edu/archive/2015/winter"
             "/12200-1/new.collegecatalog.uchicago.edu/thecollege/archives")
 LEN_ARCHIVES = len(ARCHIVES)
@@ -128,6 +220,18 @@ ARCHIVES_HTTP = ("http://www.classes.cs.uchicago.edu/archive/2015/winter"
             "/12200-1/new.collegecatalog.uchicago.edu/thecollege/archives")
 LEN_ARCHIVES_HTTP = len(ARCHIVES_HTTP)
 
+# URLs never followed, whatever their domain: mail addresses, anything
+# with an "@" and the catalog archives
+DENY_RE = re.compile("mailto:|@|^(?:{}|{})".format(re.escape(ARCHIVES),
+                                                  re.escape(ARCHIVES_HTTP)))
+FOLLOWED_SCHEMES = frozenset(("http", "https"))
+FOLLOWED_EXTENSIONS = frozenset(("", ".html"))
+
+# (page directory, href, domain) triples remembered by resolve_link, and
+# page URLs whose directory is remembered
+LINK_CACHE_SIZE = 65536
+DIRECTORY_CACHE_SIZE = 1024
+
 
 def is_url_ok_to_follow(url, limiting_domain):
     '''
@@ -149,37 +253,83 @@ def is_url_ok_to_follow(url, limiting_domain):
             yields False
     '''
 
-    if "mailto:" in url:
-        return False
-
-    if "@" in url:
-        return False
-
-    if url[:LEN_ARCHIVES] == ARCHIVES or url[:LEN_ARCHIVES_HTTP] == ARCHIVES_HTTP:
+    if DENY_RE.search(url):
         return False
 
     parsed_url = urllib.parse.urlparse(url)
-    if parsed_url.scheme != "http" and parsed_url.scheme != "https":
+    if parsed_url.scheme not in FOLLOWED_SCHEMES:
         return False
 
     if parsed_url.netloc == "":
         return False
 
-    if parsed_url.fragment != "":
-        return False
-
-    if parsed_url.query != "":
+    if parsed_url.fragment != "" or parsed_url.query != "":
         return False
 
     loc = parsed_url.netloc
-    ld = len(limiting_domain)
-    trunc_loc = loc[-(ld+1):]
-    if not (limiting_domain == loc or (trunc_loc == "." + limiting_domain)):
+    if not (loc == limiting_domain or loc.endswith("." + limiting_domain)):
         return False
 
     # does it have the right extension
     (filename, ext) = os.path.splitext(parsed_url.path)
-    return (ext == "" or ext == ".html")
+    return ext in FOLLOWED_EXTENSIONS
+
+
+def resolve_link(current_url, new_url, limiting_domain):
+    '''
+    Combines convert_if_relative_url and is_url_ok_to_follow for a link
+    found on a page. Memoized on the link and the directory of the page
+    (see link_base), since the pages of a catalog directory repeat the
+    same navigation links over and over.
+
+    Inputs:
+        current_url: absolute URL of the page the link is on
+        new_url: the href of the link
+        limiting_domain: domain name
+
+    Outputs:
+        the absolute URL to follow, or None if the link should not be
+        followed
+    '''
+    return resolve_link_from(link_base(current_url, new_url), new_url,
+                             limiting_domain)
+
+
+def link_base(current_url, new_url):
+    '''
+    The part of current_url that new_url is resolved against: its
+    directory (scheme, host and path up to the last "/"), or all of it
+    when new_url is empty or only a query or a fragment.
+
+    Examples:
+        link_base("http://cs.uchicago.edu/pa/pa1.html", "pa2.html") yields
+            'http://cs.uchicago.edu/pa/'
+    '''
+    if new_url[:1] in ("", "?", "#"):
+        return current_url
+    return page_directory(current_url)
+
+
+@functools.lru_cache(maxsize=DIRECTORY_CACHE_SIZE)
+def page_directory(url):
+    '''
+    The URL of the directory of url (see link_base).
+    '''
+    parsed_url = urllib.parse.urlsplit(url)
+    path = parsed_url.path[:parsed_url.path.rfind("/") + 1]
+    return urllib.parse.urlunsplit((parsed_url.scheme, parsed_url.netloc,
+                                    path, "", ""))
+
+
+@functools.lru_cache(maxsize=LINK_CACHE_SIZE)
+def resolve_link_from(base, new_url, limiting_domain):
+    '''
+    resolve_link for a link whose page has the link_base base.
+    '''
+    url = convert_if_relative_url(base, new_url)
+    if url and is_url_ok_to_follow(url, limiting_domain):
+        return url
+    return None
 
 
 def is_subsequence(tag):
@@ -204,8 +354,8 @@ def find_sequence(tag):
     '''
     rv = []
     sib_tag = tag.next_sibling
-    while is_subsequence(sib_tag) or is_whitespace(tag):
-        if not is_whitespace(tag):
+    while is_subsequence(sib_tag) or is_whitespace(sib_tag):
+        if not is_whitespace(sib_tag):
             rv.append(sib_tag)
         sib_tag = sib_tag.next_sibling
     return rv
@@ -0,0 +1,147 @@
+'''
+Course search engine: benchmarks
+
+Replays the find_courses calls of find_courses_tests.json:
+
+    python3 bench_courses.py queries <tuned database>
+
+times every query against course_information.sqlite3 and against a copy
+tuned by tune_db.py, and checks both return the same rows.
+
+    python3 bench_courses.py walking [database]
+
+compares compute_time_between called pair by pair with the vectorized
+compute_times_between, and the walking-time sources of find_courses
+(see courses.walking_source) on the walking-time queries.
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import courses
+
+TESTS_FILENAME = os.path.join(courses.DATA_DIR, 'find_courses_tests.json')
+SOURCE_FILENAME = os.path.join(courses.DATA_DIR, 'course_information.sqlite3')
+# calls of every query timed, after one warm-up call
+REPEAT = 20
+
+
+def load_queries(filename=TESTS_FILENAME):
+    """
+    the find_courses inputs of a tests file, with their test numbers
+    """
+    with open(filename) as f:
+        return [(test["test_num"], test["input"]) for test in json.load(f)]
+
+
+def replay(database, queries, repeat=REPEAT, walking=None):
+    """
+    run every query against database, repeat times after a warm-up call,
+    getting walking times from walking (see courses.walking_source) if
+    it is set; the result cache is off, so every call runs the query
+
+    returns the list of (seconds per call, sorted result rows) per query
+    """
+    saved = (courses.DATABASE_FILENAME, courses.walking_source,
+             courses.RESULT_CACHE.size)
+    courses.DATABASE_FILENAME = database
+    courses.RESULT_CACHE.size = 0
+    courses.RESULT_CACHE.clear()
+    if walking is not None:
+        courses.walking_source = lambda pool, args_from_ui: walking
+    try:
+        timings = []
+        for _, args in queries:
+            columns, rows = courses.find_courses(args)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                courses.find_courses(args)
+            seconds = (time.perf_counter() - start) / repeat
+            timings.append((seconds, (columns, sorted(rows))))
+        return timings
+    finally:
+        (courses.DATABASE_FILENAME, courses.walking_source,
+         courses.RESULT_CACHE.size) = saved
+
+
+def bench_queries(tuned_database):
+    """
+    compare the queries of find_courses_tests.json on the original and
+    the tuned database
+    """
+    queries = load_queries()
+    before = replay(SOURCE_FILENAME, queries)
+    after = replay(tuned_database, queries)
+    print("{:>5}  {:>11} {:>11} {:>8}  {}".format(
+        "test", "before ms", "after ms", "speedup", "fields"))
+    for (num, args), (old, old_rows), (new, new_rows) in zip(queries, before, after):
+        print("{:>5}  {:>11.3f} {:>11.3f} {:>7.1f}x  {}{}".format(
+            num, old * 1000, new * 1000, old / new, ", ".join(sorted(args)),
+            "" if old_rows == new_rows else "  DIFFERENT"))
+    total_before = sum(seconds for seconds, _ in before)
+    total_after = sum(seconds for seconds, _ in after)
+    print("{:>5}  {:>11.3f} {:>11.3f} {:>7.1f}x  {}".format(
+        "all", total_before * 1000, total_after * 1000,
+        total_before / total_after,
+        "same rows" if [rows for _, rows in before] == [rows for _, rows in after]
+        else "DIFFERENT ROWS"))
+
+
+def bench_walking(database):
+    """
+    compare the scalar and vectorized walking times, on every pair of
+    buildings and in find_courses
+    """
+    conn = sqlite3.connect(database)
+    buildings = conn.execute("SELECT lon, lat FROM gps").fetchall()
+    conn.close()
+    pairs = [src + dst for src in buildings for dst in buildings] * REPEAT
+    lon1, lat1, lon2, lat2 = zip(*pairs)
+    start = time.perf_counter()
+    scalar = [courses.compute_time_between(*pair) for pair in pairs]
+    scalar_time = time.perf_counter() - start
+    start = time.perf_counter()
+    vector = courses.compute_times_between(lon1, lat1, lon2, lat2)
+    vector_time = time.perf_counter() - start
+    print("{} building pairs: compute_time_between {:.1f} ms,"
+          " compute_times_between {:.1f} ms ({:.1f}x, {}, NumPy {})".format(
+              len(pairs), scalar_time * 1000, vector_time * 1000,
+              scalar_time / vector_time,
+              "same minutes" if scalar == vector else "DIFFERENT",
+              "installed" if courses.np is not None else "not installed"))
+
+    queries = [(num, args) for num, args in load_queries()
+               if "walking_time" in args]
+    sources = [courses.WALKING_UDF]
+    if courses.np is not None:
+        sources.append(courses.WALKING_COORDINATES)
+    if courses.get_pool(database).has_table("walking_times"):
+        sources.append(courses.WALKING_TABLE)
+    results = [replay(database, queries, walking=walking) for walking in sources]
+    print("{} walking-time queries on {}".format(len(queries), database))
+    base = sum(seconds for seconds, _ in results[0])
+    for walking, timings in zip(sources, results):
+        total = sum(seconds for seconds, _ in timings)
+        same = [rows for _, rows in timings] == [rows for _, rows in results[0]]
+        print("  {:<12} {:>9.3f} ms  {:>5.2f}x  {}".format(
+            walking, total * 1000, base / total,
+            "same rows" if same else "DIFFERENT ROWS"))
+
+
+BENCHMARKS = {
+    "queries": bench_queries,
+    "walking": bench_walking,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python3 bench_courses.py")
+    arg_parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    arg_parser.add_argument("database", nargs="?", default=SOURCE_FILENAME,
+                            help="database (tuned by tune_db.py, for queries)")
+    args = arg_parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args.database)
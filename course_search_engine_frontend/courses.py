@@ -5,13 +5,58 @@ Xinyue 'Yolanda' Pan
 '''
 
 from math import radians, cos, sin, asin, sqrt, ceil
+from urllib.request import pathname2url
+import collections
+import contextlib
 import sqlite3
+import threading
+import time
 import os
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # Use this filename for the database
 DATA_DIR = os.path.dirname(__file__)
-DATABASE_FILENAME = os.path.join(DATA_DIR, 'course_information.sqlite3')
+# COURSES_DATABASE can name a tuned copy of it (see tune_db.py)
+DATABASE_FILENAME = os.environ.get(
+    "COURSES_DATABASE", os.path.join(DATA_DIR, 'course_information.sqlite3'))
+
+# most read-only connections kept open per database, and the seconds
+# find_courses waits for one when all of them are in use
+POOL_SIZE = 8
+POOL_TIMEOUT = 10
+# prepared statements each connection keeps, one per query shape
+CACHED_STATEMENTS = 256
+# where find_courses gets walking times from: the walking_times table of
+# a tuned database (see tune_db.py), the building coordinates of the
+# result rows (computed with NumPy after the query), or compute_time_between
+# called by SQLite on every row
+WALKING_TABLE = "table"
+WALKING_COORDINATES = "coordinates"
+WALKING_UDF = "udf"
+# minutes this close to a whole number are computed again with
+# compute_time_between: NumPy's sin and cos can differ from math's in
+# the last bit, which would move their ceiling
+WHOLE_MINUTE_TOLERANCE = 1e-9
+# search fields that leave few enough rows for SQLite to compute their
+# walking times faster than NumPy after the query
+NARROWING_KEYS = ("dept", "terms")
+
+# find_courses results kept (0 turns the cache off), and the seconds
+# each is kept for
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 600
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA mmap_size = 268435456",  # map up to 256 MiB of the file
+    "PRAGMA cache_size = -16384",    # 16 MiB page cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA query_only = ON",
+)
 
 FIELD_MAPPING_TABLE = {
     "dept": "courses.dept",
@@ -26,9 +71,14 @@ FIELD_MAPPING_TABLE = {
     "course_num": 'courses.course_num'
     }
 
-def compute_projection(args_from_ui):
+def compute_projection(args_from_ui, walking=WALKING_UDF):
     """
     computes the attributes that go in the projection
+
+    walking: where the walking time comes from (WALKING_TABLE,
+      WALKING_COORDINATES or WALKING_UDF); with WALKING_COORDINATES the
+      last four fields are the coordinates of the two buildings, for
+      filter_walking_time to turn into the walking time
     """
     columns = ['dept', 'course_num', 'title']
     fields = [FIELD_MAPPING_TABLE[x] for x in columns]
@@ -38,7 +88,12 @@ def compute_projection(args_from_ui):
         lst = [FIELD_MAPPING_TABLE[x] for x in extra_columns[:-2]]
         fields.extend(lst)
         fields.append('sections.building_code')
-        fields.append("compute_time_between(gps.lon, gps.lat, target.lon, target.lat) AS walking_time")
+        if walking == WALKING_TABLE:
+            fields.append("walking_times.minutes AS walking_time")
+        elif walking == WALKING_COORDINATES:
+            fields.append("gps.lon, gps.lat, target.lon, target.lat")
+        else:
+            fields.append("compute_time_between(gps.lon, gps.lat, target.lon, target.lat) AS walking_time")
         columns.extend(extra_columns)
     
     elif any(key in args_from_ui for key in ["day", "time_start", "time_end", "enrollment"]):
@@ -49,11 +104,14 @@ def compute_projection(args_from_ui):
 
     return ', '.join(fields), columns
 
-def compute_join(args_from_ui):
+def compute_join(args_from_ui, walking=WALKING_UDF):
     """
     write the FROM, ON, JOIN queries
 
     (to compute relations and join conditions)
+
+    walking: with WALKING_TABLE, join the walking_times table (see
+      tune_db.py) instead of gps twice
     """
     query = " courses"
     params = []
@@ -67,15 +125,23 @@ def compute_join(args_from_ui):
     if 'terms' in args_from_ui:
         query += " JOIN catalog_index ON courses.course_id = catalog_index.course_id"
     if any(key in args_from_ui for key in ["building_code", "walking_time"]):
-        query += " JOIN gps ON sections.building_code = gps.building_code"
-        query += " JOIN gps AS target ON target.building_code = ?"
+        if walking == WALKING_TABLE:
+            # a row for every pair of buildings in gps, like the gps joins
+            query += (" JOIN walking_times ON walking_times.src = sections.building_code"
+                      " AND walking_times.dst = ?")
+        else:
+            query += " JOIN gps ON sections.building_code = gps.building_code"
+            query += " JOIN gps AS target ON target.building_code = ?"
         params.append(args_from_ui['building_code'])
     return query, params
 
-def compute_conditions(args_from_ui):
+def compute_conditions(args_from_ui, walking=WALKING_UDF):
     """
     write the WHERE queries
     return clause, arguments
+
+    walking: with WALKING_COORDINATES the walking time is filtered after
+      the query (see filter_walking_time)
     """
     condition = []
     params = []
@@ -91,6 +157,8 @@ def compute_conditions(args_from_ui):
     }
 
     for key, value in args_from_ui.items():
+        if key == 'walking_time' and walking == WALKING_COORDINATES:
+            continue
         if value and key in base_conditions:
             if key in ('terms', 'day'):
                 placeholder = ', '.join(['?' for _ in value])
@@ -116,7 +184,7 @@ def compute_conditions(args_from_ui):
 
     return query, params
 
-def build_query(args_from_ui):
+def build_query(args_from_ui, walking=WALKING_UDF):
 
     """
     input: takes output (strings) from projection and condition functions,
@@ -130,10 +198,12 @@ def build_query(args_from_ui):
         compute_join(args_from_ui)
         compute_conditions(args_from_ui)
 
+    walking: where the walking time comes from (see compute_projection)
+
     """
-    (proj_str, _) = compute_projection(args_from_ui)
-    (join_str, join_args) = compute_join(args_from_ui)
-    (where_str, where_args) = compute_conditions(args_from_ui)
+    (proj_str, _) = compute_projection(args_from_ui, walking)
+    (join_str, join_args) = compute_join(args_from_ui, walking)
+    (where_str, where_args) = compute_conditions(args_from_ui, walking)
 
     query_format = """SELECT {}\nFROM {}\n{}"""
     query = query_format.format(proj_str, join_str, where_str)
@@ -166,17 +236,29 @@ def find_courses(args_from_ui):
 
     if not args_from_ui:
         return ([], [])
-    else:
-        (query, args) = build_query(args_from_ui)
 
-    _, columns = compute_projection(args_from_ui)
+    filename = DATABASE_FILENAME
+    version = database_version(filename)
+    if RESULT_CACHE.changed(filename, version):
+        # the tables may have changed too
+        reset_pool(filename)
+    key = (filename, canonical_args(args_from_ui))
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        columns, results = cached
+        # callers get lists of their own
+        return (list(columns), list(results))
 
-    conn = sqlite3.connect(DATABASE_FILENAME)
-    conn.create_function("compute_time_between", 4, compute_time_between)
-    cur = conn.cursor()
+    _, columns = compute_projection(args_from_ui)
 
-    results = cur.execute(query, args).fetchall()
-    conn.close()
+    with pooled_connection(filename) as (pool, conn):
+        walking = walking_source(pool, args_from_ui)
+        (query, args) = build_query(args_from_ui, walking)
+        results = conn.execute(query, args).fetchall()
+    if walking == WALKING_COORDINATES and "walking_time" in args_from_ui:
+        results = filter_walking_time(results, args_from_ui["walking_time"])
+    # unless another query saw the database change while this one ran
+    RESULT_CACHE.put(key, (tuple(columns), tuple(results)), version)
 
     # replace with a list of the attribute names in order and a list
     # of query results.
@@ -184,6 +266,367 @@ def find_courses(args_from_ui):
     return (columns, results)
 
 
+def canonical_args(args_from_ui):
+    """
+    a hashable form of args_from_ui that is the same for every search
+    with the same results: fields in sorted order, and the terms and days
+    sorted (duplicate terms are kept, they change the query)
+    """
+    canonical = []
+    for key, value in sorted(args_from_ui.items()):
+        if key in ('terms', 'day'):
+            value = tuple(sorted(value))
+        elif isinstance(value, list):
+            value = tuple(value)
+        canonical.append((key, value))
+    return tuple(canonical)
+
+
+def database_version(filename):
+    """
+    the modification time and size of a database file, which change
+    whenever it is written
+    """
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class ResultCache:
+    """
+    thread-safe cache of find_courses results: the size most recently
+    used ones, each for at most ttl seconds, and only while the database
+    they came from keeps the version (see database_version) it had
+
+    hits, misses, expired and invalidations count the lookups answered,
+    the lookups not answered, the results dropped for their age and the
+    times a database changed
+    """
+
+    def __init__(self, size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def changed(self, filename, version):
+        """
+        record the current version of the database filename, dropping
+        its results if it changed; returns whether it did
+        """
+        with self._lock:
+            known = self._versions.get(filename)
+            self._versions[filename] = version
+            if known is None or known == version:
+                return False
+            self.invalidations += 1
+            for key in [key for key in self._entries if key[0] == filename]:
+                del self._entries[key]
+            return True
+
+    def get(self, key):
+        """
+        the result cached for key (a database filename and canonical_args
+        pair), or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result, version=None):
+        """
+        cache result for key, evicting the least recently used results
+        beyond size; a result computed from the given version of its
+        database is dropped if changed has seen another version since
+        """
+        if self.size <= 0:
+            return
+        with self._lock:
+            if version is not None and self._versions.get(key[0]) != version:
+                return
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        drop every result (the counters are kept)
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """
+        the counters and the number of results cached
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "expired": self.expired,
+                    "invalidations": self.invalidations,
+                    "size": self.size, "cached": len(self._entries)}
+
+
+RESULT_CACHE = ResultCache()
+
+
+class PoolClosedError(Exception):
+    """
+    raised by ConnectionPool.acquire once the pool is closed (reset_pool
+    closes the pool of a database that changed); get a connection from
+    the new pool instead (see pooled_connection)
+    """
+
+
+class ConnectionPool:
+    """
+    thread-safe pool of read-only connections to a database, opened as
+    they are first needed and reused afterwards
+
+    every connection has compute_time_between registered, the
+    CONNECTION_PRAGMAS applied and a cache of CACHED_STATEMENTS prepared
+    statements, keyed by the SQL text, so queries of the same shape
+    (build_query output with different parameters) are compiled once
+    """
+
+    def __init__(self, filename, size=POOL_SIZE):
+        self.filename = filename
+        self.size = size
+        self.closed = False
+        self._idle = []
+        self._opened = 0
+        # guards closed, _idle and _opened; notified when a connection
+        # is given back, a slot to open one frees up or the pool closes
+        self._available = threading.Condition()
+        self._tables = None
+
+    def _connect(self):
+        uri = "file:{}?mode=ro&cache=shared".format(
+            pathname2url(os.path.abspath(self.filename)))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("compute_time_between", 4, compute_time_between,
+                             deterministic=True)
+        if self._tables is None:
+            self._tables = frozenset(name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        return conn
+
+    def has_table(self, name):
+        """
+        whether the database has the table name
+        """
+        if self._tables is None:
+            # opening a connection finds the tables
+            with self.connection():
+                pass
+        return name in self._tables
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        """
+        take a connection: an idle one, a new one while fewer than size
+        are open, or else the first one released within timeout seconds
+
+        raises PoolClosedError when the pool is closed, before or while
+        waiting, and TimeoutError when no connection frees up in time
+        """
+        deadline = time.monotonic() + timeout
+        with self._available:
+            while True:
+                if self.closed:
+                    raise PoolClosedError(self.filename)
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.size:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("no connection to {} was released"
+                                       " within {} seconds".format(
+                                           self.filename, timeout))
+                self._available.wait(remaining)
+        try:
+            return self._connect()
+        except Exception:
+            self._forget()
+            raise
+
+    def _forget(self):
+        # a connection was closed or never opened: another may be opened
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def release(self, conn):
+        """
+        give back a connection taken with acquire (closing it if the pool
+        was closed since)
+        """
+        with self._available:
+            if not self.closed:
+                self._idle.append(conn)
+                self._available.notify()
+                return
+        conn.close()
+        self._forget()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=POOL_TIMEOUT):
+        """
+        context manager lending a connection of the pool
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        close the idle connections, and the others as they are given
+        back; threads waiting in acquire raise PoolClosedError
+        """
+        with self._available:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+def walking_source(pool, args_from_ui):
+    """
+    where find_courses gets walking times from for the database of pool:
+    its walking_times table if it has one, else, for queries that no
+    dept or terms narrow down to a few rows, the coordinates of the
+    result rows if NumPy is installed, else compute_time_between
+    """
+    if pool.has_table("walking_times"):
+        return WALKING_TABLE
+    if np is not None and not any(key in args_from_ui for key in NARROWING_KEYS):
+        return WALKING_COORDINATES
+    return WALKING_UDF
+
+
+def filter_walking_time(rows, max_minutes):
+    """
+    replace the four building coordinates that end each row (see
+    compute_projection) with the walking time between the buildings, and
+    keep the rows within max_minutes (all of them when it is 0, like the
+    walking_time condition of compute_conditions)
+    """
+    if not rows:
+        return rows
+    lon1, lat1, lon2, lat2 = zip(*[row[-4:] for row in rows])
+    minutes = compute_times_between(lon1, lat1, lon2, lat2)
+    return [row[:-4] + (mins,) for row, mins in zip(rows, minutes)
+            if not max_minutes or mins <= max_minutes]
+
+
+def haversine_many(lon1, lat1, lon2, lat2):
+    """
+    haversine for sequences of coordinates, pair by pair, computed in one
+    go with NumPy (or a haversine call per pair without NumPy)
+
+    returns the meters as a NumPy array (or a list)
+    """
+    if np is None:
+        return [haversine(*pair) for pair in zip(lon1, lat1, lon2, lat2)]
+    lon1, lat1, lon2, lat2 = [np.radians(np.asarray(x, dtype=float))
+                              for x in (lon1, lat1, lon2, lat2)]
+
+    # the operations of haversine, in the same order
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return 6367 * c * 1000
+
+
+def compute_times_between(lon1, lat1, lon2, lat2):
+    """
+    compute_time_between for sequences of coordinates, pair by pair,
+    vectorized with NumPy when it is installed
+
+    returns a list of minutes, equal to compute_time_between's
+    """
+    if np is None:
+        return [compute_time_between(*pair)
+                for pair in zip(lon1, lat1, lon2, lat2)]
+    # the walking speed of compute_time_between
+    mins = haversine_many(lon1, lat1, lon2, lat2) / (1.1 * 60)
+    minutes = np.ceil(mins).astype(int).tolist()
+    for i in np.flatnonzero(np.abs(mins - np.rint(mins)) <= WHOLE_MINUTE_TOLERANCE):
+        minutes[i] = compute_time_between(lon1[i], lat1[i], lon2[i], lat2[i])
+    return minutes
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(filename=None):
+    """
+    the connection pool of a database (DATABASE_FILENAME by default)
+    """
+    filename = filename or DATABASE_FILENAME
+    with _POOLS_LOCK:
+        pool = _POOLS.get(filename)
+        if pool is None:
+            pool = _POOLS[filename] = ConnectionPool(filename)
+    return pool
+
+
+@contextlib.contextmanager
+def pooled_connection(filename=None, timeout=POOL_TIMEOUT):
+    """
+    context manager lending a connection to a database (DATABASE_FILENAME
+    by default) and the pool it belongs to, from the pool that replaced
+    it if reset_pool closed it while waiting
+    """
+    while True:
+        pool = get_pool(filename)
+        try:
+            conn = pool.acquire(timeout)
+            break
+        except PoolClosedError:
+            continue
+    try:
+        yield pool, conn
+    finally:
+        pool.release(conn)
+
+
+def reset_pool(filename):
+    """
+    start a new connection pool for a database that changed; connections
+    lent by the old one are closed with it once given back, and threads
+    waiting for one of them move on to the new pool (see
+    pooled_connection)
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.pop(filename, None)
+    if pool is not None:
+        pool.close()
+
+
 ########### auxiliary functions #################
 ########### do not change this code #############
 
@@ -0,0 +1,93 @@
+'''
+Tests for the connection pool of find_courses
+'''
+
+import sqlite3
+import threading
+import pytest
+
+# pylint: disable= redefined-outer-name, protected-access
+
+import courses
+
+
+@pytest.fixture
+def database(tmp_path):
+    '''
+    A small database with a gps table, and no pool left behind for it.
+    '''
+    filename = str(tmp_path / "pool.sqlite3")
+    conn = sqlite3.connect(filename)
+    conn.execute("CREATE TABLE gps (building_code varchar(5), lon real,"
+                 " lat real)")
+    conn.execute("INSERT INTO gps VALUES ('RY', -87.6, 41.79)")
+    conn.commit()
+    conn.close()
+    yield filename
+    courses.reset_pool(filename)
+
+
+def test_connections_are_reused(database):
+    pool = courses.ConnectionPool(database, size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert pool.has_table("gps")
+    assert not pool.has_table("walking_times")
+    pool.close()
+
+
+def test_connections_are_read_only(database):
+    pool = courses.ConnectionPool(database)
+    with pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM gps")
+        (minutes,) = conn.execute(
+            "SELECT compute_time_between(-87.6, 41.79, -87.6, 41.8)").fetchone()
+    assert minutes == courses.compute_time_between(-87.6, 41.79, -87.6, 41.8)
+    pool.close()
+
+
+def test_acquire_times_out(database):
+    pool = courses.ConnectionPool(database, size=1)
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(conn)
+    assert pool.acquire(timeout=0.05) is conn
+    pool.close()
+
+
+def test_close_closes_lent_connections_once_released(database):
+    pool = courses.ConnectionPool(database, size=1)
+    conn = pool.acquire()
+    pool.close()
+    pool.release(conn)
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    with pytest.raises(courses.PoolClosedError):
+        pool.acquire()
+
+
+def test_reset_pool_wakes_waiters(database):
+    # one connection, held while another thread waits for it
+    courses._POOLS[database] = courses.ConnectionPool(database, size=1)
+    waited = []
+
+    def wait():
+        with courses.pooled_connection(database, timeout=5) as (pool, conn):
+            waited.append(pool)
+            conn.execute("SELECT * FROM gps").fetchall()
+
+    with courses.pooled_connection(database) as (old_pool, _):
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        waiter.join(0.1)
+        assert waiter.is_alive()
+        courses.reset_pool(database)
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert waited == [courses.get_pool(database)]
+    assert waited[0] is not old_pool
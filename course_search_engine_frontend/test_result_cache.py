@@ -0,0 +1,125 @@
+'''
+Tests for the cache of find_courses results
+'''
+
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+# pylint: disable= redefined-outer-name
+
+import courses
+
+SEARCH = {"dept": "CMSC", "day": ["TR", "MWF"]}
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    '''
+    A copy of the course database that find_courses searches, with a
+    cache of its own.
+    '''
+    filename = str(tmp_path / "courses.sqlite3")
+    shutil.copyfile(courses.DATABASE_FILENAME, filename)
+    monkeypatch.setattr(courses, "DATABASE_FILENAME", filename)
+    monkeypatch.setattr(courses, "RESULT_CACHE", courses.ResultCache())
+    yield filename
+    courses.reset_pool(filename)
+
+
+def test_lookups_and_eviction():
+    cache = courses.ResultCache(size=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # b is the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    info = cache.info()
+    assert (info["hits"], info["misses"], info["cached"]) == (3, 2, 2)
+    cache.clear()
+    assert cache.get("a") is None and cache.info()["hits"] == 3
+
+
+def test_results_expire():
+    cache = courses.ResultCache(ttl=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.info()["expired"] == 1
+
+
+def test_size_zero_turns_the_cache_off():
+    cache = courses.ResultCache(size=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_a_new_version_drops_only_its_database():
+    cache = courses.ResultCache()
+    assert not cache.changed("x.sqlite3", (1, 10))
+    assert not cache.changed("y.sqlite3", (1, 10))
+    cache.put(("x.sqlite3", ()), 1)
+    cache.put(("y.sqlite3", ()), 2)
+    assert not cache.changed("x.sqlite3", (1, 10))
+    assert cache.changed("x.sqlite3", (2, 10))
+    assert cache.get(("x.sqlite3", ())) is None
+    assert cache.get(("y.sqlite3", ())) == 2
+    assert cache.info()["invalidations"] == 1
+
+
+def test_results_of_an_old_version_are_not_cached():
+    cache = courses.ResultCache()
+    cache.changed("x.sqlite3", (1, 10))
+    # the database changed while a query of version (1, 10) ran
+    cache.changed("x.sqlite3", (2, 10))
+    cache.put(("x.sqlite3", ()), 1, (1, 10))
+    assert cache.get(("x.sqlite3", ())) is None
+    cache.put(("x.sqlite3", ()), 2, (2, 10))
+    assert cache.get(("x.sqlite3", ())) == 2
+
+
+def test_equivalent_searches_share_a_result(database):
+    header, rows = courses.find_courses(SEARCH)
+    again = courses.find_courses({"day": ["MWF", "TR"], "dept": "CMSC"})
+    assert again == (header, rows)
+    assert courses.RESULT_CACHE.info()["hits"] == 1
+    # callers cannot change what is cached
+    again[1].clear()
+    assert courses.find_courses(SEARCH)[1] == rows
+
+
+def test_writing_the_database_invalidates_its_results(database):
+    _, rows = courses.find_courses(SEARCH)
+    old_pool = courses.get_pool(database)
+    conn = sqlite3.connect(database)
+    conn.execute("DELETE FROM courses WHERE course_num = ?", (rows[0][1],))
+    conn.commit()
+    conn.close()
+    # a write within the same clock tick would keep the modification time
+    stat = os.stat(database)
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    _, new_rows = courses.find_courses(SEARCH)
+    assert courses.RESULT_CACHE.info()["invalidations"] == 1
+    assert new_rows and len(new_rows) < len(rows)
+    assert all(row[1] != rows[0][1] for row in new_rows)
+    # the connections that read the old tables are not reused
+    assert courses.get_pool(database) is not old_pool
+
+
+def test_a_query_overtaken_by_a_write_is_not_cached(database, monkeypatch):
+    build_query = courses.build_query
+
+    def build_query_during_a_write(*args):
+        # another query sees the database change before this one is done
+        courses.RESULT_CACHE.changed(database, ("written", 0))
+        return build_query(*args)
+
+    monkeypatch.setattr(courses, "build_query", build_query_during_a_write)
+    _, rows = courses.find_courses(SEARCH)
+    assert rows
+    assert courses.RESULT_CACHE.info()["cached"] == 0
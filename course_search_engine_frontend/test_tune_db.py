@@ -0,0 +1,114 @@
+'''
+Tests for the course database tuning tool
+'''
+
+import json
+import os
+import sqlite3
+
+import pytest
+
+# pylint: disable= redefined-outer-name, protected-access
+
+import courses
+import tune_db
+
+TEST_DIR = os.path.dirname(__file__)
+TESTS = json.load(open(os.path.join(TEST_DIR, 'find_courses_tests.json')))
+
+
+@pytest.fixture(scope="module")
+def tuned(tmp_path_factory):
+    '''
+    A tuned copy of the course database, and the changes made to it.
+    '''
+    filename = str(tmp_path_factory.mktemp("tuned") / "tuned.sqlite3")
+    version = courses.database_version(tune_db.SOURCE_FILENAME)
+    changes = tune_db.build(filename)
+    # the original is only read
+    assert courses.database_version(tune_db.SOURCE_FILENAME) == version
+    yield filename, changes
+    courses.reset_pool(filename)
+
+
+def test_build_migrates_to_the_schema_version(tuned):
+    filename, changes = tuned
+    assert "catalog_index clustered on (word, course_id)" in changes
+    conn = sqlite3.connect(filename)
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    assert version == tune_db.SCHEMA_VERSION
+    names = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(tune_db.INDEXES) <= names
+    (buildings,) = conn.execute("SELECT COUNT(*) FROM gps").fetchone()
+    (pairs,) = conn.execute("SELECT COUNT(*) FROM walking_times").fetchone()
+    assert pairs == buildings ** 2
+    conn.close()
+    # a tuned database has nothing left to do
+    assert tune_db.tune(filename) == []
+
+
+def test_walking_times_are_compute_time_between(tuned):
+    conn = sqlite3.connect(tuned[0])
+    rows = conn.execute(
+        "SELECT minutes, a.lon, a.lat, b.lon, b.lat FROM walking_times"
+        " JOIN gps AS a ON a.building_code = src"
+        " JOIN gps AS b ON b.building_code = dst").fetchall()
+    conn.close()
+    assert rows
+    assert all(minutes == courses.compute_time_between(*coordinates)
+               for minutes, *coordinates in rows)
+
+
+def test_tables_keep_their_rows(tuned):
+    source = sqlite3.connect(tune_db.SOURCE_FILENAME)
+    conn = sqlite3.connect(tuned[0])
+    for table in ("catalog_index", "gps", "courses", "sections"):
+        query = "SELECT * FROM {}".format(table)
+        assert sorted(conn.execute(query)) == sorted(source.execute(query))
+    conn.close()
+    source.close()
+
+
+@pytest.mark.parametrize("t", [t for t in TESTS if t["input"]],
+                         ids=lambda t: str(t["test_num"]))
+def test_find_courses_on_the_tuned_database(tuned, monkeypatch, t):
+    monkeypatch.setattr(courses, "DATABASE_FILENAME", tuned[0])
+    monkeypatch.setattr(courses, "RESULT_CACHE", courses.ResultCache())
+    with courses.pooled_connection(tuned[0]) as (pool, _):
+        assert courses.walking_source(pool, t["input"]) == courses.WALKING_TABLE
+    header, rows = courses.find_courses(t["input"])
+    assert header == t["expected"][0]
+    assert {tuple(row) for row in rows} == \
+        {tuple(row) for row in t["expected"][1]}
+
+
+def test_duplicate_keys_are_indexed_instead(tmp_path):
+    filename = str(tmp_path / "duplicates.sqlite3")
+    conn = sqlite3.connect(filename)
+    conn.execute("CREATE TABLE gps (building_code varchar(5), lon real,"
+                 " lat real)")
+    conn.executemany("INSERT INTO gps VALUES (?, ?, ?)",
+                     [("RY", -87.6, 41.79), ("RY", -87.6, 41.8)])
+    conn.execute("CREATE TABLE catalog_index (course_id integer,"
+                 " word varchar(20))")
+    conn.executemany("INSERT INTO catalog_index VALUES (?, ?)",
+                     [(1, "theory"), (2, "theory")])
+    for table, columns in (("courses", "course_id, dept, course_num, title"),
+                           ("sections", "course_id, section_id, section_num,"
+                            " meeting_pattern_id, building_code, enrollment"),
+                           ("meeting_patterns", "meeting_pattern_id, day,"
+                            " time_start, time_end")):
+        conn.execute("CREATE TABLE {} ({})".format(table, columns))
+    conn.commit()
+    conn.close()
+
+    changes = tune_db.tune(filename)
+    assert "catalog_index clustered on (word, course_id)" in changes
+    assert "gps indexed on (building_code), the key is not unique" in changes
+    assert "walking_times not built, building codes are not unique" in changes
+    conn = sqlite3.connect(filename)
+    assert conn.execute("SELECT COUNT(*) FROM gps").fetchone() == (2,)
+    assert conn.execute("SELECT name FROM sqlite_master"
+                        " WHERE name = 'walking_times'").fetchone() is None
+    conn.close()
@@ -0,0 +1,76 @@
+'''
+Tests for the walking times of find_courses, with and without NumPy
+'''
+
+import sqlite3
+
+import pytest
+
+# pylint: disable= redefined-outer-name
+
+import courses
+
+WALKING_SEARCHES = [
+    {"walking_time": 2, "building_code": "RY"},
+    {"walking_time": 5, "building_code": "RY", "day": ["MWF"]},
+    {"walking_time": 0, "building_code": "SS", "enrollment": [10, 40]},
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def numpy_or_not(request, monkeypatch):
+    '''
+    Run the test with NumPy, then as if it were not installed.
+    '''
+    if request.param == "python":
+        monkeypatch.setattr(courses, "np", None)
+    # results cached by one mode must not answer the other
+    monkeypatch.setattr(courses, "RESULT_CACHE", courses.ResultCache())
+    return request.param
+
+
+@pytest.fixture(scope="module")
+def buildings():
+    conn = sqlite3.connect(courses.DATABASE_FILENAME)
+    rows = conn.execute("SELECT lon, lat FROM gps").fetchall()
+    conn.close()
+    return rows
+
+
+def test_times_between_match_compute_time_between(numpy_or_not, buildings):
+    pairs = [(src, dst) for src in buildings for dst in buildings]
+    lon1, lat1 = zip(*[src for src, _ in pairs])
+    lon2, lat2 = zip(*[dst for _, dst in pairs])
+    assert courses.compute_times_between(lon1, lat1, lon2, lat2) == \
+        [courses.compute_time_between(*src, *dst) for src, dst in pairs]
+    assert courses.compute_times_between([], [], [], []) == []
+
+
+def test_whole_minutes_are_not_rounded_up(numpy_or_not):
+    # 66 meters due north is exactly one minute's walk
+    lat = 66 / (6367 * 1000) * 180 / 3.141592653589793
+    assert courses.compute_times_between([0.0, 0.0], [0.0, 0.0],
+                                         [0.0, 0.0], [0.0, lat]) == \
+        [0, courses.compute_time_between(0.0, 0.0, 0.0, lat)]
+
+
+def test_walking_source(numpy_or_not):
+    with courses.pooled_connection() as (pool, _):
+        coordinates = courses.walking_source(pool, {"walking_time": 2})
+        narrowed = courses.walking_source(pool, {"walking_time": 2,
+                                                 "dept": "CMSC"})
+    assert coordinates == (courses.WALKING_COORDINATES
+                           if numpy_or_not == "numpy" else courses.WALKING_UDF)
+    assert narrowed == courses.WALKING_UDF
+
+
+@pytest.mark.parametrize("args", WALKING_SEARCHES)
+def test_find_courses_matches_sqlite(numpy_or_not, args, monkeypatch):
+    header, rows = courses.find_courses(args)
+    # compute_time_between called by SQLite on every row
+    monkeypatch.setattr(courses, "walking_source",
+                        lambda pool, args: courses.WALKING_UDF)
+    monkeypatch.setattr(courses, "RESULT_CACHE", courses.ResultCache())
+    expected_header, expected_rows = courses.find_courses(args)
+    assert header == expected_header
+    assert rows and sorted(rows) == sorted(expected_rows)
@@ -0,0 +1,206 @@
+'''
+Course search engine: database tuning
+
+course_information.sqlite3 has no keys or indexes, so every join that
+courses.compute_join emits scans its tables. This tool migrates a copy of
+it (the original is only ever read) to:
+
+  - catalog_index and gps as WITHOUT ROWID tables clustered on their keys,
+    (word, course_id) and building_code, when those are unique
+  - covering indexes for the other joins and filters (INDEXES)
+  - a walking_times(src, dst, minutes) table holding compute_time_between
+    for every pair of buildings in gps, which find_courses joins instead
+    of calling compute_time_between on every row
+  - ANALYZE statistics for the query planner
+
+The original tables keep their columns, so find_courses returns the same
+rows from a tuned database:
+
+    python3 tune_db.py build course_information.tuned.sqlite3
+    COURSES_DATABASE=course_information.tuned.sqlite3 python3 manage.py runserver
+
+    python3 tune_db.py migrate <database>   (tunes it in place)
+'''
+
+from urllib.request import pathname2url
+import argparse
+import sqlite3
+import os
+
+import courses
+
+SOURCE_FILENAME = os.path.join(courses.DATA_DIR, 'course_information.sqlite3')
+
+# table: its key, the order its rows are clustered in WITHOUT ROWID
+CLUSTERED_TABLES = {
+    "catalog_index": ("word", "course_id"),
+    "gps": ("building_code",),
+}
+
+INDEXES = {
+    "courses_course_id": "courses (course_id, dept, course_num, title)",
+    "courses_dept": "courses (dept, course_id)",
+    "sections_course_id": "sections (course_id, section_id, section_num,"
+                          " meeting_pattern_id, building_code, enrollment)",
+    "sections_meeting_pattern_id": "sections (meeting_pattern_id)",
+    "meeting_patterns_id": "meeting_patterns (meeting_pattern_id, day,"
+                           " time_start, time_end)",
+    "catalog_index_course_id": "catalog_index (course_id, word)",
+}
+
+
+def is_unique(conn, table, columns):
+    """
+    whether no two rows of table agree on columns (and none is NULL)
+    """
+    cols = ", ".join(columns)
+    nulls = " OR ".join("{} IS NULL".format(col) for col in columns)
+    (rows,) = conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()
+    (distinct,) = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT DISTINCT {} FROM {} WHERE NOT ({}))"
+        .format(cols, table, nulls)).fetchone()
+    return rows == distinct
+
+
+def cluster_table(conn, table, key):
+    """
+    rebuild table as a WITHOUT ROWID table with primary key key, keeping
+    its column definitions
+
+    returns False (leaving the table alone) when key is not unique
+    """
+    if not is_unique(conn, table, key):
+        return False
+    (sql,) = conn.execute("SELECT sql FROM sqlite_master"
+                          " WHERE type = 'table' AND name = ?",
+                          (table,)).fetchone()
+    # the column list may end in a -- comment, so the key goes on a line
+    # of its own
+    body = sql.rstrip()[:-1].replace(table, table + "_clustered", 1)
+    conn.execute("{}\n    , PRIMARY KEY ({})\n) WITHOUT ROWID".format(
+        body, ", ".join(key)))
+    conn.execute("INSERT INTO {0}_clustered SELECT * FROM {0}".format(table))
+    conn.execute("DROP TABLE {}".format(table))
+    conn.execute("ALTER TABLE {0}_clustered RENAME TO {0}".format(table))
+    return True
+
+
+def add_keys(conn):
+    """
+    migration 1: cluster the CLUSTERED_TABLES and add the INDEXES
+    """
+    changes = []
+    for table, key in CLUSTERED_TABLES.items():
+        if cluster_table(conn, table, key):
+            changes.append("{} clustered on ({})".format(table, ", ".join(key)))
+        else:
+            # keep the rows, duplicates included, behind an index
+            conn.execute("CREATE INDEX IF NOT EXISTS {0}_key ON {0} ({1})"
+                         .format(table, ", ".join(key)))
+            changes.append("{} indexed on ({}), the key is not unique"
+                           .format(table, ", ".join(key)))
+    for name, columns in INDEXES.items():
+        conn.execute("CREATE INDEX IF NOT EXISTS {} ON {}".format(name, columns))
+        changes.append("index " + name)
+    return changes
+
+
+def add_walking_times(conn):
+    """
+    migration 2: precompute the walking time between every two buildings
+    """
+    if not is_unique(conn, "gps", ("building_code",)):
+        # a building with two locations has two times, which the gps join
+        # of compute_join returns as two rows; keep computing them
+        return ["walking_times not built, building codes are not unique"]
+    conn.execute("""CREATE TABLE walking_times
+(
+    src varchar(5),     -- building walked from
+    dst varchar(5),     -- building walked to
+    minutes integer,    -- compute_time_between the two
+    PRIMARY KEY (src, dst)
+) WITHOUT ROWID""")
+    buildings = conn.execute("SELECT building_code, lon, lat FROM gps").fetchall()
+    pairs = [(src, dst) for src in buildings for dst in buildings]
+    # the whole matrix in one vectorized call
+    minutes = courses.compute_times_between(
+        [src[1] for src, _ in pairs], [src[2] for src, _ in pairs],
+        [dst[1] for _, dst in pairs], [dst[2] for _, dst in pairs])
+    conn.executemany("INSERT INTO walking_times VALUES (?, ?, ?)",
+                     [(src[0], dst[0], mins)
+                      for (src, dst), mins in zip(pairs, minutes)])
+    return ["walking_times for {} pairs of buildings".format(len(pairs))]
+
+
+# (PRAGMA user_version after it, migration), in order
+MIGRATIONS = (
+    (1, add_keys),
+    (2, add_walking_times),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def tune(filename):
+    """
+    migrate the database filename in place, applying the MIGRATIONS it
+    has not had yet
+
+    returns the list of the changes made
+    """
+    conn = sqlite3.connect(filename, isolation_level=None)
+    try:
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        pending = [migrate for after, migrate in MIGRATIONS if after > version]
+        if not pending:
+            return []
+        changes = []
+        conn.execute("BEGIN")
+        for migrate in pending:
+            changes.extend(migrate(conn))
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        conn.execute("COMMIT")
+        # the rebuilt tables leave free pages behind
+        conn.execute("VACUUM")
+        return changes
+    finally:
+        conn.close()
+
+
+def build(output, source=SOURCE_FILENAME):
+    """
+    write a tuned copy of the database source to output
+
+    returns the list of the changes made
+    """
+    if os.path.exists(output):
+        os.remove(output)
+    src = sqlite3.connect("file:{}?mode=ro".format(
+        pathname2url(os.path.abspath(source))), uri=True)
+    dst = sqlite3.connect(output)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return tune(output)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python3 tune_db.py")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="write a tuned copy of"
+                                       " the course database")
+    build_parser.add_argument("output")
+    build_parser.add_argument("--source", default=SOURCE_FILENAME)
+    migrate_parser = commands.add_parser("migrate", help="tune a database in"
+                                         " place")
+    migrate_parser.add_argument("database")
+    args = arg_parser.parse_args()
+
+    if args.command == "build":
+        done = build(args.output, args.source)
+    else:
+        done = tune(args.database)
+    for change in done or ["already at schema version {}".format(SCHEMA_VERSION)]:
+        print(change)